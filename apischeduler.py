@@ -0,0 +1,188 @@
+"""
+Paces calls to the GitHub api to keep within its rate limits.
+
+GitHub has a primary rate limit - a quota of requests per hour, reported
+in the X-RateLimit-* headers of every response - and secondary limits on
+how quickly requests (particularly writes) are made.  ApiScheduler makes
+each call wait for a token from a token bucket and spaces out writes.
+Once the remaining quota runs low it slows down so what is left lasts
+until it is reset (and waits for the reset if it runs out).  If a limit
+is hit anyway it waits as long as GitHub asks (the Retry-After header)
+and tries again.
+"""
+
+# Core modules
+import itertools
+import logging
+import threading
+import time
+
+# Local imports
+import util
+
+# 3rd part imports (imported on first use, see util.lazy_import)
+github = util.lazy_import('github')
+
+logger = logging.getLogger(__name__)
+
+# How long to wait after a rate limit error that doesn't say (GitHub's
+# advice is at least a minute)
+_DEFAULT_RETRY_DELAY = 60
+
+class ApiScheduler:
+    """
+    Central scheduler for GitHub api calls, safe to share between
+    threads.
+    """
+    def __init__(
+        self, rate=5.0, burst=10, write_interval=1.0, max_retries=5,
+        quota=None, low_water=0.1, clock=time.time, sleep=time.sleep
+    ):
+        """
+        args:
+            rate: average number of calls per second to allow
+            burst: number of calls allowed at once after a lull
+            write_interval: minimum number of seconds between writes
+            max_retries: number of times to retry a call that hit a rate
+                limit before giving up
+            quota: function returning the api quota as a tuple of
+                ((remaining, limit), reset time) - as the rate_limiting and
+                rate_limiting_resettime of a github.Requester, so
+                remaining and limit are -1 until known
+            low_water: fraction of the quota below which calls are
+                slowed down so the rest lasts until the reset - above it
+                only rate and burst limit the calls
+            clock: function returning the time (as time.time) - for
+                testing
+            sleep: function to wait a number of seconds - for testing
+        """
+        self.rate = rate
+        self.burst = burst
+        self.write_interval = write_interval
+        self.max_retries = max_retries
+        self._quota = quota
+        self.low_water = low_water
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._tokens = burst
+        self._updated = clock()
+        self._next_write = 0
+        # Quota as last reported by GitHub (None until known)
+        self.remaining = None
+        self.limit = None
+        self.reset = None
+        # For the log at the end of the run
+        self.calls = 0
+        self.waited = 0.0
+
+    def _current_rate(self, now):
+        # Once the quota runs low, spread what is left of it over the
+        # time until it resets
+        if self.remaining is None or self.remaining <= 0 or (
+            self.remaining > self.low_water * self.limit
+        ):
+            return self.rate
+        return min(self.rate, self.remaining / max(self.reset - now, 1))
+
+    def _wait_for_turn(self, write):
+        with self._lock:
+            now = self._clock()
+            rate = self._current_rate(now)
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated) * rate
+            )
+            self._updated = now
+            # Take a token even if there isn't one, the wait is how long
+            # until there will be
+            self._tokens -= 1
+            wait = -self._tokens / rate if self._tokens < 0 else 0
+            if self.remaining is not None and self.remaining <= 0:
+                wait = max(wait, self.reset - now)
+            if write:
+                wait = max(wait, self._next_write - now)
+                self._next_write = now + wait + self.write_interval
+            self.calls += 1
+            self.waited += wait
+        if wait > 0:
+            logger.debug("Waiting %.2fs before next GitHub api call", wait)
+            self._sleep(wait)
+
+    def _update_quota(self):
+        if self._quota is None:
+            return
+        ((remaining, limit), reset) = self._quota()
+        if limit < 0:
+            # Not reported yet
+            return
+        with self._lock:
+            previous = self.remaining
+            (self.remaining, self.limit, self.reset) = (
+                remaining, limit, reset
+            )
+        # Log each time another tenth of the quota has gone
+        step = max(limit // 10, 1)
+        if previous is not None and remaining // step < previous // step:
+            logger.info("GitHub api budget: %s", self.budget())
+
+    def _retry_delay(self, error):
+        # Seconds to wait before retrying after error, or None if it is
+        # not a rate limit error
+        if error.status not in (403, 429):
+            return None
+        headers = error.headers or {}
+        if 'retry-after' in headers:
+            return int(headers['retry-after'])
+        elif headers.get('x-ratelimit-remaining') == '0':
+            reset = int(headers.get('x-ratelimit-reset', 0))
+            return max(reset - self._clock(), 1)
+        elif error.status == 429 or isinstance(
+            error, github.RateLimitExceededException
+        ):
+            return _DEFAULT_RETRY_DELAY
+        return None
+
+    def call(self, function, *args, write=False, **kwargs):
+        """
+        Makes a GitHub api call when the rate limits allow, retrying if
+        it hits a rate limit anyway.
+
+        args:
+            function: function making the call (a single api request)
+            args: arguments for function
+            write: is the call a write (anything other than a GET)?
+            kwargs: keyword arguments for function
+
+        returns:
+            value returned by function
+        """
+        for attempt in itertools.count(1):
+            self._wait_for_turn(write)
+            try:
+                result = function(*args, **kwargs)
+            except github.GithubException as error:
+                self._update_quota()
+                delay = self._retry_delay(error)
+                if delay is None or attempt > self.max_retries:
+                    raise
+                logger.warning(
+                    "Hit a GitHub rate limit (%s), retrying in %ds"
+                    " (attempt %d of %d)",
+                    error.status, delay, attempt, self.max_retries
+                )
+                with self._lock:
+                    self.waited += delay
+                self._sleep(delay)
+                continue
+            self._update_quota()
+            return result
+
+    def budget(self):
+        """
+        Returns a description of the quota left, for logging.
+        """
+        if self.remaining is None:
+            return "not known yet"
+        return "%d of %d requests left, resets at %s" % (
+            self.remaining, self.limit, time.ctime(self.reset)
+        )
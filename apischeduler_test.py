@@ -0,0 +1,114 @@
+import unittest
+
+import github
+
+import apischeduler
+
+class FakeClock:
+    """
+    Clock that only moves when slept on.
+    """
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class ApiSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.quota = ((-1, -1), 0)
+
+    def _scheduler(self, **kwargs):
+        return apischeduler.ApiScheduler(
+            quota=lambda: self.quota, clock=self.clock.time,
+            sleep=self.clock.sleep, **kwargs
+        )
+
+    def test_token_bucket(self):
+        scheduler = self._scheduler(rate=2, burst=3, write_interval=0)
+        for _ in range(5):
+            self.assertEqual(scheduler.call(lambda: 'result'), 'result')
+        # The burst goes straight through, then one every half a second
+        self.assertEqual(self.clock.sleeps, [0.5, 0.5])
+        self.assertEqual(scheduler.calls, 5)
+        self.assertEqual(scheduler.waited, 1.0)
+
+    def test_writes_spaced_out(self):
+        scheduler = self._scheduler(rate=100, burst=100, write_interval=1)
+        scheduler.call(lambda: None, write=True)
+        scheduler.call(lambda: None)
+        scheduler.call(lambda: None, write=True)
+        self.assertEqual(self.clock.sleeps, [1])
+
+    def test_quota(self):
+        scheduler = self._scheduler(rate=100, burst=1)
+        self.quota = ((10, 5000), self.clock.now + 100)
+        scheduler.call(lambda: None)
+        self.assertEqual(scheduler.budget()[:24], "10 of 5000 requests left")
+        # 10 requests left for 100s - slows to one every 10s
+        scheduler.call(lambda: None)
+        self.assertEqual(self.clock.sleeps, [10])
+
+        # Nothing left (as reported by the last call), wait for the reset
+        reset = self.clock.now + 50
+        self.quota = ((0, 5000), reset)
+        scheduler.call(lambda: None)
+        self.quota = ((4999, 5000), reset + 3600)
+        scheduler.call(lambda: None)
+        self.assertEqual(self.clock.now, reset)
+
+    def test_plenty_of_quota(self):
+        # A fresh token's quota is not spread over the hour, the calls go
+        # as fast as rate and burst allow
+        scheduler = self._scheduler(rate=5, burst=10, write_interval=0)
+        self.quota = ((5000, 5000), self.clock.now + 3600)
+        for _ in range(60):
+            scheduler.call(lambda: None)
+        self.assertAlmostEqual(sum(self.clock.sleeps), 10)
+
+    def test_retry_after(self):
+        attempts = []
+        def limited():
+            attempts.append(self.clock.now)
+            if len(attempts) < 3:
+                raise github.RateLimitExceededException(
+                    403, {'message': 'secondary rate limit'},
+                    {'retry-after': '30'}
+                )
+            return 'result'
+
+        scheduler = self._scheduler(rate=100)
+        with self.assertLogs(apischeduler.logger, 'WARNING'):
+            self.assertEqual(scheduler.call(limited), 'result')
+        self.assertEqual(self.clock.sleeps, [30, 30])
+
+    def test_gives_up(self):
+        def limited():
+            raise github.GithubException(
+                429, {'message': 'Too many requests'}, {}
+            )
+
+        scheduler = self._scheduler(max_retries=2)
+        with self.assertLogs(apischeduler.logger, 'WARNING'):
+            with self.assertRaises(github.GithubException):
+                scheduler.call(limited)
+        self.assertEqual(self.clock.sleeps, [60, 60])
+
+    def test_other_errors_not_retried(self):
+        calls = []
+        def forbidden():
+            calls.append(None)
+            raise github.GithubException(
+                403, {'message': 'Must have admin rights'}, {}
+            )
+
+        with self.assertRaises(github.GithubException):
+            self._scheduler().call(forbidden)
+        self.assertEqual(len(calls), 1)
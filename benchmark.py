@@ -0,0 +1,625 @@
+#!/usr/bin/env python
+"""
+Benchmarks for freeze.py.
+
+Run all of them with:
+
+    python benchmark.py
+
+or name the ones to run (see --help for the list).
+
+To check a change doesn't make anything slower, save a baseline before
+making it and compare with it afterwards (on the same machine):
+
+    python benchmark.py --save-baseline baseline.json
+    python benchmark.py --baseline baseline.json
+"""
+
+# Core modules
+import argparse
+import collections
+import contextlib
+import datetime
+import importlib
+import itertools
+import json
+import logging
+import os
+import os.path
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import unittest.mock
+import urllib.parse
+
+# 3rd part imports
+import git
+
+# Local imports
+import fakegithub
+import freeze
+
+logger = logging.getLogger(__name__)
+
+# Mapping of benchmark name to function, filled by @benchmark
+benchmarks = {}
+
+def benchmark(function):
+    """
+    Decorator registering a benchmark.  Benchmark functions take their
+    size parameters as keyword arguments (so tests can run them small)
+    and return a list of (description, value) results.
+    """
+    benchmarks[function.__name__] = function
+    return function
+
+def best_time(function, *args, repeat=3):
+    """
+    Times function, returning the fastest of repeat runs in seconds.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def _generate_schedule(lines, urls):
+    """
+    Generates a schedule of lines lines linking to urls lesson urls, and
+    the mapping of each url to its frozen url.
+    """
+    lessons = [
+        'https://org.github.io/lesson-%d' % lesson for lesson in range(urls)
+    ]
+    schedule = [
+        '<tr><td>%d:00</td><td><a href="%s">Lesson %d</a></td></tr>\n' % (
+            line % 24, lessons[line % urls], line
+        )
+        for line in range(lines)
+    ]
+    frozen_urls = {
+        lesson: lesson.replace('/lesson', '/2000-01-01-bham_lesson')
+        for lesson in lessons
+    }
+    return (schedule, frozen_urls)
+
+def _rewrite_schedule_per_url(old_schedule, frozen_urls):
+    # How update_repo_links used to do it, for comparison
+    new_schedule = []
+    for line in old_schedule:
+        new_line = line
+        for (old_url, new_url) in frozen_urls.items():
+            new_line = new_line.replace(old_url, new_url)
+        new_schedule.append(new_line)
+    return new_schedule
+
+@benchmark
+def rewrite_schedule(lines=20000, url_counts=(10, 100, 1000, 5000)):
+    """
+    Rewriting the links in a large schedule (_rewrite_schedule) compared
+    with a replace per url per line (only up to 1000 urls, it is too slow
+    after that).
+    """
+    results = []
+    for urls in url_counts:
+        (schedule, frozen_urls) = _generate_schedule(lines, urls)
+        single_pass = best_time(
+            lambda: list(freeze._rewrite_schedule(schedule, frozen_urls))
+        )
+        results.append((
+            "%d lines, %d urls - single pass (s)" % (lines, urls),
+            single_pass
+        ))
+        if urls <= 1000:
+            per_url = best_time(
+                _rewrite_schedule_per_url, schedule, frozen_urls, repeat=1
+            )
+            results.append((
+                "%d lines, %d urls - replace per url (s)" % (lines, urls),
+                per_url
+            ))
+    return results
+
+def peak_memory(function, *args):
+    """
+    Runs function, returning the peak memory it allocated in bytes.
+    """
+    tracemalloc.start()
+    try:
+        function(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def _rewrite_file_in_memory(path, frozen_urls):
+    # How update_repo_links used to rewrite the schedule, for comparison
+    with open(path) as schedule_file:
+        schedule = schedule_file.readlines()
+    new_schedule = list(freeze._rewrite_schedule(schedule, frozen_urls))
+    with open(path, 'w') as schedule_file:
+        schedule_file.writelines(new_schedule)
+
+@benchmark
+def transform_file(line_counts=(1000, 10000, 100000)):
+    """
+    Peak memory rewriting a schedule file with _transform_file compared
+    with reading it all in and writing it back out.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tempdir:
+        path = os.path.join(tempdir, 'schedule.html')
+        for lines in line_counts:
+            (schedule, frozen_urls) = _generate_schedule(lines, 10)
+            with open(path, 'w') as schedule_file:
+                schedule_file.writelines(schedule)
+            del schedule
+            results.append((
+                "%d lines - streamed (bytes)" % lines,
+                peak_memory(
+                    freeze._transform_file, path,
+                    lambda old: freeze._rewrite_schedule(old, frozen_urls)
+                )
+            ))
+            results.append((
+                "%d lines - in memory (bytes)" % lines,
+                peak_memory(_rewrite_file_in_memory, path, frozen_urls)
+            ))
+    return results
+
+def _find_links_per_line(schedule):
+    # How get_repos_to_freeze used to find links, for comparison
+    links = []
+    link_re = re.compile(r'<a\s+(?:[^\s]+\s+)?href="(?P<url>[^"]+)"')
+    for line in schedule:
+        for match in link_re.finditer(line):
+            url = urllib.parse.urlparse(match.group('url').strip())
+            if url.netloc.endswith('.github.io'):
+                url = freeze._github_io_to_github_com(url)
+            links.append((match.group('url'), url.geturl()))
+    return links
+
+@benchmark
+def extract_links(line_counts=(1000, 10000, 100000), chunk_size=64 * 1024):
+    """
+    Finding the links in a large schedule with iter_schedule_links
+    (reading the schedule in chunks) compared with the regular
+    expression per line it replaced.
+    """
+    # Logging each github.io url converted would swamp the timings
+    level = freeze.logger.level
+    freeze.logger.setLevel(logging.WARNING)
+    try:
+        results = _extract_links(line_counts, chunk_size)
+    finally:
+        freeze.logger.setLevel(level)
+    return results
+
+def _extract_links(line_counts, chunk_size):
+    results = []
+    for lines in line_counts:
+        (schedule, _) = _generate_schedule(lines, 10)
+        text = ''.join(schedule)
+        chunks = [
+            text[start:start + chunk_size]
+            for start in range(0, len(text), chunk_size)
+        ]
+        results.append((
+            "%d lines - html tokeniser (s)" % lines,
+            best_time(lambda: list(freeze.iter_schedule_links(chunks)))
+        ))
+        results.append((
+            "%d lines - regular expression (s)" % lines,
+            best_time(_find_links_per_line, schedule)
+        ))
+    return results
+
+def _parse_dates_uncached(dates):
+    # How dates used to be parsed, for comparison
+    return [freeze.dateparser.parse(date).date() for date in dates]
+
+def _parse_dates(dates):
+    freeze._parse_date.cache_clear()
+    return [freeze._parse_date(date) for date in dates]
+
+@benchmark
+def parse_date(lessons=200, courses=10):
+    """
+    Parsing the date of each lesson's course (as freezing does) with
+    _parse_date compared with dateparser.
+    """
+    dates = [
+        '2000-01-%02d' % (lesson % courses + 1) for lesson in range(lessons)
+    ]
+    # Don't count importing dateparser
+    freeze.dateparser.parse(dates[0])
+    return [
+        (
+            "%d lessons, %d courses - _parse_date (s)" % (lessons, courses),
+            best_time(_parse_dates, dates)
+        ),
+        (
+            "%d lessons, %d courses - dateparser (s)" % (lessons, courses),
+            best_time(_parse_dates_uncached, dates)
+        ),
+    ]
+
+def _run_python(*args):
+    # Runs python (from this directory) with args, checking it succeeds
+    subprocess.run(
+        (sys.executable,) + args, check=True, stdout=subprocess.DEVNULL,
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+
+@benchmark
+def startup(repeat=3):
+    """
+    How long freeze.py takes to start up - to print its help, and to
+    import it and process a command line (with an ISO date, and with a
+    date only dateparser understands) - compared with importing the
+    third party modules it imports on first use.
+    """
+    process_commandline = (
+        'import freeze; freeze.process_commandline(["repo", %r])'
+    )
+    return [
+        (
+            "freeze.py --help (s)",
+            best_time(_run_python, 'freeze.py', '--help', repeat=repeat)
+        ),
+        (
+            "command line with ISO date (s)",
+            best_time(
+                _run_python, '-c', process_commandline % '2000-01-01',
+                repeat=repeat
+            )
+        ),
+        (
+            "command line with free-form date (s)",
+            best_time(
+                _run_python, '-c', process_commandline % '1 January 2000',
+                repeat=repeat
+            )
+        ),
+        (
+            "import dateparser, git and github (s)",
+            best_time(
+                _run_python, '-c', 'import dateparser, git, github',
+                repeat=repeat
+            )
+        ),
+    ]
+
+def _make_lesson(path, files, file_size, commits):
+    """
+    Makes a lesson repository (on gh-pages, like the real ones) of files
+    files of file_size random (so incompressible) bytes, each changed in
+    every one of commits commits.
+    """
+    work = git.Repo.init(path, initial_branch='gh-pages')
+    with work.config_writer() as config:
+        config.set_value('user', 'name', 'Benchmark')
+        config.set_value('user', 'email', 'benchmark@example.tld')
+    with open(os.path.join(path, 'index.md'), 'w') as index:
+        index.write("---\nlayout: lesson\n---\n")
+    names = ['index.md']
+    for commit in range(commits):
+        for number in range(files):
+            name = 'episode-%d.bin' % number
+            with open(os.path.join(path, name), 'wb') as episode:
+                episode.write(os.urandom(file_size))
+            names.append(name)
+        work.index.add(names)
+        work.index.commit("Version %d" % commit)
+
+def _make_course(path, lessons):
+    """
+    Makes a course repository with a schedule linking to the github.io
+    pages of each of lessons.
+    """
+    work = git.Repo.init(path, initial_branch='gh-pages')
+    with work.config_writer() as config:
+        config.set_value('user', 'name', 'Benchmark')
+        config.set_value('user', 'email', 'benchmark@example.tld')
+    schedule = os.path.join(path, freeze._get_schedule_file_relative_path())
+    os.makedirs(os.path.dirname(schedule))
+    with open(schedule, 'w') as schedule_file:
+        for lesson in lessons:
+            schedule_file.write(
+                '<p><a href="https://org.github.io/%s/">%s</a></p>\n'
+                % (lesson, lesson)
+            )
+    with open(os.path.join(path, 'index.md'), 'w') as index:
+        index.write("---\nlayout: workshop\n---\n")
+    work.index.add([freeze._get_schedule_file_relative_path(), 'index.md'])
+    work.index.commit("Schedule")
+
+def _directory_size(path):
+    # Total size of the files under path, in bytes
+    return sum(
+        os.path.getsize(os.path.join(directory, name))
+        for (directory, _, names) in os.walk(path)
+        for name in names
+    )
+
+class PhaseTimer:
+    """
+    Totals the time spent in (and calls to) functions of freeze, by
+    phase.  Phases can overlap (e.g. api calls are made while reading
+    the course) and times in background threads (e.g. the prefetcher)
+    are included.
+    """
+    def __init__(self, phases):
+        """
+        args:
+            phases: dict mapping phase name to the name of the function
+                in freeze that does it
+        """
+        self.phases = phases
+        self.times = collections.Counter()
+        self.calls = collections.Counter()
+        self._lock = threading.Lock()
+
+    def _timed(self, phase, function):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.times[phase] += time.perf_counter() - start
+                    self.calls[phase] += 1
+        return timed
+
+    def patch(self, stack):
+        """
+        Replaces the functions with timed versions until stack (a
+        contextlib.ExitStack) is closed.
+        """
+        for (phase, name) in self.phases.items():
+            stack.enter_context(unittest.mock.patch.object(
+                freeze, name, self._timed(phase, getattr(freeze, name))
+            ))
+
+# Phases of a freeze timed by end_to_end
+_PHASES = {
+    'read courses': '_read_course',
+    'freeze lessons': 'freeze_all',
+    'update courses': '_update_course',
+    'fetch lessons': '_fetch_bare',
+    'push': '_push',
+    'api calls': '_github_api',
+}
+
+def _freeze_end_to_end(
+    root, lessons, files, file_size, commits, jobs, prefetch
+):
+    # Freezes a course of lessons lessons against a fake GitHub in root
+    # (with GitHub's quota, so any pacing of the api calls counts), with
+    # the jobs and prefetch settings, returning (wall time, PhaseTimer,
+    # bytes pushed, api calls)
+    fake = fakegithub.FakeGithub(os.path.join(root, 'github'))
+    names = ['lesson-%d' % lesson for lesson in range(lessons)]
+    for name in names:
+        source = os.path.join(root, 'sources', name)
+        _make_lesson(source, files, file_size, commits)
+        fake.add_repo('org', name, source=source, default_branch='gh-pages')
+    course = '2000-01-03-bham'
+    source = os.path.join(root, 'sources', course)
+    _make_course(source, names)
+    fake.add_repo(
+        'org', course, source=source, default_branch='gh-pages',
+        homepage='https://org.github.io/%s' % course
+    )
+
+    importlib.reload(freeze)
+    timer = PhaseTimer(_PHASES)
+    with fake, contextlib.ExitStack() as stack:
+        freeze.settings = {
+            'github': {
+                'accesstoken': '12345',
+                'baseurl': fake.base_url,
+                # No slower than the api allows
+                'requestrate': '1000',
+                'writeinterval': '0',
+            }
+        }
+        freeze.repository = 'https://github.com/org/%s' % course
+        freeze.freeze_date = datetime.date(2000, 1, 1)
+        freeze.jobs = jobs
+        freeze.prefetch = prefetch
+        freeze.journal_file = os.path.join(root, 'journal.jsonl')
+        stack.enter_context(unittest.mock.patch.dict(
+            os.environ,
+            fake.git_environment(
+                ('https://github.com/', 'https://12345@github.com/')
+            )
+        ))
+        stack.callback(importlib.reload, freeze)
+        timer.patch(stack)
+        start = time.perf_counter()
+        freeze.do_freeze(freeze.repository)
+        wall_time = time.perf_counter() - start
+    pushed = sum(
+        _directory_size(fake.repo_path('org', '2000-01-01-bham_' + name))
+        for name in names
+    )
+    return (wall_time, timer, pushed, len(fake.requests))
+
+@benchmark
+def end_to_end(
+    lesson_counts=(1, 5, 20), settings=((1, 0), (1, 1), (4, 1)), files=10,
+    file_size=16 * 1024, commits=3
+):
+    """
+    Freezing a whole course (do_freeze) against a fake GitHub api with
+    local (file://) repositories, for courses of different numbers of
+    lessons, each of files files of file_size bytes changed in commits
+    commits, with each of settings - tuples of (--jobs, --prefetch).
+    Reports the wall time, the time in each phase (see _PHASES), the
+    size of the frozen repositories pushed and the number of api calls.
+    """
+    # Logging every step would swamp the timings
+    level = freeze.logger.level
+    freeze.logger.setLevel(logging.WARNING)
+    results = []
+    try:
+        for (lessons, (jobs, prefetch)) in itertools.product(
+            lesson_counts, settings
+        ):
+            with tempfile.TemporaryDirectory() as root:
+                (wall_time, timer, pushed, api_calls) = _freeze_end_to_end(
+                    root, lessons, files, file_size, commits, jobs, prefetch
+                )
+            label = "%d lessons, %d jobs, prefetch %d" % (
+                lessons, jobs, prefetch
+            )
+            results.append(("%s - wall time (s)" % label, wall_time))
+            results.extend(
+                ("%s - %s (s)" % (label, phase), timer.times[phase])
+                for phase in _PHASES
+            )
+            results.append(("%s - bytes pushed" % label, pushed))
+            results.append(("%s - api calls" % label, api_calls))
+    finally:
+        freeze.logger.setLevel(level)
+    return results
+
+def run(names=None):
+    """
+    Runs the named benchmarks (all of them if names is None).
+
+    returns:
+        dict mapping benchmark name to its list of results
+    """
+    results = {}
+    for name in (names or benchmarks):
+        logger.info("Running benchmark %s", name)
+        results[name] = benchmarks[name]()
+    return results
+
+# Differences from a baseline smaller than this (a millisecond, for
+# timings) are noise, never regressions
+_NOISE = 0.001
+
+def save_baseline(results, path):
+    """
+    Saves results (as returned by run) to path as JSON, to compare later
+    runs against.
+    """
+    with open(path, 'w') as baseline_file:
+        json.dump(
+            {name: dict(values) for (name, values) in results.items()},
+            baseline_file, indent=2, sort_keys=True
+        )
+        baseline_file.write('\n')
+
+def load_baseline(path):
+    """
+    Loads results saved by save_baseline.
+
+    returns:
+        dict mapping benchmark name to dict of description to value
+    """
+    with open(path) as baseline_file:
+        return json.load(baseline_file)
+
+def is_regression(value, baseline_value, tolerance):
+    """
+    Is value worse than baseline_value by more than the fraction
+    tolerance?  Every result is a cost (time, memory, bytes or calls),
+    so bigger is worse.
+    """
+    return (
+        value - baseline_value > _NOISE
+        and value > baseline_value * (1 + tolerance)
+    )
+
+def _format_value(value):
+    if isinstance(value, int):
+        return "%12d" % value
+    return "%12.6f" % value
+
+def main(args_list=None):
+    """
+    Runs the benchmarks named on the command line and prints the results.
+
+    args:
+        args_list: Override using the real command line arguments with
+                   this list.  Intended for testing.
+    """
+    parser = argparse.ArgumentParser(description='Benchmarks for freeze.py.')
+    parser.add_argument(
+        'names',
+        nargs='*',
+        help='Benchmarks to run (defaults to all of them): %s' % ', '.join(
+            sorted(benchmarks)
+        )
+    )
+    parser.add_argument(
+        '--save-baseline',
+        dest='save_baseline',
+        metavar='FILE',
+        help='Save the results to FILE, for later runs to be compared with'
+             ' (see --baseline).'
+    )
+    parser.add_argument(
+        '--baseline',
+        dest='baseline',
+        metavar='FILE',
+        help='Compare the results with those saved in FILE by'
+             ' --save-baseline, exiting with status 1 if any are worse by'
+             ' more than --tolerance.  Baselines are only meaningful on the'
+             ' machine they were saved on.'
+    )
+    parser.add_argument(
+        '--tolerance',
+        dest='tolerance',
+        type=float,
+        default=0.25,
+        help='Fraction a result can be worse than the baseline by before it'
+             ' counts as a regression (defaults to 0.25).'
+    )
+    args = parser.parse_args(args_list)
+    unknown = set(args.names) - set(benchmarks)
+    if unknown:
+        parser.error("Unknown benchmarks: %s" % ', '.join(sorted(unknown)))
+    logging.basicConfig(
+        level=logging.INFO, format="[%(levelname)7s] %(message)s"
+    )
+    baseline = load_baseline(args.baseline) if args.baseline else {}
+
+    all_results = run(args.names)
+    regressions = 0
+    for (name, results) in all_results.items():
+        print(name)
+        for (description, value) in results:
+            line = "    %-50s %s" % (description, _format_value(value))
+            baseline_value = baseline.get(name, {}).get(description)
+            if baseline_value is not None:
+                line += " %s" % _format_value(baseline_value)
+                if baseline_value:
+                    line += " %+7.1f%%" % (
+                        100.0 * (value - baseline_value) / baseline_value
+                    )
+                if is_regression(value, baseline_value, args.tolerance):
+                    line += "  REGRESSION"
+                    regressions += 1
+            print(line)
+
+    if args.save_baseline:
+        save_baseline(all_results, args.save_baseline)
+        logger.info("Saved results as baseline in %s", args.save_baseline)
+    if regressions:
+        logger.error(
+            "%d results worse than the baseline by more than %d%%",
+            regressions, 100 * args.tolerance
+        )
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
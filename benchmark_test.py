@@ -0,0 +1,107 @@
+import contextlib
+import io
+import json
+import os.path
+import tempfile
+import unittest
+
+import benchmark
+
+class BenchmarkTest(unittest.TestCase):
+    def test_rewrite_schedule(self):
+        results = benchmark.rewrite_schedule(lines=10, url_counts=(3,))
+        self.assertEqual(len(results), 2)
+        for (description, value) in results:
+            self.assertGreaterEqual(value, 0, msg=description)
+
+    def test_rewrite_schedule_agrees(self):
+        # Without overlapping urls both ways must give the same answer
+        (schedule, frozen_urls) = benchmark._generate_schedule(50, 7)
+        self.assertEqual(
+            list(benchmark.freeze._rewrite_schedule(schedule, frozen_urls)),
+            benchmark._rewrite_schedule_per_url(schedule, frozen_urls)
+        )
+
+    def test_transform_file(self):
+        results = benchmark.transform_file(line_counts=(10, 100))
+        self.assertEqual(len(results), 4)
+        for (description, value) in results:
+            self.assertGreater(value, 0, msg=description)
+
+    def test_extract_links(self):
+        results = benchmark.extract_links(line_counts=(20,), chunk_size=100)
+        self.assertEqual(len(results), 2)
+
+    def test_extract_links_agrees(self):
+        (schedule, _) = benchmark._generate_schedule(50, 7)
+        self.assertEqual(
+            list(benchmark.freeze.iter_schedule_links(schedule)),
+            benchmark._find_links_per_line(schedule)
+        )
+
+    def test_parse_date(self):
+        results = benchmark.parse_date(lessons=5, courses=2)
+        self.assertEqual(len(results), 2)
+        for (description, value) in results:
+            self.assertGreater(value, 0, msg=description)
+
+    def test_parse_date_agrees(self):
+        dates = ['2000-01-03', '2000-12-31']
+        self.assertEqual(
+            benchmark._parse_dates(dates),
+            benchmark._parse_dates_uncached(dates)
+        )
+
+    def test_startup(self):
+        results = benchmark.startup(repeat=1)
+        self.assertEqual(len(results), 4)
+        for (description, value) in results:
+            self.assertGreater(value, 0, msg=description)
+
+    def test_end_to_end(self):
+        results = dict(benchmark.end_to_end(
+            lesson_counts=(2,), settings=((1, 0), (2, 1)), files=2,
+            file_size=1024, commits=1
+        ))
+        for label in (
+            "2 lessons, 1 jobs, prefetch 0", "2 lessons, 2 jobs, prefetch 1"
+        ):
+            self.assertGreater(results[label + " - wall time (s)"], 0)
+            for phase in benchmark._PHASES:
+                self.assertGreater(
+                    results["%s - %s (s)" % (label, phase)], 0, msg=phase
+                )
+            self.assertGreater(
+                results[label + " - bytes pushed"], 2 * 2 * 1024
+            )
+            self.assertGreater(results[label + " - api calls"], 0)
+
+    def test_baseline(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            path = os.path.join(tempdir, 'baseline.json')
+            with contextlib.redirect_stdout(io.StringIO()):
+                benchmark.main(['parse_date', '--save-baseline', path])
+            saved = benchmark.load_baseline(path)
+            self.assertEqual(len(saved['parse_date']), 2)
+
+            # Nothing could be that fast
+            with open(path, 'w') as baseline:
+                json.dump({'parse_date': {
+                    description: 0 for description in saved['parse_date']
+                }}, baseline)
+            with contextlib.redirect_stdout(io.StringIO()) as output:
+                with self.assertRaises(SystemExit) as cm:
+                    benchmark.main(['parse_date', '--baseline', path])
+            self.assertEqual(cm.exception.code, 1)
+            self.assertIn('REGRESSION', output.getvalue())
+
+    def test_is_regression(self):
+        self.assertTrue(benchmark.is_regression(13, 10, 0.25))
+        self.assertFalse(benchmark.is_regression(12, 10, 0.25))
+        # Too small a difference to tell
+        self.assertFalse(benchmark.is_regression(0.0002, 0.0001, 0.25))
+
+    def test_unknown_benchmark(self):
+        with self.assertRaises(SystemExit) as cm:
+            benchmark.main(['no_such_benchmark'])
+        self.assertEqual(cm.exception.code, 2)
@@ -0,0 +1,663 @@
+"""
+A local stand-in for the parts of the GitHub REST API used by freeze.py.
+
+Repositories are real bare git repositories kept under a directory on
+disk, and their clone urls are file:// urls, so code under test can
+clone from and push to them without the network.  Point the Github
+client at FakeGithub.base_url (see the 'baseurl' setting) and use
+FakeGithub.git_environment() to redirect github.com urls to the fake.
+
+Intended for testing and benchmarking only.
+"""
+
+# Core modules
+import base64
+import collections
+import http.server
+import json
+import logging
+import os
+import os.path
+import re
+import subprocess
+import threading
+import time
+import urllib.parse
+
+# 3rd part imports
+import git
+
+logger = logging.getLogger(__name__)
+
+class FakeGithub:
+    """
+    In-process fake GitHub api server.
+
+    Use as a context manager, or call start() and stop().  Every request
+    made is recorded in 'requests' as a (method, path) tuple, and counted
+    against the access token it was made with in 'requests_by_token'.
+
+    Like GitHub, every response reports the rate limit in X-RateLimit-*
+    headers - each request uses one of the rate_limit requests its
+    access token is allowed (but they are never actually refused).  Use
+    throttle() to have requests refused for hitting a secondary rate
+    limit, and fail() to have them fail with a server error.
+
+    Repositories generated from a template are copied at once, unless
+    copy_templates_late() is used to have them start out empty (as
+    GitHub copies the template's content in the background).
+    """
+    def __init__(self, root, rate_limit=5000):
+        """
+        args:
+            root: directory to keep the bare repositories in
+            rate_limit: requests allowed each hour
+        """
+        self.root = root
+        self.organisations = {}
+        self.requests = []
+        self.requests_by_token = collections.Counter()
+        self.rate_limit = rate_limit
+        self.rate_reset = int(time.time()) + 3600
+        self._throttled = 0
+        self._retry_after = 0
+        # Requests to fail, by method: (count, status, handled)
+        self._failures = {}
+        # Branch listings before a generated repository is copied
+        self._template_delay = 0
+        # Generated repositories not copied yet, by (organisation, name):
+        # [listings left, template path, include_all_branches]
+        self._pending_copies = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @property
+    def base_url(self):
+        """
+        Url of the api, to use as the Github client's base_url.
+        """
+        (host, port) = self._server.server_address[:2]
+        return 'http://%s:%d' % (host, port)
+
+    def start(self):
+        """
+        Starts serving on a free local port in a background thread.
+        """
+        self._server = http.server.ThreadingHTTPServer(
+            ('127.0.0.1', 0), _RequestHandler
+        )
+        self._server.fake = self
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, daemon=True
+        )
+        self._thread.start()
+        logger.debug("Fake GitHub api listening at %s", self.base_url)
+
+    def stop(self):
+        """
+        Stops the server.
+        """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+
+    def repo_path(self, organisation, repo_name):
+        """
+        Returns the path of the bare repository backing a fake repo.
+        """
+        return os.path.join(self.root, organisation, repo_name + '.git')
+
+    def git_environment(self, prefixes=('https://github.com/',)):
+        """
+        Returns environment variables that make git fetch from and push
+        to the fake's repositories instead of github.com.
+
+        args:
+            prefixes: url prefixes to redirect to the fake (the access
+                token is part of the prefix if it is in the url)
+
+        returns:
+            dict of environment variables
+        """
+        config = [
+            ('url.file://%s/.insteadOf' % os.path.abspath(self.root), prefix)
+            for prefix in prefixes
+        ]
+        environment = {'GIT_CONFIG_COUNT': str(len(config))}
+        for (count, (key, value)) in enumerate(config):
+            environment['GIT_CONFIG_KEY_%d' % count] = key
+            environment['GIT_CONFIG_VALUE_%d' % count] = value
+        return environment
+
+    def throttle(self, count=1, retry_after=0):
+        """
+        Refuses the next count requests with a secondary rate limit error.
+
+        args:
+            count: number of requests to refuse
+            retry_after: seconds to ask the client to wait (Retry-After)
+        """
+        with self._lock:
+            self._throttled = count
+            self._retry_after = retry_after
+
+    def fail(self, method, count=1, status=502, handled=False):
+        """
+        Fails the next count requests made with method with a server
+        error.
+
+        args:
+            method: http method of the requests to fail
+            count: number of requests to fail
+            status: http status to fail them with
+            handled: if True, carry out the requests before failing them
+                (as if the response was lost on the way back)
+        """
+        with self._lock:
+            self._failures[method] = (count, status, handled)
+
+    def copy_templates_late(self, listings=1):
+        """
+        Leaves repositories generated from templates from now on empty
+        until their branches have been listed listings times.
+
+        args:
+            listings: number of branch listings that find the repository
+                empty (0 to copy templates at once again)
+        """
+        with self._lock:
+            self._template_delay = listings
+
+    def add_organisation(self, organisation):
+        """
+        Adds an (empty) organisation.
+        """
+        with self._lock:
+            self.organisations.setdefault(organisation, {})
+
+    def add_repo(self, organisation, repo_name, source=None, **attributes):
+        """
+        Adds a repository, creating its bare repository on disk.
+
+        args:
+            organisation: organisation to add to (created if needed)
+            repo_name: name of the repository
+            source: path or url of a repository to mirror into it (an
+                empty repository is created if not given)
+            attributes: any other repository attributes, such as
+                homepage, default_branch or is_template
+
+        returns:
+            dict of the repository's attributes
+        """
+        self.add_organisation(organisation)
+        path = self.repo_path(organisation, repo_name)
+        if source is None:
+            bare = git.Repo.init(path, bare=True, initial_branch='master')
+        else:
+            bare = git.Repo.clone_from(source, path, mirror=True)
+        with bare.config_writer() as config:
+            # Like GitHub, allow partial clones
+            config.set_value('uploadpack', 'allowFilter', 'true')
+            config.set_value('uploadpack', 'allowAnySHA1InWant', 'true')
+        repo = {
+            'name': repo_name,
+            'homepage': None,
+            'default_branch': 'master',
+            'is_template': False,
+            'description': None,
+        }
+        repo.update(attributes)
+        with self._lock:
+            self.organisations[organisation][repo_name] = repo
+        self._set_head(organisation, repo_name)
+        return repo
+
+    def _set_head(self, organisation, repo_name):
+        repo = self.organisations[organisation][repo_name]
+        git.Repo(self.repo_path(organisation, repo_name)).git.symbolic_ref(
+            'HEAD', 'refs/heads/' + repo['default_branch']
+        )
+
+    def _organisation_json(self, organisation):
+        return {
+            'login': organisation,
+            'type': 'Organization',
+            'url': '%s/orgs/%s' % (self.base_url, organisation),
+        }
+
+    def _repo_json(self, organisation, repo_name):
+        repo = self.organisations[organisation][repo_name]
+        result = dict(repo)
+        result.update({
+            'full_name': '%s/%s' % (organisation, repo_name),
+            'owner': self._organisation_json(organisation),
+            'url': '%s/repos/%s/%s' % (
+                self.base_url, organisation, repo_name
+            ),
+            'html_url': 'https://github.com/%s/%s' % (
+                organisation, repo_name
+            ),
+            'clone_url': 'file://%s' % os.path.abspath(
+                self.repo_path(organisation, repo_name)
+            ),
+        })
+        return result
+
+    def handle(self, method, path, body, token=None):
+        """
+        Handles an api request.
+
+        args:
+            method: http method
+            path: request path (without query string)
+            body: decoded json body - for requests without a body, the
+                query string parameters as a dict
+            token: access token the request was made with
+
+        returns:
+            tuple of (status, json-serialisable response, dict of extra
+            response headers)
+        """
+        with self._lock:
+            self.requests.append((method, path))
+            self.requests_by_token[token] += 1
+            used = min(self.requests_by_token[token], self.rate_limit)
+            headers = {
+                'X-RateLimit-Limit': str(self.rate_limit),
+                'X-RateLimit-Remaining': str(self.rate_limit - used),
+                'X-RateLimit-Reset': str(self.rate_reset),
+                'X-RateLimit-Used': str(used),
+            }
+            throttled = self._throttled > 0
+            if throttled:
+                self._throttled -= 1
+                headers['Retry-After'] = str(self._retry_after)
+            failure = None
+            if not throttled and method in self._failures:
+                failure = self._failures.pop(method)
+                if failure[0] > 1:
+                    self._failures[method] = (failure[0] - 1,) + failure[1:]
+        if throttled:
+            return (
+                403,
+                {
+                    'message': 'You have exceeded a secondary rate limit.'
+                        ' Please wait a few minutes before you try again.'
+                },
+                headers
+            )
+        server_error = {'message': 'Server Error'}
+        if failure is not None and not failure[2]:
+            return (failure[1], server_error, headers)
+
+        (status, response) = (404, {'message': 'Not Found'})
+        for (route_method, pattern, handler) in _ROUTES:
+            if route_method != method:
+                continue
+            match = re.fullmatch(pattern, path)
+            if match:
+                try:
+                    result = handler(self, body, *match.groups())
+                except KeyError:
+                    break
+                (status, response) = result[:2]
+                # Handlers only return headers if they have any
+                if len(result) == 3:
+                    headers.update(result[2])
+                break
+        if failure is not None:
+            # Done, but the client is told it failed
+            return (failure[1], server_error, headers)
+        return (status, response, headers)
+
+    def _get_organisation(self, body, organisation):
+        if organisation not in self.organisations:
+            raise KeyError(organisation)
+        return (200, self._organisation_json(organisation))
+
+    def _get_repo(self, body, organisation, repo_name):
+        return (200, self._repo_json(organisation, repo_name))
+
+    def _list_repos(self, body, organisation):
+        # Paginated like GitHub, with a Link header to the next and last
+        # pages
+        names = sorted(self.organisations[organisation])
+        per_page = int(body.get('per_page', 30))
+        page = int(body.get('page', 1))
+        pages = max(1, -(-len(names) // per_page))
+        headers = {}
+        if page < pages:
+            page_url = '%s/orgs/%s/repos?per_page=%d&page=%%d' % (
+                self.base_url, organisation, per_page
+            )
+            headers['Link'] = '<%s>; rel="next", <%s>; rel="last"' % (
+                page_url % (page + 1), page_url % pages
+            )
+        return (
+            200,
+            [
+                self._repo_json(organisation, name)
+                for name in names[(page - 1) * per_page:page * per_page]
+            ],
+            headers
+        )
+
+    def _create_repo(self, body, organisation):
+        if body['name'] in self.organisations[organisation]:
+            return (422, {
+                'message': 'Repository creation failed.',
+                'errors': [{
+                    'resource': 'Repository',
+                    'field': 'name',
+                    'message': 'name already exists on this account',
+                }],
+            })
+        self.add_repo(organisation, body['name'])
+        return (201, self._repo_json(organisation, body['name']))
+
+    def _edit_repo(self, body, organisation, repo_name):
+        repo = self.organisations[organisation][repo_name]
+        for (attribute, value) in body.items():
+            if attribute != 'name':
+                repo[attribute] = value
+        if 'default_branch' in body:
+            self._set_head(organisation, repo_name)
+        return (200, self._repo_json(organisation, repo_name))
+
+    def _generate_repo(self, body, organisation, repo_name):
+        template = self.organisations[organisation][repo_name]
+        if not template.get('is_template'):
+            return (422, {'message': 'Repository is not a template.'})
+        owner = body.get('owner', organisation)
+        self.add_organisation(owner)
+        if body['name'] in self.organisations[owner]:
+            return (422, {'message': 'Name already exists on this account'})
+        source = self.repo_path(organisation, repo_name)
+        include_all_branches = body.get('include_all_branches', False)
+        self.add_repo(
+            owner, body['name'],
+            default_branch=template['default_branch'],
+            description=template['description'],
+        )
+        with self._lock:
+            delay = self._template_delay
+            if delay:
+                self._pending_copies[(owner, body['name'])] = [
+                    delay, source, include_all_branches
+                ]
+        if not delay:
+            self._copy_template(
+                owner, body['name'], source, include_all_branches
+            )
+        return (201, self._repo_json(owner, body['name']))
+
+    def _copy_template(self, organisation, repo_name, source,
+                       include_all_branches):
+        new_repo = git.Repo(self.repo_path(organisation, repo_name))
+        new_repo.git.fetch(source, '+refs/*:refs/*')
+        if not include_all_branches:
+            default_branch = (
+                self.organisations[organisation][repo_name]['default_branch']
+            )
+            for head in new_repo.heads:
+                if head.name != default_branch:
+                    new_repo.delete_head(head, force=True)
+
+    def _get_branches(self, body, organisation, repo_name):
+        if repo_name not in self.organisations[organisation]:
+            raise KeyError(repo_name)
+        with self._lock:
+            pending = self._pending_copies.get((organisation, repo_name))
+            if pending is not None:
+                pending[0] -= 1
+                if pending[0] < 0:
+                    del self._pending_copies[(organisation, repo_name)]
+        if pending is not None:
+            if pending[0] >= 0:
+                return (200, [])
+            self._copy_template(organisation, repo_name, *pending[1:])
+        repo = git.Repo(self.repo_path(organisation, repo_name))
+        return (200, [
+            {'name': head.name, 'commit': {'sha': head.commit.hexsha}}
+            for head in repo.heads
+        ])
+
+    def _git(self, organisation, repo_name, *args, input=None, env=None):
+        if repo_name not in self.organisations[organisation]:
+            raise KeyError(repo_name)
+        return subprocess.run(
+            ('git',) + args,
+            cwd=self.repo_path(organisation, repo_name),
+            input=input,
+            env=dict(os.environ, **(env or {})),
+            check=True,
+            capture_output=True,
+        ).stdout.decode('utf-8').strip()
+
+    def _object_url(self, organisation, repo_name, kind, sha):
+        return '%s/repos/%s/%s/git/%s/%s' % (
+            self.base_url, organisation, repo_name, kind, sha
+        )
+
+    def _get_contents(self, body, organisation, repo_name, path):
+        repo = self.organisations[organisation][repo_name]
+        ref = body.get('ref') or repo['default_branch']
+        try:
+            sha = self._git(
+                organisation, repo_name, 'rev-parse', '%s:%s' % (ref, path)
+            )
+        except subprocess.CalledProcessError:
+            raise KeyError(path)
+        content = subprocess.run(
+            ['git', 'cat-file', 'blob', sha],
+            cwd=self.repo_path(organisation, repo_name),
+            check=True, capture_output=True
+        ).stdout
+        return (200, {
+            'type': 'file',
+            'encoding': 'base64',
+            'content': base64.b64encode(content).decode('ascii'),
+            'sha': sha,
+            'size': len(content),
+            'name': os.path.basename(path),
+            'path': path,
+            'url': '%s/repos/%s/%s/contents/%s' % (
+                self.base_url, organisation, repo_name, path
+            ),
+        })
+
+    def _ref_json(self, organisation, repo_name, ref):
+        sha = self._git(organisation, repo_name, 'rev-parse', 'refs/' + ref)
+        return {
+            'ref': 'refs/' + ref,
+            'url': '%s/repos/%s/%s/git/refs/%s' % (
+                self.base_url, organisation, repo_name, ref
+            ),
+            'object': {
+                'type': 'commit',
+                'sha': sha,
+                'url': self._object_url(
+                    organisation, repo_name, 'commits', sha
+                ),
+            },
+        }
+
+    def _get_ref(self, body, organisation, repo_name, ref):
+        try:
+            return (200, self._ref_json(organisation, repo_name, ref))
+        except subprocess.CalledProcessError:
+            raise KeyError(ref)
+
+    def _update_ref(self, body, organisation, repo_name, ref):
+        old_sha = self._git(organisation, repo_name, 'rev-parse', 'refs/' + ref)
+        if not body.get('force'):
+            try:
+                self._git(
+                    organisation, repo_name,
+                    'merge-base', '--is-ancestor', old_sha, body['sha']
+                )
+            except subprocess.CalledProcessError:
+                return (422, {'message': 'Update is not a fast forward'})
+        self._git(
+            organisation, repo_name,
+            'update-ref', 'refs/' + ref, body['sha'], old_sha
+        )
+        return (200, self._ref_json(organisation, repo_name, ref))
+
+    def _commit_json(self, organisation, repo_name, sha):
+        (tree, parents, message) = self._git(
+            organisation, repo_name,
+            'show', '-s', '--format=%T%n%P%n%B', sha
+        ).split('\n', 2)
+        person = {
+            'name': 'Fake', 'email': 'fake@example.tld',
+            'date': '2000-01-01T00:00:00Z',
+        }
+        return {
+            'sha': sha,
+            'url': self._object_url(organisation, repo_name, 'commits', sha),
+            'message': message,
+            'author': person,
+            'committer': person,
+            'tree': {
+                'sha': tree,
+                'url': self._object_url(organisation, repo_name, 'trees', tree),
+            },
+            'parents': [
+                {
+                    'sha': parent,
+                    'url': self._object_url(
+                        organisation, repo_name, 'commits', parent
+                    ),
+                }
+                for parent in parents.split()
+            ],
+        }
+
+    def _get_commit(self, body, organisation, repo_name, sha):
+        try:
+            return (200, self._commit_json(organisation, repo_name, sha))
+        except subprocess.CalledProcessError:
+            raise KeyError(sha)
+
+    def _create_blob(self, body, organisation, repo_name):
+        if body.get('encoding') == 'base64':
+            content = base64.b64decode(body['content'])
+        else:
+            content = body['content'].encode('utf-8')
+        sha = self._git(
+            organisation, repo_name, 'hash-object', '-w', '--stdin',
+            input=content
+        )
+        return (201, {
+            'sha': sha,
+            'url': self._object_url(organisation, repo_name, 'blobs', sha),
+        })
+
+    def _create_tree(self, body, organisation, repo_name):
+        index = os.path.join(
+            self.repo_path(organisation, repo_name),
+            'fake-index-%d' % threading.get_ident()
+        )
+        env = {'GIT_INDEX_FILE': index}
+        try:
+            if body.get('base_tree'):
+                self._git(
+                    organisation, repo_name,
+                    'read-tree', body['base_tree'], env=env
+                )
+            else:
+                self._git(
+                    organisation, repo_name, 'read-tree', '--empty', env=env
+                )
+            for entry in body['tree']:
+                self._git(
+                    organisation, repo_name,
+                    'update-index', '--add', '--cacheinfo',
+                    '%s,%s,%s' % (entry['mode'], entry['sha'], entry['path']),
+                    env=env
+                )
+            sha = self._git(organisation, repo_name, 'write-tree', env=env)
+        finally:
+            if os.path.exists(index):
+                os.remove(index)
+        return (201, {
+            'sha': sha,
+            'url': self._object_url(organisation, repo_name, 'trees', sha),
+            'tree': [],
+        })
+
+    def _create_commit(self, body, organisation, repo_name):
+        args = ['commit-tree', body['tree'], '-m', body['message']]
+        for parent in body.get('parents', []):
+            args.extend(['-p', parent])
+        sha = self._git(
+            organisation, repo_name, *args,
+            env={
+                'GIT_AUTHOR_NAME': 'Fake',
+                'GIT_AUTHOR_EMAIL': 'fake@example.tld',
+                'GIT_COMMITTER_NAME': 'Fake',
+                'GIT_COMMITTER_EMAIL': 'fake@example.tld',
+            }
+        )
+        return (201, self._commit_json(organisation, repo_name, sha))
+
+_ROUTES = [
+    ('GET', r'/orgs/([^/]+)', FakeGithub._get_organisation),
+    ('GET', r'/orgs/([^/]+)/repos', FakeGithub._list_repos),
+    ('POST', r'/orgs/([^/]+)/repos', FakeGithub._create_repo),
+    ('GET', r'/repos/([^/]+)/([^/]+)', FakeGithub._get_repo),
+    ('PATCH', r'/repos/([^/]+)/([^/]+)', FakeGithub._edit_repo),
+    ('POST', r'/repos/([^/]+)/([^/]+)/generate', FakeGithub._generate_repo),
+    ('GET', r'/repos/([^/]+)/([^/]+)/branches', FakeGithub._get_branches),
+    ('GET', r'/repos/([^/]+)/([^/]+)/contents/(.+)', FakeGithub._get_contents),
+    ('GET', r'/repos/([^/]+)/([^/]+)/git/ref/(.+)', FakeGithub._get_ref),
+    ('PATCH', r'/repos/([^/]+)/([^/]+)/git/refs/(.+)', FakeGithub._update_ref),
+    ('GET', r'/repos/([^/]+)/([^/]+)/git/commits/([0-9a-f]+)',
+        FakeGithub._get_commit),
+    ('POST', r'/repos/([^/]+)/([^/]+)/git/blobs', FakeGithub._create_blob),
+    ('POST', r'/repos/([^/]+)/([^/]+)/git/trees', FakeGithub._create_tree),
+    ('POST', r'/repos/([^/]+)/([^/]+)/git/commits', FakeGithub._create_commit),
+]
+
+class _RequestHandler(http.server.BaseHTTPRequestHandler):
+    def _handle(self):
+        url = urllib.parse.urlparse(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            body = json.loads(self.rfile.read(length))
+        else:
+            body = dict(urllib.parse.parse_qsl(url.query))
+        # 'token <access token>'
+        token = self.headers.get('Authorization', '').rpartition(' ')[2]
+        (status, response, headers) = self.server.fake.handle(
+            self.command, url.path, body, token or None
+        )
+        payload = json.dumps(response).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        for (header, value) in headers.items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = _handle
+    do_POST = _handle
+    do_PATCH = _handle
+    do_PUT = _handle
+    do_DELETE = _handle
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
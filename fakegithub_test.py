@@ -0,0 +1,164 @@
+import os.path
+import subprocess
+import tempfile
+import unittest
+
+import git
+import github
+
+import fakegithub
+
+class FakeGithubTest(unittest.TestCase):
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tempdir.cleanup)
+        self.fake = fakegithub.FakeGithub(self._tempdir.name)
+        self.fake.start()
+        self.addCleanup(self.fake.stop)
+        self.gh = github.Github(
+            'token', base_url=self.fake.base_url, retry=None,
+            seconds_between_requests=None, seconds_between_writes=None
+        )
+
+    def test_repository_lifecycle(self):
+        self.fake.add_organisation('org')
+        org = self.gh.get_organization('org')
+        new_repo = org.create_repo(name='lesson')
+        self.assertTrue(os.path.isdir(self.fake.repo_path('org', 'lesson')))
+        self.assertEqual(
+            new_repo.clone_url,
+            'file://' + os.path.abspath(self.fake.repo_path('org', 'lesson'))
+        )
+        with self.assertRaises(github.GithubException):
+            org.create_repo(name='lesson')
+
+        new_repo.edit(homepage='https://org.github.io/lesson')
+        self.assertEqual(
+            org.get_repo('lesson').homepage, 'https://org.github.io/lesson'
+        )
+        with self.assertRaises(github.UnknownObjectException):
+            org.get_repo('missing').default_branch
+        self.assertIn(('PATCH', '/repos/org/lesson'), self.fake.requests)
+
+    def test_list_repos(self):
+        for name in ('a', 'b', 'c', 'd', 'e'):
+            self.fake.add_repo('org', name)
+        gh = github.Github(
+            'token', base_url=self.fake.base_url, per_page=2,
+            seconds_between_requests=None, seconds_between_writes=None
+        )
+        self.assertEqual(
+            [repo.name for repo in gh.get_organization('org').get_repos()],
+            ['a', 'b', 'c', 'd', 'e']
+        )
+        self.assertEqual(
+            self.fake.requests.count(('GET', '/orgs/org/repos')), 3
+        )
+
+    def test_rate_limit(self):
+        self.fake.add_organisation('org')
+        self.gh.get_organization('org')
+        self.assertEqual(self.gh.requester.rate_limiting, (4999, 5000))
+        self.assertEqual(self.fake.requests_by_token, {'token': 1})
+        self.fake.throttle(retry_after=7)
+        with self.assertRaises(github.RateLimitExceededException) as cm:
+            self.gh.get_organization('org')
+        self.assertEqual(cm.exception.headers['retry-after'], '7')
+        self.assertEqual(self.gh.get_organization('org').login, 'org')
+
+    def test_fail(self):
+        self.fake.add_organisation('org')
+        org = self.gh.get_organization('org')
+        self.fake.fail('POST', status=503)
+        with self.assertRaises(github.GithubException) as cm:
+            org.create_repo(name='lesson')
+        self.assertEqual(cm.exception.status, 503)
+        self.assertNotIn('lesson', self.fake.organisations['org'])
+        # Only the next request fails
+        org.create_repo(name='lesson')
+
+        # Carried out, but reported as failed
+        self.fake.fail('POST', handled=True)
+        with self.assertRaises(github.GithubException):
+            org.create_repo(name='other')
+        self.assertIn('other', self.fake.organisations['org'])
+
+    def test_generate_from_template(self):
+        source = os.path.join(self._tempdir.name, 'source')
+        work = git.Repo.init(source, initial_branch='gh-pages')
+        work.index.commit("Initial commit")
+        self.fake.add_repo(
+            'org', 'lesson', source=source,
+            default_branch='gh-pages', is_template=True
+        )
+        org = self.gh.get_organization('org')
+        new_repo = org.create_repo_from_template(
+            'copy', org.get_repo('lesson'), include_all_branches=True
+        )
+        self.assertEqual(new_repo.default_branch, 'gh-pages')
+        self.assertEqual(
+            [branch.name for branch in new_repo.get_branches()], ['gh-pages']
+        )
+
+    def test_copy_templates_late(self):
+        source = os.path.join(self._tempdir.name, 'source')
+        work = git.Repo.init(source, initial_branch='gh-pages')
+        work.index.commit("Initial commit")
+        self.fake.add_repo(
+            'org', 'lesson', source=source,
+            default_branch='gh-pages', is_template=True
+        )
+        self.fake.copy_templates_late(listings=2)
+        org = self.gh.get_organization('org')
+        new_repo = org.create_repo_from_template(
+            'copy', org.get_repo('lesson'), include_all_branches=True
+        )
+        for _ in range(2):
+            self.assertEqual(list(new_repo.get_branches()), [])
+        self.assertEqual(
+            [branch.name for branch in new_repo.get_branches()], ['gh-pages']
+        )
+
+    def test_git_environment(self):
+        self.fake.add_repo('org', 'lesson')
+        output = subprocess.run(
+            ['git', 'ls-remote', 'https://github.com/org/lesson.git'],
+            env=dict(os.environ, **self.fake.git_environment()),
+            check=True, capture_output=True, text=True
+        )
+        self.assertEqual(output.returncode, 0)
+
+    def test_git_data(self):
+        source = os.path.join(self._tempdir.name, 'source')
+        work = git.Repo.init(source, initial_branch='master')
+        with open(os.path.join(source, 'file.txt'), 'w') as f:
+            f.write('Old\n')
+        work.index.add(['file.txt'])
+        work.index.commit("Initial commit")
+        self.fake.add_repo('org', 'lesson', source=source)
+
+        repo = self.gh.get_organization('org').get_repo('lesson')
+        self.assertEqual(
+            repo.get_contents('file.txt', ref='master').decoded_content,
+            b'Old\n'
+        )
+        ref = repo.get_git_ref('heads/master')
+        base = repo.get_git_commit(ref.object.sha)
+        blob = repo.create_git_blob('New\n', 'utf-8')
+        tree = repo.create_git_tree(
+            [
+                github.InputGitTreeElement(
+                    'dir/new.txt', '100644', 'blob', sha=blob.sha
+                )
+            ],
+            base.tree
+        )
+        commit = repo.create_git_commit('Add file', tree, [base])
+        ref.edit(commit.sha)
+
+        bare = git.Repo(self.fake.repo_path('org', 'lesson'))
+        self.assertEqual(bare.heads.master.commit.hexsha, commit.sha)
+        self.assertEqual(bare.git.show('master:dir/new.txt'), 'New')
+        self.assertEqual(bare.git.show('master:file.txt'), 'Old')
+        with self.assertRaises(github.UnknownObjectException):
+            repo.get_contents('missing.txt')
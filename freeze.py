@@ -2,31 +2,105 @@
 
 # Core modules
 import argparse
+import collections
+import concurrent.futures
+import contextlib
+import datetime
+import functools
+import html
+import itertools
+import json
 import logging
 import os.path
 import re
+import shutil
 import sys
 import tempfile
+import threading
+import time
 import urllib.parse
 import warnings
 
-# 3rd part imports
-import dateparser
-import git
-import github
-
 # Local imports
+import apischeduler
+import journal
+import mirrorcache
+import retry
+import runsummary
+import tracing
 import util
 
+# 3rd part imports - imported on first use (see util.lazy_import), as
+# they are slow to import and not needed for --help or to check the
+# command line
+dateparser = util.lazy_import('dateparser')
+git = util.lazy_import('git')
+github = util.lazy_import('github')
+
 logger = logging.getLogger(__name__)
 tempdirs = []
 repository = None
 force = None
 carry_on = False
 freeze_date = None
+# List of (course repository, freeze date) for --manifest
+courses = None
 settings_file = 'settings.ini'
 settings = None
 dry_run = False
+# Only work out (and log) what a run would do - see do_plan
+plan_only = False
+# File to write the plan to (see write_plan) and to apply one from
+plan_file = None
+apply_file = None
+jobs = 1
+# How the frozen copy is made - 'mirror' (clone and push from here) or
+# 'template' (have GitHub generate it from the source repository)
+backend = 'mirror'
+prefetch = 1
+prefetcher = None
+# Only fetch what is needed to update the course (see _clone_course)
+shallow_course = False
+# Link to an existing frozen copy of a lesson that has not changed since
+# it was made, rather than freezing it again (see find_matching_snapshot)
+reuse_snapshots = False
+# Read and update the course through the GitHub api instead of a clone
+course_via_api = False
+# mirrorcache.MirrorCache to clone through, if configured (see
+# load_settings)
+mirror_cache = None
+# Where to record the steps done, so --continue can resume a run
+journal_file = 'freeze-journal.jsonl'
+# journal.Journal for the current run (None in dry-run mode)
+run_journal = None
+# Timing spans of the phases of the run, written to trace_file (if set)
+# at the end
+tracer = tracing.Tracer()
+trace_file = None
+# What the run cost (api calls, git traffic...), logged at the end and
+# written to summary_file (if set)
+run_summary = runsummary.RunSummary()
+summary_file = None
+# A GithubClient for each access token (see _get_github_clients) and
+# the one leased by each thread (see _lease_github_client)
+github_pool_size = 10
+_github_clients = None
+_leased = threading.local()
+# Names of the repositories in each organisation (see
+# _get_organisation_repo_names)
+_github_repo_names = {}
+# How clones, pushes and api calls that fail for (possibly) transient
+# reasons are retried (see the [retry] settings)
+retry_policy = retry.RetryPolicy()
+# How long to wait for GitHub to copy a template's content into a
+# repository generated from it, checking every template_poll_interval
+# seconds (see wait_for_template_copy)
+template_copy_timeout = 300
+template_poll_interval = 2
+_github_lock = threading.Lock()
+# Roughly how many api calls a lease uses, so concurrent leases are
+# spread between tokens before GitHub has reported on their quota
+_CALLS_PER_LEASE = 10
 
 def process_commandline(args_list=None):
     """
@@ -65,9 +139,37 @@ def process_commandline(args_list=None):
         '--continue',
         dest='carry_on',
         action='store_true',
-        help='Carry on regardless if the frozen repository already exists'
-            ' (will not update existing repositories - just assumes they are'
-            ' already faithful snapshots)'
+        help='Resume an interrupted run from its journal, skipping the'
+            ' steps it had already done.  Frozen repositories that already'
+            ' exist (but are not in the journal) are assumed to be faithful'
+            ' snapshots and used as they are, rather than being an error.'
+    )
+    parser.add_argument(
+        '--journal',
+        dest='journal_file',
+        action='store',
+        help='File to record the steps done in, so an interrupted run can'
+            ' be resumed with --continue - defaults to'
+            ' "freeze-journal.jsonl" in the current working directory.  It'
+            ' is removed once the run has finished.'
+    )
+    parser.add_argument(
+        '--trace',
+        dest='trace_file',
+        action='store',
+        help='Write how long each phase of the run took (for each lesson'
+            ' and course) to this file, in the Chrome trace event format -'
+            ' open it in chrome://tracing or https://ui.perfetto.dev to see'
+            ' it as a timeline.'
+    )
+    parser.add_argument(
+        '--summary',
+        dest='summary_file',
+        action='store',
+        help='Write a summary of what the run cost (GitHub api calls by'
+            ' endpoint, bytes fetched - unless using the mirror cache - and'
+            ' pushed, size of the repositories frozen) to this file as'
+            ' JSON.  The summary is always logged at the end of the run.'
     )
     parser.add_argument(
         '--dry-run',
@@ -76,14 +178,104 @@ def process_commandline(args_list=None):
         help='Logs (at info level) what would be done but does not actually'
              ' make any changes.'
     )
+    parser.add_argument(
+        '--plan',
+        dest='plan_only',
+        action='store_true',
+        help='Work out what the run would do (which repositories would be'
+             ' created, pushed and changed, and which links updated) and'
+             ' log it, without cloning anything or making any changes.'
+             '  Much quicker than --dry-run, as only the schedules and'
+             ' repository listings are read from GitHub.'
+    )
+    parser.add_argument(
+        '--save-plan',
+        dest='plan_file',
+        action='store',
+        help='Work out what the run would do, as --plan, and write it to'
+             ' this file as JSON - to be reviewed, then done with --apply.'
+    )
+    parser.add_argument(
+        '--apply',
+        dest='apply_file',
+        action='store',
+        help='Do what the plan in this file (written by --save-plan) says,'
+             ' instead of freezing the course on the command line.  The'
+             ' lessons are frozen in parallel (see --jobs).'
+    )
     parser.add_argument(
         '--no-dry-run',
         dest='no_dry_run',
         action='store_true',
         help='Forcibly turn off dry-run mode (only useful with -d/--debug).'
     )
+    parser.add_argument(
+        '-j', '--jobs',
+        dest='jobs',
+        action='store',
+        type=int,
+        default=1,
+        help='Number of lessons to freeze concurrently (defaults to 1).'
+    )
+    parser.add_argument(
+        '--prefetch',
+        dest='prefetch',
+        action='store',
+        type=int,
+        default=1,
+        help='Number of lessons to fetch ahead of those being pushed'
+             ' (defaults to 1, 0 turns off fetching ahead).'
+    )
+    parser.add_argument(
+        '--backend',
+        dest='backend',
+        action='store',
+        choices=('mirror', 'template'),
+        default='mirror',
+        help='How to make the frozen copies.  "mirror" (the default)'
+             ' clones each repository here and pushes it to the new one.'
+             ' "template" has GitHub generate the new repository from the'
+             ' original, which must be marked as a template repository'
+             ' (GitHub does not keep the history of a template).'
+    )
+    parser.add_argument(
+        '--shallow-course',
+        dest='shallow_course',
+        action='store_true',
+        help='Only fetch the latest version of the schedule and index from'
+             ' the course repository, rather than cloning all of it (and its'
+             ' history).'
+    )
+    parser.add_argument(
+        '--reuse-snapshots',
+        dest='reuse_snapshots',
+        action='store_true',
+        help='If a lesson has not changed (same branches and tags) since'
+             ' its latest frozen copy was made, link to that copy instead'
+             ' of making another.  The copy keeps its link back to'
+             ' the course it was made for.  Only copies made by the'
+             ' mirror backend can match.'
+    )
+    parser.add_argument(
+        '--course-api',
+        dest='course_via_api',
+        action='store_true',
+        help='Read and update the course schedule through the GitHub api,'
+             ' without cloning the course repository.'
+    )
+    parser.add_argument(
+        '--manifest',
+        dest='manifest',
+        action='store',
+        help='Freeze all the courses listed in this file, instead of the'
+             ' one on the command line.  Each line should be a course'
+             ' repository and its freeze date, separated by spaces.'
+             '  Repositories linked to by several courses (with the same'
+             ' date) are only frozen once.'
+    )
     parser.add_argument(
         'repo',
+        nargs='?',
         action='store',
         help='Repository to freeze (i.e. the repository with the schedule'
             ' whose repos you want to freeze).  Can be the repository'
@@ -91,6 +283,7 @@ def process_commandline(args_list=None):
     )
     parser.add_argument(
         'date',
+        nargs='?',
         action='store',
         help='Date to use in the prefix of the new (frozen) repositories.  Any'
             ' date parseable by the dateparser'
@@ -99,6 +292,16 @@ def process_commandline(args_list=None):
     
     logger.debug("Parsing args list (will use sys.argv if None): %s", args_list)
     args = parser.parse_args(args_list)
+    if args.apply_file and (args.manifest or args.plan_only or args.plan_file):
+        parser.error(
+            "Cannot use --apply with --manifest, --plan or --save-plan"
+        )
+    elif args.manifest and args.repo:
+        parser.error("Cannot give a repo and date with --manifest")
+    elif args.apply_file and args.repo:
+        parser.error("Cannot give a repo and date with --apply")
+    elif not (args.manifest or args.apply_file) and args.date is None:
+        parser.error("the following arguments are required: repo, date")
 
     global dry_run
     
@@ -129,9 +332,19 @@ def process_commandline(args_list=None):
     global repository
     repository = args.repo
 
-    global freeze_date
-    freeze_date = dateparser.parse(args.date).date()
-    logger.debug("Using date %s for freeze date", freeze_date.isoformat())
+    if args.apply_file:
+        global apply_file
+        apply_file = args.apply_file
+    elif args.manifest:
+        global courses
+        courses = read_manifest(args.manifest)
+        logger.debug("Got courses %s from manifest", courses)
+    else:
+        global freeze_date
+        freeze_date = _parse_date(args.date)
+        if freeze_date is None:
+            parser.error("cannot understand the date %r" % args.date)
+        logger.debug("Using date %s for freeze date", freeze_date.isoformat())
 
     if args.settings_file:
         global settings_file
@@ -141,10 +354,54 @@ def process_commandline(args_list=None):
         global force
         force = True
     
+    if args.shallow_course:
+        global shallow_course
+        shallow_course = True
+
+    if args.reuse_snapshots:
+        global reuse_snapshots
+        reuse_snapshots = True
+
+    if args.course_via_api:
+        global course_via_api
+        course_via_api = True
+
     if args.carry_on:
         global carry_on
         carry_on = True
 
+    if args.journal_file:
+        global journal_file
+        journal_file = args.journal_file
+
+    if args.trace_file:
+        global trace_file
+        trace_file = args.trace_file
+
+    if args.summary_file:
+        global summary_file
+        summary_file = args.summary_file
+
+    if args.jobs < 1:
+        logger.critical("--jobs must be at least 1 (got %d)", args.jobs)
+        sys.exit(1)
+    elif args.jobs != 1:
+        global jobs
+        jobs = args.jobs
+
+    if args.backend != 'mirror':
+        global backend
+        backend = args.backend
+
+    if args.prefetch < 0:
+        logger.critical(
+            "--prefetch cannot be negative (got %d)", args.prefetch
+        )
+        sys.exit(1)
+    elif args.prefetch != 1:
+        global prefetch
+        prefetch = args.prefetch
+
     if args.dry_run and args.no_dry_run:
         logger.critical(
             "Cannot specify --dry-run and --no-dry-run (does not make sense!)"
@@ -154,8 +411,40 @@ def process_commandline(args_list=None):
         dry_run = True
         logger.info("Turned on dry-run mode.")
 
+    if args.plan_only or args.plan_file:
+        global plan_only
+        plan_only = True
+
+    if args.plan_file:
+        global plan_file
+        plan_file = args.plan_file
+
     logger.debug("Got repository '%s' from command line", repository)
 
+@functools.lru_cache(maxsize=None)
+def _parse_date(text):
+    """
+    Parses a date.  YYYY-MM-DD dates (the usual case - freeze dates and
+    the start of course repository names) are read directly, anything
+    else is left to dateparser, which is much slower and depends on the
+    locale.  Results are cached, as the same few dates are parsed again
+    and again (e.g. for every lesson in a course).
+
+    args:
+        text: date to parse
+
+    returns:
+        datetime.date, or None if it is not a date dateparser can parse
+    """
+    try:
+        return datetime.date.fromisoformat(text)
+    except ValueError:
+        pass
+    parsed = dateparser.parse(text)
+    if parsed is None:
+        return None
+    return parsed.date()
+
 def _get_schedule_file_relative_path():
     """
     Returns the relative path of the schedule file to the git repo root.
@@ -176,88 +465,82 @@ def _get_index_file_relative_path():
 
 def  __get_schedule_file_path(repo_root):
     """
-    Returns the path of the schedule file - used by _get_schedule_file,
-    _write_schedule_file and update_repo_urls so we only have to fix it
-    in one place if it changes.
+    Returns the path of the schedule file - used by
+    _transform_schedule_file and update_repo_urls so we only have to fix
+    it in one place if it changes.
     """
     return os.path.join(repo_root, _get_schedule_file_relative_path())
 
 
 def  __get_index_file_path(repo_root):
     """
-    Returns the path of the schedule file - used by _get_index_file,
-    _write_index_file and update_repo_urls so we only have to fix it
-    in one place if it changes.
+    Returns the path of the schedule file - used by _transform_index_file
+    and update_repo_urls so we only have to fix it in one place if it
+    changes.
     """
     return os.path.join(repo_root, _get_index_file_relative_path())
 
-def _get_schedule_file(repo_root):
-    """
-    Read the content of the schedule file.
-
-    args:
-        repo_root: Root of the cloned repository with the file in.
-
-    returns:
-        contents of the file as a list of lines (via .readlines())
+def _transform_file(path, transform):
     """
-    schedule_path = __get_schedule_file_path(repo_root)
-    logger.debug("Reading schedule from: %s", schedule_path)
-    with open(schedule_path) as schedule_file:
-        schedule = schedule_file.readlines()
-    return schedule
+    Rewrites a file through a transform, a line at a time.
 
-def _get_index_file(repo_root):
-    """
-    Read the content of the index file.
+    The new contents go to a temporary file next to the original, which
+    then replaces it with an atomic rename - so a failure part way
+    through leaves the original untouched rather than truncated, and
+    only as much of the file is held in memory as the transform needs.
 
     args:
-        repo_root: Root of the cloned repository with the file in.
+        path: file to rewrite
+        transform: function taking an iterator over the lines of the
+            file (with line endings) and returning an iterable of the
+            new lines
 
     returns:
-        contents of the file as a list of lines (via .readlines())
+        Nothing
     """
-    index_path = __get_index_file_path(repo_root)
-    logger.debug("Reading index from: %s", index_path)
-    with open(index_path) as index_file:
-        index = index_file.readlines()
-    return index
-
-def _write_schedule_file(repo_root, lines):
+    (handle, temp_path) = tempfile.mkstemp(
+        dir=os.path.dirname(path), prefix='.%s.' % os.path.basename(path)
+    )
+    try:
+        with open(path) as old_file, open(handle, 'w') as new_file:
+            new_file.writelines(transform(old_file))
+            new_file.flush()
+            os.fsync(new_file.fileno())
+        shutil.copymode(path, temp_path)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+def _transform_schedule_file(repo_root, transform):
     """
-    Write new contents to the schedule file.
+    Rewrites the schedule file (see _transform_file).
 
     args:
         repo_root: Root of the cloned repository with the file in.
-        lines: list of lines to write (mirroring return value of
-            _get_schedule_file)
+        transform: function from the old lines to the new lines
 
     returns:
         Nothing
     """
     schedule_path = __get_schedule_file_path(repo_root)
-    logger.debug("Writing new schedule to: %s", schedule_path)
-
-    with open(schedule_path, 'w') as schedule_file:
-        schedule_file.writelines(lines)
+    logger.debug("Rewriting schedule: %s", schedule_path)
+    _transform_file(schedule_path, transform)
 
-def _write_index_file(repo_root, lines):
+def _transform_index_file(repo_root, transform):
     """
-    Write new contents to the index file.
+    Rewrites the index file (see _transform_file).
 
     args:
         repo_root: Root of the cloned repository with the file in.
-        lines: list of lines to write (mirroring return value of
-            _get_index_file)
+        transform: function from the old lines to the new lines
 
     returns:
         Nothing
     """
     index_path = __get_index_file_path(repo_root)
-    logger.debug("Writing new index to: %s", index_path)
-
-    with open(index_path, 'w') as index_file:
-        index_file.writelines(lines)
+    logger.debug("Rewriting index: %s", index_path)
+    _transform_file(index_path, transform)
 
 def _github_io_to_github_com(url):
     """
@@ -285,38 +568,109 @@ def _github_io_to_github_com(url):
     )
     return new_url
 
-def get_repos_to_freeze(repo_root):
+# Tokens of html that matter for finding links - comments (so links in
+# them are skipped, a comment not closed yet runs to the end) and <a>
+# start tags, which may span lines and have '>'s in quoted attribute
+# values.
+_link_token_re = re.compile(
+    r"""<!--(?:.*?-->|.*\Z)|<a\s(?:[^>"']|"[^"]*"|'[^']*')*>""",
+    re.IGNORECASE | re.DOTALL
+)
+# The start of a token that is not complete yet (see iter_schedule_links)
+_partial_token_re = re.compile(
+    r"<(?:a\s|!--)|<(?:a|!-?)?\Z", re.IGNORECASE
+)
+# The href attribute of an <a> tag
+_href_re = re.compile(
+    r"""\shref\s*=\s*(?:"(?P<double>[^"]*)"|'(?P<single>[^']*)'"""
+    r"""|(?P<bare>[^\s"'>]+))""",
+    re.IGNORECASE
+)
+
+def iter_schedule_links(chunks):
+    """
+    Finds the repos referenced by a schedule as it is read.
+
+    The schedule is tokenised as html, so links split across lines (or
+    chunks), with the href in any position or quoted either way are
+    found and links in comments are ignored.
+
+    args:
+        chunks: iterable of strings making up the schedule (e.g. chunks
+            read from the file, or its lines)
+
+    yields:
+        (link, repository url) tuples - the link as written in the
+        schedule and the github.com url of the repository it is for.
+    """
+    pending = ''
+    for chunk in itertools.chain(chunks, [None]):
+        if chunk is None:
+            # End of the schedule - anything left is never completed
+            buffer = pending
+            pending = ''
+        else:
+            buffer = pending + chunk
+        end = 0
+        for token in _link_token_re.finditer(buffer):
+            if token.group().startswith('<!'):
+                if token.group().endswith('-->') or chunk is None:
+                    end = token.end()
+                # else the comment's end is still to come
+                continue
+            end = token.end()
+            match = _href_re.search(token.group())
+            if match is None:
+                continue
+            written = next(
+                value for value in match.group('double', 'single', 'bare')
+                if value is not None
+            )
+            url = urllib.parse.urlparse(html.unescape(written).strip())
+            if url.netloc.endswith('.github.io'):
+                url = _github_io_to_github_com(url)
+            yield (written, url.geturl())
+        if chunk is not None:
+            # Keep anything that might be the start of a token for when
+            # the rest of it arrives.
+            partial = _partial_token_re.search(buffer, end)
+            pending = buffer[partial.start():] if partial else ''
+
+def get_repos_to_freeze(repo_root, chunk_size=64 * 1024):
     """
     Finds the repos referenced by the schedule, to get a list to freeze.
 
     args:
         repo_root: string which is the path to a clone of the repo to
             freeze.
+        chunk_size: how much of the schedule to read at a time
 
     returns:
         list of urls that are linked to from the schedule
     """
-    schedule = _get_schedule_file(repo_root)
-    repos_to_freeze = []
-    link_re = re.compile(r'<a\s+(?:[^\s]+\s+)?href="(?P<url>[^"]+)"')
-    for line in schedule:
-        start = 0
-        while start >= 0:
-            match = link_re.search(line, start)
-            if match:
-                # Found a match - store the url found
-                url = urllib.parse.urlparse(match.group('url').strip())
-                if url.netloc.endswith('.github.io'):
-                    url = _github_io_to_github_com(url)
-
-                repos_to_freeze.append( (match.group('url'), url.geturl()) )
-                # Check the rest of the string for another url
-                start = match.end()
-            else:
-                start = -1 # No match, so exit loop
+    schedule_path = __get_schedule_file_path(repo_root)
+    logger.debug("Reading schedule from: %s", schedule_path)
+    with tracer.span('find lessons'), open(schedule_path) as schedule_file:
+        repos_to_freeze = list(iter_schedule_links(
+            iter(lambda: schedule_file.read(chunk_size), '')
+        ))
     logger.debug("get_repos_to_freeze found: %s", repos_to_freeze)
     return repos_to_freeze
 
+def _find_repos_in_schedule(schedule):
+    """
+    Finds the repos referenced by the lines of a schedule.
+
+    args:
+        schedule: list of lines of the schedule file
+
+    returns:
+        list of (link, repository url) tuples, as get_repos_to_freeze
+    """
+    repos_to_freeze = list(iter_schedule_links(schedule))
+    logger.debug("_find_repos_in_schedule found: %s", repos_to_freeze)
+    return repos_to_freeze
+
 def _get_organisation_repo_from_url(repo_url):
     """
     Attempts to guess organisation and repository from Github url
@@ -353,17 +707,364 @@ def _get_organisation_repo_from_url(repo_url):
     repo_name = split_path[last_path_part]
     return (organisation, repo_name)
 
+def _add_access_token(url):
+    """
+    Adds the access token (of the current client, see
+    _get_github_client) as the user in an http(s) url, so that git can
+    push to it.  Other urls (e.g. file://) and urls that already have a
+    user are returned unchanged.
+
+    args:
+        url: url to add the token to
+
+    returns:
+        New url
+    """
+    parsed = urllib.parse.urlparse(url)
+    if parsed.scheme not in ('http', 'https') or '@' in parsed.netloc:
+        return url
+    # This is why we need an access token rather than username/password
+    return url.replace(
+        '://',
+        '://%(user)s@' % {
+            'user': _get_github_client().token,
+        },
+        1
+    )
+
+class GithubClient:
+    """
+    A github.Github for one access token, with the api scheduler its
+    calls go through, its caches of organisation and repository objects
+    (which make their api calls with the token that fetched them) and a
+    record of its use.
+    """
+    def __init__(self, token):
+        """
+        args:
+            token: GitHub access token
+        """
+        github_settings = settings['github']
+        self.token = token
+        # A single instance is kept for the whole run so that the
+        # underlying HTTP connections are pooled and kept alive between
+        # API calls.
+        self.github = github.Github(
+            token,
+            base_url=github_settings.get('baseurl', 'https://api.github.com'),
+            pool_size=github_pool_size,
+            # Fewer requests to list an organisation's repositories
+            per_page=100,
+            # Pacing and rate limit errors are up to the scheduler
+            retry=None,
+            seconds_between_requests=None,
+            seconds_between_writes=None,
+        )
+        requester = self.github.requester
+        self.scheduler = apischeduler.ApiScheduler(
+            rate=float(github_settings.get('requestrate', 5)),
+            burst=int(github_settings.get('requestburst', 10)),
+            write_interval=float(github_settings.get('writeinterval', 1)),
+            quota=lambda: (
+                requester.rate_limiting, requester.rate_limiting_resettime
+            ),
+        )
+        self.organisations = {}
+        self.repos = {}
+        # Number of leases of the client now and in total
+        self.active = 0
+        self.leases = 0
+
+    def available(self):
+        """
+        Returns the quota left, allowing for the leases using it now
+        (infinite if GitHub hasn't said yet).
+        """
+        if self.scheduler.remaining is None:
+            return float('inf')
+        return self.scheduler.remaining - _CALLS_PER_LEASE * self.active
+
+    def __str__(self):
+        # Never log the whole token
+        return 'token ...%s' % self.token[-4:]
+
+def _get_github_clients():
+    """
+    Returns the list of GithubClients, one for each access token in the
+    settings, creating them on first use.
+
+    args:
+        None
+
+    returns:
+        list of GithubClient
+    """
+    global _github_clients
+    with _github_lock:
+        if _github_clients is None:
+            _github_clients = [
+                GithubClient(token)
+                for token in util.split_list(settings['github']['accesstoken'])
+            ]
+    return _github_clients
+
+def _get_github_client():
+    """
+    Returns the GithubClient leased by this thread (see
+    _lease_github_client), or the first one if it has not leased one.
+    """
+    client = getattr(_leased, 'client', None)
+    if client is None:
+        client = _get_github_clients()[0]
+    return client
+
+@contextlib.contextmanager
+def _lease_github_client():
+    """
+    Context manager making this thread use the GithubClient with the
+    most quota left for its api calls (and the access token in urls it
+    pushes to) until it exits.  Leasing for each lesson or course
+    spreads the work between the access tokens.
+
+    returns:
+        GithubClient leased
+    """
+    client = getattr(_leased, 'client', None)
+    if client is not None:
+        # Already leased one, keep using it
+        yield client
+        return
+
+    clients = _get_github_clients()
+    with _github_lock:
+        client = max(
+            clients, key=lambda client: (client.available(), -client.leases)
+        )
+        client.active += 1
+        client.leases += 1
+    _leased.client = client
+    try:
+        yield client
+    finally:
+        _leased.client = None
+        with _github_lock:
+            client.active -= 1
+
 def _get_github_instance():
     """
-    Initialise a new github.Github object from the settings file.
+    Returns the github.Github object of the current client (see
+    _get_github_client).
 
     args:
         None
 
     returns:
-        New Github object
+        Shared Github object
+    """
+    return _get_github_client().github
+
+def _github_api(function, *args, write=False, already_done=None, **kwargs):
+    """
+    Makes a GitHub api call through the current client's api scheduler,
+    so it is paced to keep within GitHub's rate limits (and retried if it
+    hits one), retrying it with retry_policy if it fails with a server or
+    network error.
+
+    args:
+        function: function making a single api request
+        args: arguments for function
+        write: does the call change anything (i.e. is it not a GET)?
+        already_done: for calls that must not be repeated if they
+            succeeded (e.g. creating a repository), function returning
+            the call's result if a failed attempt turns out to have
+            succeeded after all (see retry.RetryPolicy.call)
+        kwargs: keyword arguments for function
+
+    returns:
+        value returned by function
+    """
+    scheduler = _get_github_client().scheduler
+    name = getattr(function, '__name__', repr(function))
+    run_summary.api_call(getattr(function, '__qualname__', name))
+    with tracer.span(name, 'api'):
+        return retry_policy.call(
+            lambda: scheduler.call(function, *args, write=write, **kwargs),
+            description="GitHub api call %s" % name,
+            already_done=already_done
+        )
+
+def _get_github_organisation(organisation):
+    """
+    Returns the (cached) github organisation object.
+
+    args:
+        organisation: name of the organisation
+
+    returns:
+        github.Organization.Organization object
+    """
+    client = _get_github_client()
+    gh_org = client.organisations.get(organisation)
+    if gh_org is None:
+        gh_org = _github_api(client.github.get_organization, organisation)
+        with _github_lock:
+            gh_org = client.organisations.setdefault(organisation, gh_org)
+    return gh_org
+
+def _get_github_repo(organisation, repo_name):
+    """
+    Returns the (cached) github repository object.
+
+    args:
+        organisation: organisation the repository is in
+        repo_name: name of the repository
+
+    returns:
+        github.Repository.Repository object
+    """
+    client = _get_github_client()
+    key = (organisation, repo_name)
+    gh_repo = client.repos.get(key)
+    if gh_repo is None:
+        gh_repo = _github_api(
+            _get_github_organisation(organisation).get_repo, repo_name
+        )
+        with _github_lock:
+            gh_repo = client.repos.setdefault(key, gh_repo)
+    return gh_repo
+
+def _get_organisation_repo_names(organisation):
+    """
+    Returns the (cached) names of the repositories in an organisation.
+
+    The organisation is listed once per run (a page of 100 repositories
+    per api call) and repositories we create are added as we go, so
+    whether a repository exists can be checked without asking GitHub.
+    The listing has the details of each repository (default branch,
+    homepage...), so the repository objects are cached too.
+
+    args:
+        organisation: name of the organisation
+
+    returns:
+        set of repository names
+    """
+    names = _github_repo_names.get(organisation)
+    if names is None:
+        client = _get_github_client()
+        gh_repos = _get_github_organisation(organisation).get_repos()
+        listed = {}
+        # A page at a time, so each request is scheduled
+        for page in itertools.count():
+            repos_page = _github_api(gh_repos.get_page, page)
+            listed.update((gh_repo.name, gh_repo) for gh_repo in repos_page)
+            if len(repos_page) < client.github.per_page:
+                break
+        logger.debug(
+            "Found %d repositories in %s", len(listed), organisation
+        )
+        with _github_lock:
+            names = _github_repo_names.setdefault(organisation, set(listed))
+            for (repo_name, gh_repo) in listed.items():
+                client.repos.setdefault((organisation, repo_name), gh_repo)
+    return names
+
+def _find_github_repo(organisation, repo_name):
+    """
+    Returns the github repository object, or None if there is no such
+    repository.  Unlike _github_repo_exists, GitHub is asked (so the
+    answer is up to date).
+
+    args:
+        organisation: organisation the repository is in
+        repo_name: name of the repository
+
+    returns:
+        github.Repository.Repository object or None
+    """
+    try:
+        return _get_github_repo(organisation, repo_name)
+    except github.UnknownObjectException:
+        return None
+
+def _github_repo_exists(organisation, repo_name):
+    """
+    Does the organisation have a repository called repo_name?  (See
+    _get_organisation_repo_names)
+    """
+    names = _get_organisation_repo_names(organisation)
+    with _github_lock:
+        return repo_name in names
+
+def _add_github_repo(organisation, repo_name, new_repo):
+    # Caches a repository we have just created
+    client = _get_github_client()
+    with _github_lock:
+        client.repos[(organisation, repo_name)] = new_repo
+        if organisation in _github_repo_names:
+            _github_repo_names[organisation].add(repo_name)
+
+def _invalidate_github_repo(organisation, repo_name):
+    """
+    Drops a repository from the object caches, so the next use re-fetches
+    it.  Called whenever we change a repository ourselves.
+
+    args:
+        organisation: organisation the repository is in
+        repo_name: name of the repository
+
+    returns:
+        Nothing
+    """
+    with _github_lock:
+        for client in _github_clients or []:
+            client.repos.pop((organisation, repo_name), None)
+
+def _forget_github_repos():
+    """
+    Empties the repository caches (both the objects and the organisation
+    listings), so everything is fetched from GitHub again.
+    """
+    with _github_lock:
+        _github_repo_names.clear()
+        for client in _github_clients or []:
+            client.repos.clear()
+
+def _edit_github_repo(organisation, repo_name, **kwargs):
+    """
+    Edits a repository via the github api and invalidates the cached
+    copy of it.
+
+    args:
+        organisation: organisation the repository is in
+        repo_name: name of the repository
+        kwargs: passed through to Repository.edit
+
+    returns:
+        Nothing
+    """
+    _github_api(
+        _get_github_repo(organisation, repo_name).edit, write=True, **kwargs
+    )
+    _invalidate_github_repo(organisation, repo_name)
+
+
+def _get_github_file(gh_repo, path, ref):
+    """
+    Reads a (text) file from a repository through the contents api.
+
+    args:
+        gh_repo: github.Repository.Repository to read from
+        path: path of the file in the repository
+        ref: commit, branch or tag to read it from
+
+    returns:
+        contents of the file as a string
     """
-    return github.Github(settings['github']['accesstoken'])
+    logger.debug("Reading %s at %s from %s", path, ref, gh_repo.full_name)
+    return _github_api(
+        gh_repo.get_contents, path, ref=ref
+    ).decoded_content.decode('utf-8')
 
 
 def create_github_repo(organisation, repo_name):
@@ -378,14 +1079,117 @@ def create_github_repo(organisation, repo_name):
     returns:
         URL of the new repository
     """
-    gh = _get_github_instance()
-
-    gh_org = gh.get_organization(organisation)
+    gh_org = _get_github_organisation(organisation)
 
     create_args = {'name': repo_name}
-    new_repo =  gh_org.create_repo(**create_args)
+    # Don't try to create it again if the attempt that failed did
+    with tracer.span('create repository', repository=repo_name):
+        new_repo = _github_api(
+            gh_org.create_repo, write=True,
+            already_done=lambda: _find_github_repo(organisation, repo_name),
+            **create_args
+        )
+    _add_github_repo(organisation, repo_name, new_repo)
+    return new_repo.clone_url
+
+def create_github_repo_from_template(organisation, template_name, repo_name):
+    """
+    Create a new repo called repo_name within the organisation as a copy
+    of template_name (which must be marked as a template repository),
+    including all of its branches.  The copy is made by GitHub, so no
+    repository data passes through this machine.
+
+    N.B. GitHub does not copy the commit history of a template, each
+    branch of the new repository starts from a single commit.
+
+    args:
+        organisation: organisation to create in (also the organisation
+            the template is in)
+        template_name: name of the template repository
+        repo_name: name to create
+
+    returns:
+        URL of the new repository
+    """
+    template = _get_github_repo(organisation, template_name)
+    if not template.is_template:
+        logger.error(
+            "Repository %s/%s is not a template repository - tick"
+            " 'Template repository' in its settings to use the template"
+            " backend.", organisation, template_name
+        )
+        raise RuntimeError("Not a template repository")
+
+    with tracer.span('create repository', repository=repo_name):
+        new_repo = _github_api(
+            _get_github_organisation(organisation).create_repo_from_template,
+            repo_name, template, include_all_branches=True, write=True,
+            already_done=lambda: _find_github_repo(organisation, repo_name)
+        )
+    _add_github_repo(organisation, repo_name, new_repo)
     return new_repo.clone_url
 
+def _get_github_branch_names(organisation, repo_name):
+    """
+    Returns the names of the branches of a repository (asking GitHub,
+    a page of 100 branches per api call).
+
+    args:
+        organisation: organisation the repository is in
+        repo_name: name of the repository
+
+    returns:
+        set of branch names
+    """
+    client = _get_github_client()
+    gh_branches = _get_github_repo(organisation, repo_name).get_branches()
+    names = set()
+    # A page at a time, so each request is scheduled
+    for page in itertools.count():
+        branches_page = _github_api(gh_branches.get_page, page)
+        names.update(branch.name for branch in branches_page)
+        if len(branches_page) < client.github.per_page:
+            break
+    return names
+
+def wait_for_template_copy(organisation, template_name, repo_name):
+    """
+    Waits for GitHub to copy the branches of template_name into repo_name.
+
+    GitHub creates a repository generated from a template straight
+    away but copies the template's content in the background, so until
+    it has finished the new repository may be empty - setting its
+    default branch fails and cloning it gets nothing.
+
+    args:
+        organisation: organisation the repositories are in
+        template_name: name of the template repository
+        repo_name: name of the repository generated from it
+    """
+    expected = _get_github_branch_names(organisation, template_name)
+    deadline = time.monotonic() + template_copy_timeout
+    with tracer.span('wait for template copy', repository=repo_name):
+        while True:
+            missing = expected - _get_github_branch_names(
+                organisation, repo_name
+            )
+            if not missing:
+                return
+            if time.monotonic() >= deadline:
+                logger.error(
+                    "GitHub has not copied branches %s of %s/%s to %s after"
+                    " %s seconds - check the repository on GitHub and"
+                    " re-run with --continue once it has.",
+                    ', '.join(sorted(missing)), organisation, template_name,
+                    repo_name, template_copy_timeout
+                )
+                raise RuntimeError("Template not copied")
+            logger.debug(
+                "Waiting for GitHub to copy %s to %s", template_name,
+                repo_name
+            )
+            time.sleep(template_poll_interval)
+
 def github_default_branch(organisation, repo_name):
     """
     Returns default branch for the repo.
@@ -394,8 +1198,7 @@ def github_default_branch(organisation, repo_name):
         organisation: organisation to check
         repo_name: name of repo to check
     """
-    return _get_github_instance().get_organization(organisation)\
-        .get_repo(repo_name).default_branch
+    return _get_github_repo(organisation, repo_name).default_branch
 
 def set_github_default_branch(organisation, repo_name, branch='master'):
     """
@@ -409,8 +1212,7 @@ def set_github_default_branch(organisation, repo_name, branch='master'):
     returns:
         Nothing
     """
-    _get_github_instance().get_organization(organisation).get_repo(repo_name)\
-        .edit(default_branch=branch)
+    _edit_github_repo(organisation, repo_name, default_branch=branch)
 
 def get_github_homepage(organisation, repo_name):
     """
@@ -424,8 +1226,7 @@ def get_github_homepage(organisation, repo_name):
         homepage of the repository
 
     """
-    return _get_github_instance().get_organization(organisation)\
-        .get_repo(repo_name).homepage
+    return _get_github_repo(organisation, repo_name).homepage
 
 def set_github_homepage(organisation, repo_name, homepage):
     """
@@ -439,48 +1240,336 @@ def set_github_homepage(organisation, repo_name, homepage):
     returns:
         Nothing
     """
-    _get_github_instance().get_organization(organisation).get_repo(repo_name)\
-        .edit(homepage=homepage)
+    _edit_github_repo(organisation, repo_name, homepage=homepage)
 
-def import_to(source, dest):
+def _empty_directory(path):
     """
-    Import repository from source to dest.
-
-    Works very similarly to the github import tool - clones the source,
-    updates the remote and pushes to the new remote.
+    Removes everything in the directory path (but not path itself).
+    """
+    for entry in os.scandir(path):
+        if entry.is_dir(follow_symlinks=False):
+            shutil.rmtree(entry.path)
+        else:
+            os.remove(entry.path)
 
-    Based on GitHubs guide on mirroring a repository:
-        https://help.github.com/articles/duplicating-a-repository/
+def _retry_git(function, *args, path=None, description=None, **kwargs):
+    """
+    Runs a git operation that goes over the network (clone, fetch or
+    push), retrying it with retry_policy if it fails for what may be a
+    transient reason.
 
     args:
-        source: source repository url
-        dest: destination repository url
-    """
-    with tempfile.TemporaryDirectory() as tempdir:
-        logger.debug("Using temporary directory: %s", tempdir)
-        repo = git.Repo.clone_from(source, tempdir, bare=True)
-        logger.info("Fetched repository: %s", source)
-        repo.delete_remote('origin')
-        repo.create_remote('origin', dest)
-        repo.remote('origin').push(mirror=True)
-        logger.info("Pushed to new repository: %s", dest)
+        function: function doing the operation
+        args: arguments for function
+        path: directory the operation creates a repository in (e.g. a
+            clone), which is emptied before retrying (optional)
+        description: what the operation is, for the log
+        kwargs: keyword arguments for function
 
+    returns:
+        value returned by function
+    """
+    return retry_policy.call(
+        lambda: function(*args, **kwargs),
+        description=description,
+        cleanup=None if path is None else lambda: _empty_directory(path)
+    )
 
-def update_frozen_repository(repo_url, course_repository):
+def _push(repo, **kwargs):
     """
-    Adds a note and back-reference to the frozen copy of a repository.
+    Pushes repo to its origin (retrying transient failures), raising
+    git.GitCommandError if any ref failed to push.
 
     args:
-        repo_url: Url of the frozen repo
-        course_repository: Url of the course repository (the backlink
-            will be determined from this repositories Github homepage)
+        repo: git.Repo to push
+        kwargs: passed to git.Remote.push
 
     returns:
         Nothing
     """
+    transferred = runsummary.TransferCounter()
+    with tracer.span('push'):
+        _retry_git(
+            lambda: repo.remote('origin').push(
+                progress=transferred, **kwargs
+            ).raise_if_error(),
+            description="Push from %s" % repo.git_dir
+        )
+    run_summary.pushed(transferred.bytes)
 
-    # Find the organisation and repository for the course homepage
-    (organisation, repository) = _get_organisation_repo_from_url(
+def _clone(url, path, source=None, **kwargs):
+    """
+    Clones a repository, getting its content from the mirror cache if
+    one is configured.  Transient failures are retried (see _retry_git).
+
+    args:
+        url: url of the repository to clone (will be the clone's origin)
+        path: directory to clone into
+        source: url of the repository that url is a copy of - if given,
+            only objects missing from the cached mirror of source are
+            fetched from url.  Otherwise the clone is made from the
+            cached mirror of url.
+        kwargs: passed to git.Repo.clone_from
+
+    returns:
+        git.Repo of the clone
+    """
+    repo = _retry_git(
+        _clone_once, url, path, source, path=path,
+        description="Clone into %s" % path, **kwargs
+    )
+    if mirror_cache is None:
+        # Everything in the clone was fetched
+        run_summary.fetched(runsummary.count_objects(repo)[1])
+    else:
+        # Can't tell what the mirror cache had to fetch
+        run_summary.fetched(0)
+    return repo
+
+def _clone_once(url, path, source, **kwargs):
+    # A single attempt at _clone
+    if mirror_cache is None:
+        return git.Repo.clone_from(url, path, **kwargs)
+
+    if source is None:
+        with mirror_cache.mirror(url) as mirror:
+            repo = git.Repo.clone_from(mirror, path, **kwargs)
+        repo.remote('origin').set_url(url)
+    else:
+        with mirror_cache.mirror(source) as mirror:
+            repo = git.Repo.clone_from(
+                url, path, reference=mirror, dissociate=True, **kwargs
+            )
+    return repo
+
+def _clone_course(repo_url, path):
+    """
+    Clones the course repository.
+
+    If shallow_course is set only the latest commit is fetched, without
+    any file contents, and just the schedule and index files are checked
+    out (so only their contents get fetched).  The index still has every
+    file in, so committing works as normal and does not delete the
+    others.
+
+    args:
+        repo_url: url of the course repository
+        path: directory to clone into
+
+    returns:
+        git.Repo of the clone
+    """
+    if not shallow_course:
+        return _clone(repo_url, path)
+
+    repo = _retry_git(
+        git.Repo.clone_from, repo_url, path, path=path,
+        description="Clone into %s" % path,
+        depth=1, filter='blob:none', no_checkout=True
+    )
+    repo.git.read_tree('HEAD')
+    # Fetches the files' contents
+    _retry_git(
+        repo.git.checkout, 'HEAD', '--',
+        _get_schedule_file_relative_path(),
+        _get_index_file_relative_path(),
+        description="Checkout in %s" % path
+    )
+    run_summary.fetched(runsummary.count_objects(repo)[1])
+    return repo
+
+def _fetch_bare(source):
+    """
+    Makes a bare clone of source in a new temporary directory.
+
+    args:
+        source: source repository url
+
+    returns:
+        tuple of (tempfile.TemporaryDirectory, git.Repo) - the caller is
+        responsible for cleaning up the temporary directory.
+    """
+    tempdir = tempfile.TemporaryDirectory()
+    logger.debug("Using temporary directory: %s", tempdir.name)
+    try:
+        with tracer.span('fetch', source=source):
+            repo = _clone(source, tempdir.name, bare=True)
+        run_summary.repository(source, *runsummary.count_objects(repo))
+    except BaseException:
+        tempdir.cleanup()
+        raise
+    logger.info("Fetched repository: %s", source)
+    return (tempdir, repo)
+
+class Prefetcher:
+    """
+    Fetches source repositories in the background, ahead of import_to
+    needing them, so that fetching the next lessons overlaps with
+    pushing the current ones.
+
+    At most 'depth' fetched repositories are held on disk besides those
+    being pushed - the background fetch blocks until import_to has
+    finished with (or discard has thrown away) an earlier one.
+    """
+    def __init__(self, depth, jobs=1):
+        """
+        args:
+            depth: number of repositories to fetch ahead
+            jobs: number of repositories pushed at once (so fetched at
+                once, and held on disk while being pushed)
+        """
+        self._slots = threading.Semaphore(depth + jobs)
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=jobs
+        )
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def _fetch(self, source):
+        self._slots.acquire()
+        try:
+            return _fetch_bare(source)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def prefetch(self, source):
+        """
+        Queues source to be fetched in the background.
+
+        args:
+            source: source repository url
+
+        returns:
+            Nothing
+        """
+        with self._lock:
+            if source not in self._futures:
+                self._futures[source] = self._executor.submit(
+                    self._fetch, source
+                )
+
+    def take(self, source):
+        """
+        Hands over a fetched repository, waiting for the fetch to finish
+        if necessary.  The result must be given back to release().
+
+        args:
+            source: source repository url
+
+        returns:
+            tuple of (tempfile.TemporaryDirectory, git.Repo), as
+            _fetch_bare, or None if source was never queued.
+        """
+        with self._lock:
+            future = self._futures.pop(source, None)
+        if future is None:
+            return None
+        return future.result()
+
+    def release(self, fetched):
+        """
+        Cleans up a repository returned by take() and frees its slot.
+
+        args:
+            fetched: the tuple returned from take()
+
+        returns:
+            Nothing
+        """
+        fetched[0].cleanup()
+        self._slots.release()
+
+    def discard(self, source):
+        """
+        Throws away source if it was queued but never taken (e.g. the
+        freeze was skipped or failed before importing).
+
+        args:
+            source: source repository url
+
+        returns:
+            Nothing
+        """
+        with self._lock:
+            future = self._futures.pop(source, None)
+        if future is None or future.cancel():
+            return
+        try:
+            fetched = future.result()
+        except Exception:
+            # Failed fetches have already given their slot back
+            return
+        self.release(fetched)
+
+    def shutdown(self):
+        """
+        Discards anything not taken and stops the background thread.
+        """
+        with self._lock:
+            sources = list(self._futures)
+        for source in sources:
+            self.discard(source)
+        self._executor.shutdown()
+
+def import_to(source, dest, before_push=None):
+    """
+    Import repository from source to dest.
+
+    Works very similarly to the github import tool - clones the source,
+    updates the remote and pushes to the new remote.  If the source has
+    been queued with the active Prefetcher the clone it made is used.
+
+    Based on GitHubs guide on mirroring a repository:
+        https://help.github.com/articles/duplicating-a-repository/
+
+    args:
+        source: source repository url
+        dest: destination repository url
+        before_push: function to call with the (bare) git.Repo before it
+            is pushed, e.g. to commit changes to it (optional)
+    """
+    fetched = None
+    if prefetcher is not None:
+        fetched = prefetcher.take(source)
+    if fetched is None:
+        fetched = _fetch_bare(source)
+        release = lambda fetched: fetched[0].cleanup()
+    else:
+        release = prefetcher.release
+
+    try:
+        repo = fetched[1]
+        if before_push is not None:
+            before_push(repo)
+        repo.delete_remote('origin')
+        repo.create_remote('origin', dest)
+        _push(repo, mirror=True)
+        logger.info("Pushed to new repository: %s", dest)
+    finally:
+        release(fetched)
+
+
+_BACKLINK_COMMIT_MESSAGE = """Updated index with back link to course schedule.
+
+Automatic commit from freeze script.
+"""
+
+def _get_backlink(course_repository):
+    """
+    Finds what the frozen repositories should link back to.
+
+    args:
+        course_repository: Url of the course repository (the backlink
+            will be determined from this repositories Github homepage)
+
+    returns:
+        tuple of (backlink url, course date) - the course date is
+        inferred from the course repository name and is None if it does
+        not start with one.
+    """
+    # Find the organisation and repository for the course homepage
+    (organisation, repository) = _get_organisation_repo_from_url(
         course_repository
     )
     logger.debug(
@@ -493,19 +1582,120 @@ def update_frozen_repository(repo_url, course_repository):
     # Infer the course date from the repository start, if it looks like
     # a date (the first 10 characters are all 0-9 or '-'s)
     if re.match('[0-9-]{10}', repository):
-        course_date = dateparser.parse(repository[:10]).date()
+        course_date = _parse_date(repository[:10])
     else:
         course_date = None
     logger.debug("Schedule back-link will be to: %s", backlink)
-    with tempfile.TemporaryDirectory() as tempdir:
+    return (backlink, course_date)
+
+def _add_backlink(old_index, backlink, course_date):
+    """
+    Inserts the back-reference note into the lines of an index file.
+
+    The file starts with some meta data seperated by a line above and
+    below beginning with dashes.  The message goes after the last dashes.
+
+    args:
+        old_index: iterable of lines of the index file
+        backlink: url to link back to
+        course_date: date the course starts (or None if not known)
+
+    returns:
+        generator of the new lines
+    """
+    dash_count = 0
+    for line in old_index:
+        if line.startswith('--'):
+            dash_count += 1
+            if dash_count == 2:
+                # Make sure to include the original line of dashes first
+                yield line
+                # 2nd line beginning with dashes
+                message = [
+                    "This is the version taught at the"
+                    " [Software carpentries](%s) workshop" % backlink
+                ]
+                if course_date is not None:
+                    message.append(
+                        " beginning on %s" % course_date.strftime(
+                            "%A %d %B %Y"
+                        )
+                    )
+                message.append('.\n')
+                yield ''.join(message)
+                # Don't re-add this line by falling through -
+                # force next loop
+                continue
+        yield line
+
+def commit_backlink(repo, branch, course_repository):
+    """
+    Commits the back-reference note to a branch of a (bare) repository
+    without needing a working tree - so it can be added to the clone
+    made by import_to before it is pushed, rather than cloning the
+    frozen repository again afterwards.
+
+    args:
+        repo: git.Repo to commit to
+        branch: name of the branch to commit to
+        course_repository: Url of the course repository (see
+            _get_backlink)
+
+    returns:
+        Nothing
+    """
+    (backlink, course_date) = _get_backlink(course_repository)
+    ref = 'refs/heads/%s' % branch
+    index_path = _get_index_file_relative_path()
+
+    old_index = repo.git.show(
+        '%s:%s' % (ref, index_path), strip_newline_in_stdout=False
+    )
+    new_index = _add_backlink(
+        old_index.splitlines(keepends=True), backlink, course_date
+    )
+    with tempfile.TemporaryFile('w+') as new_file:
+        new_file.writelines(new_index)
+        new_file.seek(0)
+        blob = repo.git.hash_object('-w', '--stdin', istream=new_file)
+
+    index = git.IndexFile.from_tree(repo, ref)
+    old_entry = index.entries[(index_path, 0)]
+    index.entries[(index_path, 0)] = git.IndexEntry.from_base(
+        git.BaseIndexEntry(
+            (old_entry.mode, bytes.fromhex(blob), 0, index_path)
+        )
+    )
+    commit = git.Commit.create_from_tree(
+        repo, index.write_tree(), _BACKLINK_COMMIT_MESSAGE,
+        parent_commits=[repo.commit(ref)]
+    )
+    repo.git.update_ref(ref, commit.hexsha)
+    logger.debug("Committed back link to %s as %s", branch, commit.hexsha)
+
+def update_frozen_repository(repo_url, course_repository, source_url=None):
+    """
+    Adds a note and back-reference to the frozen copy of a repository.
+
+    Clones the frozen repository to do so - when mirroring, freeze adds
+    the note with commit_backlink before pushing instead.
+
+    args:
+        repo_url: Url of the frozen repo
+        course_repository: Url of the course repository (the backlink
+            will be determined from this repositories Github homepage)
+        source_url: Url of the repository that was frozen, so that the
+            clone can come from the mirror cache (optional)
+
+    returns:
+        Nothing
+    """
+    (backlink, course_date) = _get_backlink(course_repository)
+    with tracer.span(
+        'update frozen repository', source=source_url
+    ), tempfile.TemporaryDirectory() as tempdir:
         logger.debug("Using temporary directory: %s", tempdir)
-        if '@' not in repo_url:
-            repo_url = repo_url.replace(
-                '://',
-                '://%(user)s@' % {
-                    'user': settings['github']['accesstoken'],
-                }
-            )
+        repo_url = _add_access_token(repo_url)
 
         if dry_run:
             old_repo_url = re.sub(r'[0-9-]{10}-bham_', '', repo_url)
@@ -513,56 +1703,21 @@ def update_frozen_repository(repo_url, course_repository):
                 "DRY-RUN - Would clone repo from %s but using %s instead",
                 repo_url, old_repo_url
             )
-            repo = git.Repo.clone_from(old_repo_url, tempdir)
+            repo = _clone(old_repo_url, tempdir)
             # To be on the safe-side, don't want any code accidentally
             # pushing to our live courses.
             repo.delete_remote(repo.remote('origin'))
         else:
-            repo = git.Repo.clone_from(repo_url, tempdir)
+            repo = _clone(repo_url, tempdir, source=source_url)
         
-        # Read the old index
-        with open(os.path.join(tempdir, 'index.md')) as f:
-            old_index = f.readlines()
-
-        # Modify it - the file starts with some meta data seperated by
-        # a line above and below beginning with dashes.  Find the last
-        # dashes and insert the message.
-        new_index = []
-        dash_count = 0
-        for line in old_index:
-            if line.startswith('--'):
-                dash_count += 1
-                if dash_count == 2:
-                    # Make sure to include the original line of dashes first
-                    new_index.append(line)
-                    # 2nd line beginning with dashes
-                    message = [
-                        "This is the version taught at the"
-                        " [Software carpentries](%s) workshop" % backlink
-                    ]
-                    if course_date is not None:
-                        message.append(
-                            " beginning on %s" % course_date.strftime(
-                                "%A %d %B %Y"
-                            )
-                        )
-                    message.append('.\n')
-                    new_index.append(''.join(message))
-                    # Don't re-add this line by falling through -
-                    # force next loop
-                    continue
-            new_index.append(line)
+        _transform_index_file(
+            tempdir,
+            lambda lines: _add_backlink(lines, backlink, course_date)
+        )
 
-        # Write the new file
-        with open(os.path.join(tempdir, 'index.md'), 'w') as f:
-            f.writelines(new_index)
-        
         ri = repo.index
-        ri.add(['index.md'])
-        ri.commit("""Updated index with back link to course schedule.
-
-Automatic commit from freeze script.
-""")
+        ri.add([_get_index_file_relative_path()])
+        ri.commit(_BACKLINK_COMMIT_MESSAGE)
         if dry_run:
             logger.info(
                 "DRY-RUN - Would push updated repository from '%s' to origin",
@@ -571,32 +1726,227 @@ Automatic commit from freeze script.
         else:
             # This is why we make sure to have 'user@' in the remote url when
             # this was cloned at the start of do_freeze.
-            repo.remote('origin').push()
+            _push(repo)
+
+
+# Start of a frozen repository's name, YYYY-MM-DD-bham_ (see
+# _looks_frozen)
+_FROZEN_PREFIX_RE = '20[0-9]{2}-[01][0-9]-[0-3][0-9]-bham_'
+
+def _looks_frozen(repo_name):
+    """
+    Does the repository name already start with something that looks
+    like a YYYY-MM-DD-bham_ format (20..-*.-^.-bham_ where . is any
+    digit, * is 0 or 1 and ^ is 0, 1, 2 or 3)?
+
+    args:
+        repo_name: name of the repository to check
 
+    returns:
+        True if it looks like a frozen repository's name
+    """
+    return bool(re.match(_FROZEN_PREFIX_RE, repo_name))
 
-def freeze(repo_url, freeze_date, force=False):
+def _frozen_repo_name(repo_name, freeze_date):
+    """
+    Returns the name of the frozen copy of repository repo_name made for
+    freeze_date.
+    """
+    return '%s-bham_' % freeze_date.isoformat() + repo_name
+
+def _frozen_url(organisation, repo_name, default_branch, clone_url):
+    """
+    Returns the url to link to a frozen repository by - its github.io
+    pages if it is published from gh-pages, otherwise the repository.
+
+    args:
+        organisation: organisation of the frozen repository
+        repo_name: name of the frozen repository
+        default_branch: default branch of the frozen repository
+        clone_url: clone url of the frozen repository
+
+    returns:
+        url for the schedule
+    """
+    if default_branch == 'gh-pages':
+        return "https://%s.github.io/%s" % (organisation, repo_name)
+    # Remove '.git' from end of url for link to GitHub repo page
+    if clone_url.endswith('.git'):
+        return clone_url[:-4]
+    return clone_url
+
+def _remote_refs(organisation, repo_name):
+    """
+    Returns the branches and tags of a GitHub repository (with git
+    ls-remote, so without cloning it).
+
+    args:
+        organisation: organisation the repository is in
+        repo_name: name of the repository
+
+    returns:
+        dict mapping each ref (e.g. 'refs/heads/master') to its sha
+    """
+    url = 'https://github.com/%s/%s' % (organisation, repo_name)
+    output = _retry_git(
+        git.cmd.Git().ls_remote, '--heads', '--tags', _add_access_token(url),
+        description="List refs of %s" % url
+    )
+    refs = {}
+    for line in output.splitlines():
+        (sha, ref) = line.split('\t', 1)
+        refs[ref] = sha
+    return refs
+
+def _is_snapshot_of(source_refs, organisation, snapshot, default_branch):
+    """
+    Does the frozen repository snapshot have the refs source_refs?  A
+    copy of a gh-pages repository has the back link committed on top of
+    the source's gh-pages (see commit_backlink), which is allowed for.
+
+    args:
+        source_refs: refs of the source repository (see _remote_refs)
+        organisation: organisation of the frozen repository
+        snapshot: name of the frozen repository
+        default_branch: default branch of the source repository
+
+    returns:
+        True if snapshot is a copy of the source as it is now
+    """
+    snapshot_refs = _remote_refs(organisation, snapshot)
+    if snapshot_refs.keys() != source_refs.keys():
+        return False
+    for (ref, sha) in source_refs.items():
+        if snapshot_refs[ref] == sha:
+            continue
+        elif default_branch != 'gh-pages' or ref != 'refs/heads/gh-pages':
+            return False
+        commit = _github_api(
+            _get_github_repo(organisation, snapshot).get_git_commit,
+            snapshot_refs[ref]
+        )
+        if [parent.sha for parent in commit.parents] != [sha] or (
+            commit.message.strip() != _BACKLINK_COMMIT_MESSAGE.strip()
+        ):
+            return False
+    return True
+
+def find_matching_snapshot(organisation, repo_name, default_branch):
+    """
+    Checks whether the latest frozen copy of a repository (named
+    YYYY-MM-DD-bham_ and its name) was made since the repository last
+    changed - it has the same branches and tags, pointing to the same
+    commits.
+
+    Only the latest copy is compared (two git ls-remotes, however many
+    copies there are) - if the repository has changed since then, an
+    older copy matching it again would take a reverted change, which
+    isn't worth listing every copy for.
+
+    N.B. Copies made by the template backend never match, as GitHub does
+    not copy the history of a template.
+
+    args:
+        organisation: organisation the repository (and so its frozen
+            copies) is in
+        repo_name: name of the repository
+        default_branch: default branch of the repository
+
+    returns:
+        name of the latest frozen copy if it matches, otherwise None
+    """
+    pattern = re.compile(_FROZEN_PREFIX_RE + re.escape(repo_name) + '$')
+    names = _get_organisation_repo_names(organisation)
+    with _github_lock:
+        snapshot = max(
+            (name for name in names if pattern.match(name)), default=None
+        )
+    if snapshot is None:
+        return None
+    with tracer.span('match snapshot', repository=repo_name):
+        if _is_snapshot_of(
+            _remote_refs(organisation, repo_name), organisation, snapshot,
+            default_branch
+        ):
+            return snapshot
+    logger.debug(
+        "%s/%s has changed since it was frozen as %s",
+        organisation, repo_name, snapshot
+    )
+    return None
+
+def _journal_key(repo_url, freeze_date):
+    """
+    Returns the key the steps of freezing (or updating) repo_url for
+    freeze_date are journalled under.
+    """
+    return '%s %s' % (repo_url, freeze_date.isoformat())
+
+def _journalled(key, step, action, *args):
+    """
+    Does a step of the run, unless the journal shows it was done by an
+    earlier (interrupted) run, and journals it.
+
+    args:
+        key: journal key of the work the step is part of
+        step: name of the step
+        action: function doing the step, its return value (which must be
+            JSON serialisable) is journalled
+        args: arguments for action
+
+    returns:
+        value returned by action (or journalled when it was done before)
+    """
+    if run_journal is None:
+        return action(*args)
+    elif run_journal.done(key, step):
+        logger.info("Already done %s for %s, skipping", step, key)
+        return run_journal.value(key, step)
+    value = action(*args)
+    run_journal.record(key, step, value)
+    return value
+
+def _journal_value(key, step, default=None):
+    """
+    Returns the value journalled for step of key (default if it has not
+    been done, or there is no journal).
+    """
+    if run_journal is None:
+        return default
+    return run_journal.value(key, step, default)
+
+def freeze(repo_url, freeze_date, force=False, course_repository=None):
     """
     Actually freeze the repository given.
 
+    Each step is journalled (see _journalled), so when resuming a run
+    the steps already done are skipped.
+
     args:
         repo_url: Repository url to freeze
         force: Force a freeze even if the repo URL looks like it points
             to a frozen repo already.
+        course_repository: Url of the course the frozen copy should link
+            back to (defaults to repository)
+
+    If the frozen repository already exists (and was not created by
+    this run, according to the journal) it is an error, unless carry_on
+    is set in which case it is assumed to be a faithful snapshot and
+    used as it is.  If reuse_snapshots is set and the repository has not
+    changed since an earlier frozen copy was made (see
+    find_matching_snapshot), that copy is used instead.
 
     returns:
         New repository's url if the repository was frozen by this method.
         False if the repository was already frozen (and 'force' was not
-            true, so this method did nothing) or frozen url already
-            existed.
+            true, so this method did nothing).
     """
 
     logger.debug("Freezing repository: %s", repo_url)
+    if course_repository is None:
+        course_repository = repository
     (organisation, old_repo_name) = _get_organisation_repo_from_url(repo_url)
-    # Does the url path already start with something that looks like
-    # a YYYY-MM-DD-bham_ format (20..-*.-^.-bham_ where . is any digit,
-    # * is 0 or 1 and ^ is 0, 1, 2 or 3)?
-    if re.match('20[0-9]{2}-[01][0-9]-[0-3][0-9]-bham_',
-        old_repo_name):
+    if _looks_frozen(old_repo_name):
         logger.warning(
             "Repository '%s' looks like it is already frozen",
             repo_url
@@ -607,7 +1957,42 @@ def freeze(repo_url, freeze_date, force=False):
         else:
             logger.info("Force specified, freezing anyway.")
 
-    repo_name = '%s-bham_' % freeze_date.isoformat() + old_repo_name
+    repo_name = _frozen_repo_name(old_repo_name, freeze_date)
+    key = _journal_key(repo_url, freeze_date)
+    old_default_branch = github_default_branch(organisation, old_repo_name)
+
+    if _journal_value(key, 'created') is None and _github_repo_exists(
+        organisation, repo_name
+    ):
+        if not carry_on:
+            logger.error(
+                "Frozen repository %s/%s already exists (use --continue to"
+                " use it as it is)", organisation, repo_name
+            )
+            raise RuntimeError("Frozen repository already exists")
+        logger.info(
+            "Frozen repository %s/%s already exists, using it as it is",
+            organisation, repo_name
+        )
+        return _frozen_url(
+            organisation, repo_name, old_default_branch,
+            _get_github_repo(organisation, repo_name).clone_url
+        )
+
+    if reuse_snapshots and _journal_value(key, 'created') is None:
+        snapshot = _journalled(
+            key, 'snapshot matched', find_matching_snapshot,
+            organisation, old_repo_name, old_default_branch
+        )
+        if snapshot is not None:
+            logger.info(
+                "Repository %s has not changed since it was frozen as"
+                " %s/%s, linking to that", repo_url, organisation, snapshot
+            )
+            return _frozen_url(
+                organisation, snapshot, old_default_branch,
+                _get_github_repo(organisation, snapshot).clone_url
+            )
 
     if dry_run:
         logger.info(
@@ -619,32 +2004,52 @@ def freeze(repo_url, freeze_date, force=False):
             organisation,
             repo_name
         )
+    elif backend == 'template':
+        # Have GitHub copy the repository - nothing comes through here
+        new_repo_url = _journalled(
+            key, 'created', create_github_repo_from_template,
+            organisation, old_repo_name, repo_name
+        )
+        # Not journalled, GitHub may still be copying the content when a
+        # run stops and is continued
+        wait_for_template_copy(organisation, old_repo_name, repo_name)
+        logger.info(
+            "Generated repository from template which will be published"
+            " at: %s", new_repo_url
+        )
     else:
         # Create the new remote repository
-        new_repo_url = create_github_repo(organisation, repo_name)
+        new_repo_url = _journalled(
+            key, 'created', create_github_repo, organisation, repo_name
+        )
         logger.info(
             "Created repository which will be published at: %s",
             new_repo_url
         )
 
-    # This is why we need an access token rather than username/password
-    new_repo_user_url = new_repo_url.replace(
-        '://',
-        '://%(user)s@' % {
-            'user': settings['github']['accesstoken'],
-        }
-    )
+    new_repo_user_url = _add_access_token(new_repo_url)
 
-    if dry_run:
+    if backend == 'template':
+        # create_github_repo_from_template has already copied the content
+        pass
+    elif dry_run:
         logger.info(
             "DRY-RUN - Would have imported old repo, %s, to new repo, %s",
             repo_url,
             new_repo_url
         )
+    elif old_default_branch == 'gh-pages':
+        # Add the back link to the clone being pushed, saves cloning the
+        # new repository again afterwards.
+        _journalled(
+            key, 'pushed', import_to, repo_url, new_repo_user_url,
+            lambda repo: commit_backlink(
+                repo, old_default_branch, course_repository
+            )
+        )
     else:
-        import_to(repo_url, new_repo_user_url)
+        _journalled(key, 'pushed', import_to, repo_url, new_repo_user_url)
 
-    old_default_branch = github_default_branch(organisation, old_repo_name)
     if old_default_branch != 'master':
         if dry_run:
             logger.info(
@@ -654,7 +2059,8 @@ def freeze(repo_url, freeze_date, force=False):
                 old_default_branch
             )
         else:
-            set_github_default_branch(
+            _journalled(
+                key, 'default branch set', set_github_default_branch,
                 organisation, repo_name, old_default_branch
             )
             logger.debug(
@@ -673,8 +2079,15 @@ def freeze(repo_url, freeze_date, force=False):
                 "Old repository default branch was gh-pages.  Will set homepage"
                 " and update links."
             )
-            set_github_homepage(organisation, repo_name, repo_homepage)
-            update_frozen_repository(new_repo_user_url, repository)
+            _journalled(
+                key, 'homepage set', set_github_homepage,
+                organisation, repo_name, repo_homepage
+            )
+            if backend == 'template':
+                _journalled(
+                    key, 'backlink committed', update_frozen_repository,
+                    new_repo_user_url, course_repository, repo_url
+                )
         logger.info("Will return URL to github.io pages")
         result  = repo_homepage
     else:
@@ -691,6 +2104,164 @@ def freeze(repo_url, freeze_date, force=False):
 
     return result
 
+_SCHEDULE_COMMIT_MESSAGE = """Updated schedule with frozen urls.
+
+Automatic commit from freeze script.
+"""
+
+def _compile_url_matcher(urls):
+    """
+    Compiles a regular expression matching any of urls.
+
+    The expression is built from a trie of the urls, so urls sharing a
+    prefix (as urls in a schedule mostly do) share the work of matching
+    it, and where one url is a prefix of another the longer one matches.
+
+    args:
+        urls: iterable of (non-empty) strings to match
+
+    returns:
+        compiled regular expression
+    """
+    trie = {}
+    for url in urls:
+        node = trie
+        for char in url:
+            node = node.setdefault(char, {})
+        # Marks the end of a url
+        node[None] = None
+
+    def node_pattern(node):
+        branches = [
+            re.escape(char) + node_pattern(child)
+            for (char, child) in node.items() if char is not None
+        ]
+        if not branches:
+            return ''
+        elif len(branches) == 1 and None not in node:
+            return branches[0]
+        pattern = '(?:%s)' % '|'.join(branches)
+        if None in node:
+            # Greedy, so longer urls are preferred
+            pattern += '?'
+        return pattern
+
+    return re.compile(node_pattern(trie))
+
+def _rewrite_schedule(old_schedule, frozen_urls):
+    """
+    Replaces the urls in the lines of a schedule.
+
+    All the urls are replaced in a single pass over each line, so a
+    replacement is never itself rewritten by another mapping and the
+    longest url matching at any point wins.
+
+    args:
+        old_schedule: iterable of lines of the schedule file
+        frozen_urls: dict mapping the old url (key) to new url (value)
+
+    returns:
+        generator of the new lines
+    """
+    if not frozen_urls:
+        yield from old_schedule
+        return
+    matcher = _compile_url_matcher(frozen_urls)
+    replace = lambda match: frozen_urls[match.group(0)]
+    for line in old_schedule:
+        yield matcher.sub(replace, line)
+
+def _touch_index(index):
+    """
+    Makes a trivial change to the lines of the index file.
+
+    Github has recently (around July 2019) stopped updating git.io on
+    any file update, it only refreshes now if the index.md gets changed
+    (the schedule, which is included, is not longer sufficient)
+
+    This basically removes a blank line, if the last 2 lines in the
+    index file are blank, or adds a new blank line in any other case.
+
+    Only the last 2 lines are held back, the rest are passed straight
+    through.
+
+    args:
+        index: iterable of lines of the index file (with line endings)
+
+    returns:
+        generator of the new lines
+    """
+    last_lines = collections.deque()
+    for line in index:
+        last_lines.append(line)
+        if len(last_lines) > 2:
+            yield last_lines.popleft()
+    if list(last_lines) == ['\n', '\n']:
+        yield last_lines[0]
+    else:
+        yield from last_lines
+        yield '\n'
+
+def update_repo_links_via_api(organisation, repo_name, frozen_urls):
+    """
+    Updates the urls in the carpentries homepage without a clone.
+
+    Reads the schedule and index through the contents api, makes the
+    same changes as update_repo_links and writes them back as a single
+    commit on the default branch using the git data api.
+
+    args:
+        organisation: organisation of the course repository
+        repo_name: name of the course repository
+        frozen_urls: dict mapping the old url (key) to new url (value)
+
+    returns:
+        Nothing
+    """
+    gh_repo = _get_github_repo(organisation, repo_name)
+    branch = gh_repo.default_branch
+    ref = _github_api(gh_repo.get_git_ref, 'heads/%s' % branch)
+    base_commit = _github_api(gh_repo.get_git_commit, ref.object.sha)
+
+    tree = []
+    for (path, rewrite) in (
+        (
+            _get_schedule_file_relative_path(),
+            lambda lines: _rewrite_schedule(lines, frozen_urls)
+        ),
+        (_get_index_file_relative_path(), _touch_index),
+    ):
+        old_content = _get_github_file(gh_repo, path, base_commit.sha)
+        new_content = ''.join(rewrite(old_content.splitlines(keepends=True)))
+        if dry_run:
+            continue
+        blob = _github_api(
+            gh_repo.create_git_blob, new_content, 'utf-8', write=True
+        )
+        tree.append(
+            github.InputGitTreeElement(path, '100644', 'blob', sha=blob.sha)
+        )
+
+    if dry_run:
+        logger.info(
+            "DRY-RUN - Would commit updated schedule to %s of %s/%s",
+            branch, organisation, repo_name
+        )
+        return
+
+    new_tree = _github_api(
+        gh_repo.create_git_tree, tree, base_commit.tree, write=True
+    )
+    new_commit = _github_api(
+        gh_repo.create_git_commit, _SCHEDULE_COMMIT_MESSAGE, new_tree,
+        [base_commit], write=True
+    )
+    _github_api(ref.edit, new_commit.sha, write=True)
+    logger.info(
+        "Committed updated schedule to %s of %s/%s as %s",
+        branch, organisation, repo_name, new_commit.sha
+    )
+
 def update_repo_links(gitdirectory, frozen_urls):
     """
     Updates the urls in the clone of the carpentries homepage.
@@ -706,28 +2277,10 @@ def update_repo_links(gitdirectory, frozen_urls):
         Nothing
     """
     repo = git.Repo(gitdirectory)
-    old_schedule = _get_schedule_file(gitdirectory)
-    new_schedule = []
-    for line in old_schedule:
-        new_line = line
-        for (old_url, new_url) in frozen_urls.items():
-            new_line = new_line.replace(old_url, new_url)
-        new_schedule.append(new_line)
-    _write_schedule_file(gitdirectory, new_schedule)
-    index = _get_index_file(gitdirectory)
-    # Github has recently (around July 2019) stopped updating git.io on
-    # any file update, it only refreshes now if the index.md gets
-    # changed (the schedule, which is included, is not longer
-    # sufficient)
-    #
-    # This block of code basically removes a blank line, if the last 2
-    # lines in the index file are blank, or adds a new blank line in any
-    # other case.
-    if index[-2:] == ['', '']:
-        del index[-1]
-    else:
-        index.append('')
-    _write_index_file(gitdirectory, index)
+    _transform_schedule_file(
+        gitdirectory, lambda lines: _rewrite_schedule(lines, frozen_urls)
+    )
+    _transform_index_file(gitdirectory, _touch_index)
     ri = repo.index
     schedule_file_location = _get_schedule_file_relative_path()
     index_file_location = _get_index_file_relative_path()
@@ -736,10 +2289,7 @@ def update_repo_links(gitdirectory, frozen_urls):
         schedule_file_location, index_file_location
     )
     ri.add([schedule_file_location, index_file_location])
-    ri.commit("""Updated schedule with frozen urls.
-
-Automatic commit from freeze script.
-""")
+    ri.commit(_SCHEDULE_COMMIT_MESSAGE)
 
     if dry_run:
         logger.info(
@@ -749,7 +2299,341 @@ Automatic commit from freeze script.
     else:
         # This is why we make sure to have 'user@' in the remote url when
         # this was cloned at the start of do_freeze.
-        repo.remote('origin').push()
+        _push(repo)
+
+def freeze_all(work, force=False, jobs=1):
+    """
+    Freezes every repository in work, using up to jobs worker threads.
+    When mirroring (and not in dry-run mode), source repositories are
+    fetched ahead by a Prefetcher (see the prefetch setting).
+
+    A failure freezing one repository is logged but does not stop the
+    others being frozen.
+
+    args:
+        work: dict mapping a key (anything hashable identifying the
+            work) to a tuple of (repo url, freeze date, course
+            repository) - arguments for freeze()
+        force: Passed through to freeze()
+        jobs: Maximum number of repositories to freeze at once
+
+    returns:
+        tuple of (frozen, failed) - frozen is a dict mapping the key to
+        the frozen url, in the same order as work, and failed is a list
+        of the keys that could not be frozen.
+    """
+    global prefetcher
+    # Before any worker threads can be the first to use them
+    util.finish_lazy_imports()
+    # List each organisation once up front, rather than as each worker
+    # first needs it
+    organisations = set()
+    for (repo, _, _) in work.values():
+        try:
+            organisations.add(_get_organisation_repo_from_url(repo)[0])
+        except RuntimeError:
+            # Not a repository url, left to freeze_one to report
+            pass
+    for organisation in sorted(organisations):
+        try:
+            with _lease_github_client():
+                _get_organisation_repo_names(organisation)
+        except Exception:
+            # Leave it to the lessons in it to fail (or not)
+            logger.exception(
+                "Failed to list the repositories in %s", organisation
+            )
+
+    # Lessons matching a snapshot would be fetched for nothing
+    if prefetch and backend == 'mirror' and not (
+        dry_run or reuse_snapshots
+    ):
+        prefetcher = Prefetcher(prefetch, jobs)
+        for (repo, freeze_date, _) in work.values():
+            try:
+                (_, repo_name) = _get_organisation_repo_from_url(repo)
+            except RuntimeError:
+                # Not a repository url, nothing to fetch
+                continue
+            if (force or not _looks_frozen(repo_name)) and not (
+                run_journal is not None and run_journal.done(
+                    _journal_key(repo, freeze_date), 'pushed'
+                )
+            ):
+                prefetcher.prefetch(repo)
+
+    def freeze_one(repo, freeze_date, course_repository):
+        try:
+            with _lease_github_client(), tracer.span(
+                'freeze lesson', lesson=repo
+            ):
+                return freeze(repo, freeze_date, force, course_repository)
+        finally:
+            if prefetcher is not None:
+                prefetcher.discard(repo)
+
+    frozen = {}
+    failed = []
+    try:
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=jobs
+        ) as executor:
+            futures = [
+                (key, executor.submit(freeze_one, *arguments))
+                for (key, arguments) in work.items()
+            ]
+            # Collect in submission order so the result does not depend
+            # on which lesson happened to finish first.
+            for (key, future) in futures:
+                try:
+                    frozen_url = future.result()
+                except Exception:
+                    logger.exception("Failed to freeze %s", work[key][0])
+                    failed.append(key)
+                    continue
+                if frozen_url:
+                    frozen[key] = frozen_url
+    finally:
+        if prefetcher is not None:
+            prefetcher.shutdown()
+            prefetcher = None
+    return (frozen, failed)
+
+def _course_repository_url(repo_url):
+    """
+    Returns the github.com url of a course given either its repository
+    or its github.io pages.
+    """
+    if 'github.io' in repo_url.lower():
+        url = urllib.parse.urlparse(repo_url)
+        new_url = _github_io_to_github_com(url)
+        repo_url = new_url.geturl()
+        logger.info("Converted github.io url to %s", repo_url)
+    return repo_url
+
+def _read_course_via_api(repo_url):
+    """
+    Reads the schedule of a course through the GitHub api.
+
+    args:
+        repo_url: github.com url of the course repository
+
+    returns:
+        list of repos to freeze, as get_repos_to_freeze
+    """
+    (organisation, course_name) = _get_organisation_repo_from_url(repo_url)
+    gh_repo = _get_github_repo(organisation, course_name)
+    schedule = _get_github_file(
+        gh_repo,
+        _get_schedule_file_relative_path(),
+        gh_repo.default_branch
+    )
+    logger.info("Read schedule from repository: %s", repo_url)
+    return _find_repos_in_schedule(schedule.splitlines(keepends=True))
+
+def _read_course(repo_url, tempdir):
+    """
+    Gets the schedule of a course and the repositories it links to.
+
+    Clones the course into tempdir, unless course_via_api is set in
+    which case the schedule is read through the GitHub api instead.
+
+    args:
+        repo_url: string address to the course repository
+        tempdir: directory to clone into
+
+    returns:
+        tuple of (repository url, list of repos to freeze) - the
+        repository url is the github.com url of the course (github.io
+        urls are converted) and the list is as get_repos_to_freeze.
+    """
+    repo_url = _course_repository_url(repo_url)
+
+    if course_via_api:
+        to_freeze = _read_course_via_api(repo_url)
+    else:
+        clone_url = repo_url
+        # Make life easy when we try to push the changes at the end.
+        if 'github' in clone_url.lower():
+            clone_url = _add_access_token(clone_url)
+        with tracer.span('clone course'):
+            _clone_course(clone_url, tempdir)
+        logger.info("Fetched repository: %s", repo_url)
+
+        to_freeze = get_repos_to_freeze(tempdir)
+    logger.info("Need to freeze: %s", to_freeze)
+    return (repo_url, to_freeze)
+
+def _update_course(repo_url, tempdir, frozen):
+    """
+    Updates the links in a course read by _read_course.
+
+    args:
+        repo_url: course repository url, as returned by _read_course
+        tempdir: directory the course was cloned into
+        frozen: dict mapping the old url (key) to new url (value)
+
+    returns:
+        Nothing
+    """
+    if course_via_api:
+        (organisation, course_name) = _get_organisation_repo_from_url(
+            repo_url
+        )
+        update_repo_links_via_api(organisation, course_name, frozen)
+    else:
+        update_repo_links(tempdir, frozen)
+
+def do_batch_freeze(courses, force=False):
+    """
+    Freeze several courses at once.
+
+    Reads the schedule of every course first, then freezes each distinct
+    (repository, freeze date) pair once - even if several courses link
+    to it - and finally updates the links in every course.  The frozen
+    copies link back to the first course that uses them.
+
+    Unless in dry-run mode, the steps done are recorded in a journal
+    (journal_file) which is removed once everything has been done.  If
+    carry_on is set the journal of an interrupted run is resumed,
+    skipping the steps it had done.
+
+    args:
+        courses: list of (course repository url, freeze date) tuples
+        force: Passed through to freeze()
+
+    returns: Nothing
+    """
+    with _run(courses=len(courses)):
+        _batch_freeze(courses, force)
+
+@contextlib.contextmanager
+def _run(**args):
+    """
+    Context manager for a run (of do_batch_freeze or apply_plan) -
+    journals it (unless in dry-run mode), removing the journal once the
+    run has finished or keeping it to be resumed if it fails, and
+    reports what the run took at the end.
+
+    args:
+        args: details to record with the run's trace span
+    """
+    global run_journal
+    if not dry_run:
+        run_journal = journal.Journal(journal_file, resume=carry_on)
+    try:
+        with tracer.span('run', **args):
+            yield
+    except BaseException:
+        if run_journal is not None:
+            run_journal.close()
+            logger.info(
+                "Resume this run with --continue (journal is in %s)",
+                journal_file
+            )
+        raise
+    else:
+        if run_journal is not None:
+            run_journal.remove()
+    finally:
+        run_journal = None
+        if trace_file:
+            tracer.write(trace_file)
+        logger.info("Run summary:")
+        for line in run_summary.table():
+            logger.info("  %s", line)
+        if summary_file:
+            run_summary.write(summary_file)
+        for client in _github_clients or []:
+            logger.info(
+                "GitHub %s: used for %d lessons or courses, made %d api"
+                " calls (waiting %.1fs for rate limits), budget: %s",
+                client, client.leases, client.scheduler.calls,
+                client.scheduler.waited, client.scheduler.budget()
+            )
+
+def _batch_freeze(courses, force):
+    # The work of do_batch_freeze, once the journal is set up
+    with contextlib.ExitStack() as stack:
+        read_courses = []
+        work = {}
+        for (course_url, course_date) in courses:
+            course_key = _journal_key(course_url, course_date)
+            updated = _journal_value(course_key, 'course updated', {})
+            to_freeze = _journal_value(course_key, 'schedule read')
+            if to_freeze is not None and all(
+                homepage in updated for (homepage, _) in to_freeze
+            ):
+                logger.info("Already updated %s, skipping", course_url)
+                continue
+            tempdir = stack.enter_context(tempfile.TemporaryDirectory())
+            logger.debug("Using temporary directory: %s", tempdir)
+            with _lease_github_client(), tracer.span(
+                'read course', course=course_url
+            ):
+                (course_url, found) = _read_course(course_url, tempdir)
+            # Once partly updated the schedule no longer links to
+            # everything that was to be frozen, so go by the journal
+            to_freeze = [
+                tuple(link) for link in _journalled(
+                    course_key, 'schedule read', lambda: found
+                )
+            ]
+            read_courses.append(
+                (course_url, course_date, course_key, tempdir, to_freeze)
+            )
+            # Some repos are specified twice - e.g. the R and Python
+            # inputs are on the schedule twice, once each day.  Trying to
+            # re-freeze the same repository will fail (and makes no
+            # sense).
+            for (homepage, repo) in to_freeze:
+                work.setdefault(
+                    (repo, course_date), (repo, course_date, course_url)
+                )
+        logger.info(
+            "Need to freeze %d distinct repositories for %d courses",
+            len(work), len(read_courses)
+        )
+
+        with tracer.span('freeze lessons', lessons=len(work)):
+            (frozen, failed) = freeze_all(work, force, jobs)
+
+        for (
+            course_url, course_date, course_key, tempdir, to_freeze
+        ) in read_courses:
+            updated = _journal_value(course_key, 'course updated', {})
+            course_frozen = {}
+            for (homepage, repo) in to_freeze:
+                if (repo, course_date) in frozen and homepage not in updated:
+                    course_frozen[homepage] = frozen[(repo, course_date)]
+            if len(course_frozen):
+                with _lease_github_client(), tracer.span(
+                    'update course', course=course_url
+                ):
+                    _update_course(course_url, tempdir, course_frozen)
+                if run_journal is not None:
+                    run_journal.record(
+                        course_key, 'course updated',
+                        dict(updated, **course_frozen)
+                    )
+            elif updated:
+                logger.info("Already updated %s", course_url)
+            else:
+                logger.warning(
+                    "No repositories frozen for %s - maybe none found or all"
+                    " already frozen?", course_url
+                 )
+
+        if failed:
+            raise RuntimeError(
+                "Failed to freeze %d repositories: %s" % (
+                    len(failed),
+                    ', '.join(
+                        "%s (%s)" % (repo, date.isoformat())
+                        for (repo, date) in failed
+                    )
+                )
+            )
 
 def do_freeze(repo_url, force=False):
     """
@@ -758,6 +2642,8 @@ def do_freeze(repo_url, force=False):
     Clones the repository, finds repositories referenced by the schedule
     and creates new snapshot repositories of them in GitHub.  Then
     updates the links in the schedule and commits the new version back.
+    If course_via_api is set the schedule is read and updated through
+    the GitHub api instead of a clone.
 
     args:
       repo_url: string address to the repository
@@ -765,57 +2651,419 @@ def do_freeze(repo_url, force=False):
 
     returns: Nothing
     """
-    with tempfile.TemporaryDirectory() as tempdir:
-        logger.debug("Using temporary directory: %s", tempdir)
+    do_batch_freeze([(repo_url, freeze_date)], force)
+
+def plan_lesson(repo_url, freeze_date, course_repository, force=False):
+    """
+    Works out what freeze would do for a repository, without cloning it
+    or changing anything.  Only the (cached) listing of its organisation
+    and of the course's are used, so there is usually nothing to fetch
+    from GitHub for it.
 
-        if 'github.io' in repo_url.lower():
-            url = urllib.parse.urlparse(repo_url)
-            new_url = _github_io_to_github_com(url)
-            repo_url = new_url.geturl()
-            logger.info("Converted github.io url to %s", repo_url)
+    args:
+        repo_url: Repository url to freeze
+        freeze_date: date to freeze it for
+        course_repository: Url of the course the frozen copy would link
+            back to
+        force: as for freeze
 
-        # Make life easy when we try to push the changes at the end.
-        if 'github' in repo_url.lower() and '@' not in repo_url:
-            repo_url = repo_url.replace(
-                '://',
-                '://%(user)s@' % {
-                    'user': settings['github']['accesstoken'],
-                }
+    returns:
+        dict describing the work (see plan_freeze), or None if the
+        repository looks frozen already (and force is not set)
+    """
+    try:
+        (organisation, old_repo_name) = _get_organisation_repo_from_url(
+            repo_url
+        )
+    except RuntimeError:
+        return {
+            'source': repo_url,
+            'freeze_date': freeze_date.isoformat(),
+            'course': course_repository,
+            'organisation': None,
+            'repository': None,
+            'steps': [],
+            'error': "Not a repository url",
+        }
+    if _looks_frozen(old_repo_name) and not force:
+        logger.warning(
+            "Repository '%s' looks like it is already frozen, would not"
+            " freeze it without a force", repo_url
+        )
+        return None
+
+    repo_name = _frozen_repo_name(old_repo_name, freeze_date)
+    lesson = {
+        'source': repo_url,
+        'freeze_date': freeze_date.isoformat(),
+        'course': course_repository,
+        'organisation': organisation,
+        'repository': repo_name,
+        'steps': [],
+    }
+    if not _github_repo_exists(organisation, old_repo_name):
+        lesson['error'] = "Repository not found"
+        return lesson
+    gh_repo = _get_github_repo(organisation, old_repo_name)
+    default_branch = gh_repo.default_branch
+    lesson['default_branch'] = default_branch
+    lesson['homepage'] = None
+
+    if _github_repo_exists(organisation, repo_name):
+        lesson['url'] = _frozen_url(
+            organisation, repo_name, default_branch,
+            _get_github_repo(organisation, repo_name).clone_url
+        )
+        if not carry_on:
+            lesson['error'] = "Frozen repository already exists"
+        return lesson
+
+    if reuse_snapshots:
+        snapshot = find_matching_snapshot(
+            organisation, old_repo_name, default_branch
+        )
+        if snapshot is not None:
+            lesson['snapshot'] = snapshot
+            lesson['url'] = _frozen_url(
+                organisation, snapshot, default_branch,
+                _get_github_repo(organisation, snapshot).clone_url
             )
-        git.Repo.clone_from(repo_url, tempdir)
-        logger.info("Fetched repository: %s", repo_url)
+            return lesson
 
-        to_freeze = get_repos_to_freeze(tempdir)
-        logger.info("Need to freeze: %s", to_freeze)
-
-        # if _test:
-        #     # Abort
-        #     warnings.warn("***TEST SET TO TRUE - ABORTING***", RuntimeWarning)
-        #     logger.info("do_freeze is aborting after clone and get_repos_to_freeze")
-        #     return
-
-        frozen = {}
-        for (homepage, repo) in to_freeze:
-            if homepage in frozen:
-                # Some repos are specified twice - e.g. the R and Python
-                # inputs are on the schedule twice, once each day.
-                # Trying to re-freeze the same repository will fail (and
-                # makes no sense).
-                continue # Skip to next repo.
-            frozen_url = freeze(repo, freeze_date, force)
-            if frozen_url:
-                frozen[homepage] = frozen_url
-
-        if len(frozen):
-            update_repo_links(tempdir, frozen)
+    # As the url of the frozen repository will be on GitHub
+    lesson['url'] = _frozen_url(
+        organisation, repo_name, default_branch,
+        'https://github.com/%s/%s' % (organisation, repo_name)
+    )
+    lesson['steps'].append('created')
+    if backend == 'template':
+        if not gh_repo.is_template:
+            lesson['error'] = "Not a template repository"
+    else:
+        lesson['steps'].append('pushed')
+    if default_branch != 'master':
+        lesson['steps'].append('default branch set')
+    if default_branch == 'gh-pages':
+        lesson['homepage'] = lesson['url']
+        lesson['backlink'] = _get_backlink(course_repository)[0]
+        lesson['steps'].append('homepage set')
+        if backend == 'template':
+            lesson['steps'].append('backlink committed')
+    return lesson
+
+def plan_freeze(courses, force=False):
+    """
+    Works out what do_batch_freeze would do for courses, without cloning
+    anything or making any changes.
+
+    Each schedule is read through the GitHub api and each organisation
+    is listed once (see _get_organisation_repo_names), which is all
+    that is needed - a handful of api calls for a normal course.  If
+    reuse_snapshots is set the refs of the lessons (and their earlier
+    frozen copies) are listed too, with git ls-remote.
+
+    args:
+        courses: list of (course repository url, freeze date) tuples
+        force: Passed through to plan_lesson
+
+    returns:
+        dict (that can be turned into JSON) of
+        'backend': backend the plan is for
+        'lessons': list of the distinct repositories to freeze, each a
+            dict of 'source' (repository url), 'freeze_date', 'course'
+            (the course it will link back to), 'organisation' and
+            'repository' (name) of the frozen copy (None if the source
+            is not a repository url), 'default_branch',
+            'homepage' (None if it is not set), 'url' (what the schedule
+            will link to), 'backlink' (for gh-pages repositories),
+            'steps' (the journal steps freeze would do - none if the
+            frozen copy already exists and will be used as it is),
+            'snapshot' (name of the earlier frozen copy that will be used
+            instead, see reuse_snapshots) and 'error' (if it cannot be
+            frozen)
+        'courses': list of dicts of 'course' (repository url),
+            'freeze_date' and 'links' (dict mapping each url in the
+            schedule that would be changed to its new url)
+    """
+    plan = {'backend': backend, 'lessons': [], 'courses': []}
+    with _lease_github_client():
+        read_courses = []
+        work = {}
+        for (course_url, course_date) in courses:
+            course_url = _course_repository_url(course_url)
+            # Lists the organisation (and caches its repositories), so
+            # the lessons usually in it need no more api calls
+            _get_organisation_repo_names(
+                _get_organisation_repo_from_url(course_url)[0]
+            )
+            to_freeze = _read_course_via_api(course_url)
+            read_courses.append((course_url, course_date, to_freeze))
+            for (homepage, repo) in to_freeze:
+                work.setdefault(
+                    (repo, course_date), (repo, course_date, course_url)
+                )
+
+        planned = {}
+        for (key, arguments) in work.items():
+            lesson = plan_lesson(*arguments, force=force)
+            if lesson is not None:
+                plan['lessons'].append(lesson)
+                if 'error' not in lesson:
+                    planned[key] = lesson['url']
+
+        for (course_url, course_date, to_freeze) in read_courses:
+            plan['courses'].append({
+                'course': course_url,
+                'freeze_date': course_date.isoformat(),
+                'links': {
+                    homepage: planned[(repo, course_date)]
+                    for (homepage, repo) in to_freeze
+                    if (repo, course_date) in planned
+                },
+            })
+    return plan
+
+def do_plan(courses, force=False):
+    """
+    Works out what freezing courses would do (see plan_freeze) and logs
+    it, writing it to plan_file if that is set.
+
+    args:
+        courses: list of (course repository url, freeze date) tuples
+        force: Passed through to plan_freeze
+
+    returns:
+        the plan
+    """
+    with tracer.span('plan', courses=len(courses)):
+        plan = plan_freeze(courses, force)
+    errors = 0
+    for lesson in plan['lessons']:
+        target = '%s/%s' % (lesson['organisation'], lesson['repository'])
+        if 'error' in lesson:
+            errors += 1
+            if lesson['repository'] is None:
+                logger.error(
+                    "PLAN - Cannot freeze %s: %s",
+                    lesson['source'], lesson['error']
+                )
+            else:
+                logger.error(
+                    "PLAN - Cannot freeze %s as %s: %s",
+                    lesson['source'], target, lesson['error']
+                )
+        elif lesson['steps']:
+            logger.info(
+                "PLAN - Would freeze %s as %s (%s)",
+                lesson['source'], target, ', '.join(lesson['steps'])
+            )
+        elif 'snapshot' in lesson:
+            logger.info(
+                "PLAN - Would use %s/%s for %s, which has not changed since"
+                " it was frozen", lesson['organisation'], lesson['snapshot'],
+                lesson['source']
+            )
         else:
-            logger.warning(
-                "No repositories frozen - maybe none found or all already"
-                " frozen?"
-             )
+            logger.info(
+                "PLAN - Would use %s, which already exists, for %s",
+                target, lesson['source']
+            )
+    for course in plan['courses']:
+        logger.info(
+            "PLAN - Would update %d links in %s",
+            len(course['links']), course['course']
+        )
+        for (old_url, new_url) in course['links'].items():
+            logger.info("PLAN -   %s -> %s", old_url, new_url)
+    logger.info(
+        "Planned %d lessons for %d courses with %d GitHub api calls",
+        len(plan['lessons']), len(plan['courses']),
+        sum(run_summary.as_dict()['api_calls'].values())
+    )
+    if plan_file:
+        # Even if it has errors, so they can be looked into
+        write_plan(plan, plan_file)
+    if errors:
+        raise RuntimeError("Cannot freeze %d repositories" % errors)
+    return plan
+
+def write_plan(plan, path):
+    """
+    Writes a plan (see plan_freeze) to path as JSON.
+    """
+    with open(path, 'w') as out:
+        json.dump(plan, out, indent=2)
+        out.write('\n')
+    logger.info("Wrote plan to %s", path)
 
-if __name__ == '__main__':
-    process_commandline()
+def read_plan(path):
+    """
+    Reads a plan written by write_plan.
+
+    args:
+        path: file to read
+
+    returns:
+        the plan
+    """
+    try:
+        with open(path) as plan:
+            return json.load(plan)
+    except ValueError:
+        logger.error("%s is not a plan written by --save-plan", path)
+        raise RuntimeError("Invalid plan")
+
+def apply_plan(plan):
+    """
+    Does what a plan (see plan_freeze) says - freezes its lessons, up to
+    jobs at once (see freeze_all), then updates the links in its courses
+    to the frozen copies.
+
+    Like do_batch_freeze the run is journalled, so it can be resumed
+    with --continue if it is interrupted.
+
+    Before anything is done the lessons are checked against GitHub, and
+    if any has changed since the plan was made (e.g. its default branch)
+    nothing is done - make a new plan.
+
+    args:
+        plan: plan to apply (as returned by plan_freeze or read_plan)
+
+    returns:
+        Nothing
+    """
+    if plan['backend'] != backend:
+        logger.error(
+            "The plan is for the %s backend (use --backend %s)",
+            plan['backend'], plan['backend']
+        )
+        raise RuntimeError("Plan is for another backend")
+    problems = [lesson for lesson in plan['lessons'] if 'error' in lesson]
+    for lesson in problems:
+        logger.error(
+            "Plan cannot freeze %s: %s", lesson['source'], lesson['error']
+        )
+    if problems:
+        raise RuntimeError("Plan has %d errors" % len(problems))
+    # Check against GitHub as it is now, not as it was when planning
+    _forget_github_repos()
+    with _run(lessons=len(plan['lessons']), courses=len(plan['courses'])):
+        _apply_plan(plan)
+
+def _apply_plan(plan):
+    # The work of apply_plan, once the journal is set up
+    work = {}
+    # Url each frozen url in the plan should really be (only known once
+    # frozen, if the repository will not be published from gh-pages)
+    frozen_urls = {}
+    with _lease_github_client():
+        for lesson in plan['lessons']:
+            (organisation, old_repo_name) = _get_organisation_repo_from_url(
+                lesson['source']
+            )
+            # Checked from the listing, rather than a call per lesson
+            _get_organisation_repo_names(organisation)
+            if github_default_branch(
+                organisation, old_repo_name
+            ) != lesson['default_branch']:
+                logger.error(
+                    "The default branch of %s has changed since the plan"
+                    " was made", lesson['source']
+                )
+                raise RuntimeError("Plan is out of date")
+            if not lesson['steps']:
+                # Already exists, use it as it is
+                frozen_urls[lesson['url']] = lesson['url']
+                continue
+            date = _parse_date(lesson['freeze_date'])
+            work[lesson['url']] = (lesson['source'], date, lesson['course'])
+
+    # Everything left in the plan is to be frozen, whatever its name
+    with tracer.span('freeze lessons', lessons=len(work)):
+        (frozen, failed) = freeze_all(work, force=True, jobs=jobs)
+    frozen_urls.update(frozen)
+
+    for course in plan['courses']:
+        course_key = _journal_key(
+            course['course'], _parse_date(course['freeze_date'])
+        )
+        updated = _journal_value(course_key, 'course updated', {})
+        course_frozen = {
+            old_url: frozen_urls[new_url]
+            for (old_url, new_url) in course['links'].items()
+            if new_url in frozen_urls and old_url not in updated
+        }
+        if not course_frozen:
+            logger.info("Nothing to update in %s", course['course'])
+            continue
+        with _lease_github_client(), tracer.span(
+            'update course', course=course['course']
+        ), tempfile.TemporaryDirectory() as tempdir:
+            if not course_via_api:
+                with tracer.span('clone course'):
+                    _clone_course(
+                        _add_access_token(course['course']), tempdir
+                    )
+            _update_course(course['course'], tempdir, course_frozen)
+        if run_journal is not None:
+            run_journal.record(
+                course_key, 'course updated', dict(updated, **course_frozen)
+            )
+
+    if failed:
+        raise RuntimeError(
+            "Failed to freeze %d repositories: %s" % (
+                len(failed), ', '.join(work[url][0] for url in failed)
+            )
+        )
+
+def read_manifest(manifest_file):
+    """
+    Reads a manifest of courses to freeze.
+
+    Each line is the course repository and the freeze date for it,
+    separated by whitespace.  Blank lines and lines starting with '#'
+    are ignored.
+
+    args:
+        manifest_file: name of the file to read
+
+    returns:
+        list of (course repository, freeze date) tuples
+    """
+    courses = []
+    with open(manifest_file) as manifest:
+        for (number, line) in enumerate(manifest, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                (course, date) = line.split(None, 1)
+                parsed = _parse_date(date)
+                if parsed is None:
+                    raise ValueError("Not a date: %s" % date)
+                courses.append((course, parsed))
+            except ValueError:
+                logger.error(
+                    "Cannot understand line %d of %s: %s",
+                    number, manifest_file, line
+                )
+                raise RuntimeError("Invalid manifest")
+    return courses
+
+def load_settings():
+    """
+    Reads the settings file (settings_file) into settings, checking the
+    mandatory settings are present, and sets up the retry policy and the
+    mirror cache if they are configured.
+
+    args:
+        None
+
+    returns:
+        Nothing
+    """
+    global settings
     settings = util.read_settings(settings_file)
     # Check for mandatory settings
     # Lots of this code relies on there being an access token
@@ -825,10 +3073,39 @@ if __name__ == '__main__':
             settings_file
         )
         raise RuntimeError("No GitHub settings found.")
-    elif 'accesstoken' not in settings['github']:
+    elif not settings['github'].getlist('accesstoken'):
         logger.error(
             "No access token found for GitHub! (Have they been put in %s?)",
             settings_file
         )
         raise RuntimeError("No GitHub access token")
-    do_freeze(repository, force)
+
+    if 'retry' in settings:
+        global retry_policy
+        retry_settings = settings['retry']
+        retry_policy = retry.RetryPolicy(
+            attempts=int(retry_settings.get('attempts', 5)),
+            base_delay=float(retry_settings.get('delay', 1)),
+            max_delay=float(retry_settings.get('maxdelay', 60)),
+        )
+
+    if 'mirrorcache' in settings:
+        global mirror_cache
+        max_size = settings['mirrorcache'].get('maxsize')
+        mirror_cache = mirrorcache.MirrorCache(
+            os.path.expanduser(settings['mirrorcache']['directory']),
+            mirrorcache.parse_size(max_size) if max_size else None
+        )
+        logger.debug("Using mirror cache in %s", mirror_cache.root)
+
+if __name__ == '__main__':
+    process_commandline()
+    load_settings()
+    if apply_file is not None:
+        apply_plan(read_plan(apply_file))
+    elif plan_only:
+        do_plan(courses or [(repository, freeze_date)], force)
+    elif courses is not None:
+        do_batch_freeze(courses, force)
+    else:
+        do_freeze(repository, force)
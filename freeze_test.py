@@ -1,14 +1,25 @@
+import collections
 import datetime
 import importlib
+import json
 import logging
 import os
 import os.path
 import shutil
+import subprocess
+import sys
 import tempfile
+import threading
 import unittest
+import unittest.mock
 import urllib.parse
 
+import git
+
+import fakegithub
 import freeze
+import mirrorcache
+import retry
 
 # Uncommenting this can be handy for examining why test fail
 #logging.basicConfig(level=logging.DEBUG)
@@ -21,7 +32,19 @@ default_settings = {
     'carry_on': False,
     'freeze_date': None,
     'settings_file': 'settings.ini',
-    'dry_run': False
+    'dry_run': False,
+    'plan_only': False,
+    'plan_file': None,
+    'apply_file': None,
+    'jobs': 1,
+    'prefetch': 1,
+    'shallow_course': False,
+    'course_via_api': False,
+    'reuse_snapshots': False,
+    'courses': None,
+    'journal_file': 'freeze-journal.jsonl',
+    'trace_file': None,
+    'summary_file': None,
 }
 
 minimal_commandline_args = {
@@ -90,7 +113,7 @@ class TestCommandLine(unittest.TestCase):
             if add_min_args:
                 args.extend(minimal_commandline_args['args'])
         freeze.process_commandline(args)
-        test_values = minimal_commandline_args['test_values']
+        test_values = dict(minimal_commandline_args['test_values'])
         test_values.update(kwargs)
         self._check_setting_values(**test_values)
 
@@ -175,7 +198,1278 @@ class TestCommandLine(unittest.TestCase):
             msg="--dry-run and --no-dry-run together should exit with error"
                 " state"
         )
-   
+
+    def test_process_commandline_jobs(self):
+        self._test_args(['--jobs', '4'], jobs=4)
+
+    def test_process_commandline_jobs_invalid(self):
+        with self.assertRaises(SystemExit) as cm:
+            self._test_args(['-j', '0'])
+        self.assertEqual(
+            cm.exception.code, 1,
+            msg="--jobs 0 should exit with error state"
+        )
+
+    def test_process_commandline_manifest(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.txt') as manifest:
+            manifest.write("https://dummy.repo.tld/some-repo.git 2000-01-01\n")
+            manifest.flush()
+            freeze.process_commandline(['--manifest', manifest.name])
+            self.assertEqual(
+                freeze.courses,
+                [("https://dummy.repo.tld/some-repo.git",
+                  datetime.date(2000, 1, 1))]
+            )
+            # Can't have both
+            with self.assertRaises(SystemExit) as cm:
+                self._test_args(['--manifest', manifest.name])
+            self.assertEqual(cm.exception.code, 2)
+
+    def test_process_commandline_continue(self):
+        self._test_args(
+            ['--continue', '--journal', 'run.jsonl'],
+            carry_on=True, journal_file='run.jsonl'
+        )
+
+    def test_process_commandline_trace(self):
+        self._test_args(['--trace', 'trace.json'], trace_file='trace.json')
+
+    def test_process_commandline_plan(self):
+        self._test_args(['--plan'], plan_only=True)
+
+    def test_process_commandline_reuse_snapshots(self):
+        self._test_args(['--reuse-snapshots'], reuse_snapshots=True)
+
+    def test_process_commandline_save_plan(self):
+        self._test_args(
+            ['--save-plan', 'plan.json'], plan_only=True, plan_file='plan.json'
+        )
+
+    def test_process_commandline_apply(self):
+        freeze.process_commandline(['--apply', 'plan.json'])
+        self.assertEqual(freeze.apply_file, 'plan.json')
+        self.assertIsNone(freeze.repository)
+        # Nothing to plan or freeze besides the plan
+        for args in (
+            ['--apply', 'plan.json', '--plan'],
+            ['--apply', 'plan.json', 'https://dummy.repo.tld/some-repo.git'],
+        ):
+            with self.assertRaises(SystemExit) as cm:
+                self._test_args(args, add_min_args=False)
+            self.assertEqual(cm.exception.code, 2)
+
+    def test_process_commandline_summary(self):
+        self._test_args(
+            ['--summary', 'summary.json'], summary_file='summary.json'
+        )
+
+    def test_process_commandline_free_form_date(self):
+        self._test_args(
+            ["https://dummy.repo.tld/some-repo.git", "1st January 2000"],
+            add_min_args=False
+        )
+
+    def test_process_commandline_invalid_date(self):
+        with self.assertRaises(SystemExit) as cm:
+            self._test_args(
+                ["https://dummy.repo.tld/some-repo.git", "not a date"],
+                add_min_args=False
+            )
+        self.assertEqual(cm.exception.code, 2)
+
+    def test_regression_startup_imports(self):
+        # Nothing slow to import should be needed to check the command
+        # line (with an ISO date)
+        output = subprocess.run(
+            [
+                sys.executable, '-c',
+                'import sys, freeze;'
+                ' freeze.process_commandline(["repo", "2000-01-01"]);'
+                ' print(" ".join(sorted(set(sys.modules) & {'
+                '"dateparser.date", "git.repo", "github.MainClass"})))'
+            ],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            check=True, capture_output=True, text=True
+        )
+        self.assertEqual(output.stdout.strip(), '')
+
+    def test_process_commandline_prefetch(self):
+        self._test_args(['--prefetch', '0'], prefetch=0)
+        self._reset_settings()
+        with self.assertRaises(SystemExit) as cm:
+            self._test_args(['--prefetch', '-1'])
+        self.assertEqual(
+            cm.exception.code, 1,
+            msg="--prefetch -1 should exit with error state"
+        )
+
+
+class FreezeAllTest(unittest.TestCase):
+    work = {
+        'a': ('https://github.com/org/a', datetime.date(2000, 1, 1), None),
+        'b': ('https://github.com/org/b', datetime.date(2000, 1, 1), None),
+        'c': ('https://github.com/org/c', datetime.date(2000, 1, 1), None),
+    }
+
+    @staticmethod
+    def _fake_freeze(repo_url, freeze_date, force=False, course=None):
+        if repo_url.endswith('/b'):
+            raise RuntimeError("Simulated failure")
+        return repo_url + '-frozen'
+
+    @unittest.mock.patch.object(freeze, 'prefetch', 0)
+    @unittest.mock.patch.object(
+        freeze, 'settings', {'github': {'accesstoken': '12345'}}
+    )
+    @unittest.mock.patch.object(freeze, '_github_clients', None)
+    @unittest.mock.patch.object(freeze, '_get_organisation_repo_names')
+    def test_freeze_all(self, mock_list):
+        for jobs in (1, 3):
+            with unittest.mock.patch.object(
+                freeze, 'freeze', side_effect=self._fake_freeze
+            ) as mock_freeze:
+                (frozen, failed) = freeze.freeze_all(self.work, jobs=jobs)
+            # Failure does not stop others
+            self.assertEqual(mock_freeze.call_count, 3)
+            self.assertEqual(
+                list(frozen.items()),
+                [
+                    ('a', 'https://github.com/org/a-frozen'),
+                    ('c', 'https://github.com/org/c-frozen'),
+                ]
+            )
+            self.assertEqual(failed, ['b'])
+            # Organisation listed once, up front
+            mock_list.assert_called_once_with('org')
+            mock_list.reset_mock()
+
+    @unittest.mock.patch.object(freeze, 'prefetch', 0)
+    @unittest.mock.patch.object(
+        freeze, 'settings', {'github': {'accesstoken': '12345'}}
+    )
+    @unittest.mock.patch.object(freeze, '_github_clients', None)
+    @unittest.mock.patch.object(freeze, '_get_organisation_repo_names')
+    def test_freeze_all_bad_url(self, mock_list):
+        # A link in the schedule that is not to a lesson
+        work = dict(self.work)
+        work['d'] = (
+            'https://software-carpentry.org/', datetime.date(2000, 1, 1), None
+        )
+        def fake_freeze(repo_url, freeze_date, force=False, course=None):
+            freeze._get_organisation_repo_from_url(repo_url)
+            return self._fake_freeze(repo_url, freeze_date, force, course)
+        with unittest.mock.patch.object(
+            freeze, 'freeze', side_effect=fake_freeze
+        ), self.assertLogs(freeze.logger, 'ERROR'):
+            (frozen, failed) = freeze.freeze_all(work, jobs=2)
+        self.assertEqual(list(frozen), ['a', 'c'])
+        self.assertEqual(failed, ['b', 'd'])
+        mock_list.assert_called_once_with('org')
+
+    @unittest.mock.patch.object(freeze, 'prefetch', 1)
+    @unittest.mock.patch.object(
+        freeze, 'settings', {'github': {'accesstoken': '12345'}}
+    )
+    @unittest.mock.patch.object(freeze, '_github_clients', None)
+    @unittest.mock.patch.object(freeze, '_get_organisation_repo_names')
+    @unittest.mock.patch.object(freeze, 'Prefetcher')
+    def test_prefetch_bad_url(self, mock_prefetcher, mock_list):
+        work = {
+            'a': self.work['a'],
+            'd': (
+                'https://software-carpentry.org/', datetime.date(2000, 1, 1),
+                None
+            ),
+        }
+        with unittest.mock.patch.object(
+            freeze, 'freeze', side_effect=self._fake_freeze
+        ), self.assertLogs(freeze.logger, 'ERROR'):
+            (frozen, failed) = freeze.freeze_all(work, jobs=2)
+        self.assertEqual(list(frozen), ['a', 'd'])
+        # Only the lesson fetched
+        mock_prefetcher.return_value.prefetch.assert_called_once_with(
+            'https://github.com/org/a'
+        )
+
+
+class ManifestTest(unittest.TestCase):
+    def test_read_manifest(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.txt') as manifest:
+            manifest.write(
+                "# Course, date\n"
+                "https://org.github.io/2000-01-03-bham 2000-01-01\n"
+                "\n"
+                "https://github.com/org/2000-02-07-bham  5 February 2000\n"
+            )
+            manifest.flush()
+            self.assertEqual(
+                freeze.read_manifest(manifest.name),
+                [
+                    (
+                        'https://org.github.io/2000-01-03-bham',
+                        datetime.date(2000, 1, 1)
+                    ),
+                    (
+                        'https://github.com/org/2000-02-07-bham',
+                        datetime.date(2000, 2, 5)
+                    ),
+                ]
+            )
+
+    def test_read_manifest_invalid(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.txt') as manifest:
+            manifest.write("https://org.github.io/2000-01-03-bham\n")
+            manifest.flush()
+            with self.assertRaises(RuntimeError):
+                freeze.read_manifest(manifest.name)
+
+    def test_read_manifest_invalid_date(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.txt') as manifest:
+            manifest.write("https://org.github.io/2000-01-03-bham never\n")
+            manifest.flush()
+            with self.assertRaises(RuntimeError):
+                freeze.read_manifest(manifest.name)
+
+
+class ParseDateTest(unittest.TestCase):
+    def setUp(self):
+        freeze._parse_date.cache_clear()
+        self.addCleanup(freeze._parse_date.cache_clear)
+
+    def test_iso_date(self):
+        with unittest.mock.patch.object(freeze, 'dateparser') as mock_parser:
+            self.assertEqual(
+                freeze._parse_date('2000-01-03'), datetime.date(2000, 1, 3)
+            )
+        mock_parser.parse.assert_not_called()
+
+    def test_free_form_date(self):
+        self.assertEqual(
+            freeze._parse_date('3 January 2000'), datetime.date(2000, 1, 3)
+        )
+        self.assertIsNone(freeze._parse_date('not a date'))
+        self.assertIsNone(freeze._parse_date('2000-13-45'))
+
+    def test_cached(self):
+        with unittest.mock.patch.object(freeze, 'dateparser') as mock_parser:
+            mock_parser.parse.return_value = datetime.datetime(2000, 1, 3)
+            for _ in range(3):
+                self.assertEqual(
+                    freeze._parse_date('3 January 2000'),
+                    datetime.date(2000, 1, 3)
+                )
+        mock_parser.parse.assert_called_once_with('3 January 2000')
+
+
+def _make_source_repo(path, commits=1):
+    """
+    Creates a bare repository at path with some commits on master, for
+    tests that need something real to clone.
+
+    returns:
+        the bare git.Repo
+    """
+    with tempfile.TemporaryDirectory() as workdir:
+        work = git.Repo.init(workdir, initial_branch='master')
+        with work.config_writer() as config:
+            config.set_value('user', 'name', 'Test')
+            config.set_value('user', 'email', 'test@example.tld')
+        for commit in range(commits):
+            with open(os.path.join(workdir, 'index.md'), 'w') as f:
+                f.write("---\nlayout: lesson\n---\nCommit %d\n" % commit)
+            work.index.add(['index.md'])
+            work.index.commit("Commit %d" % commit)
+        return work.clone(path, bare=True)
+
+
+class ImportTest(unittest.TestCase):
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tempdir.cleanup)
+        self.sources = []
+        for name in ('one', 'two', 'three'):
+            path = os.path.join(self._tempdir.name, name + '.git')
+            _make_source_repo(path)
+            self.sources.append(path)
+
+    def _dest(self, name):
+        path = os.path.join(self._tempdir.name, 'frozen-' + name + '.git')
+        git.Repo.init(path, bare=True)
+        return path
+
+    def _assert_imported(self, source, dest):
+        self.assertEqual(
+            git.Repo(dest).heads.master.commit.hexsha,
+            git.Repo(source).heads.master.commit.hexsha
+        )
+
+    def test_import_to(self):
+        dest = self._dest('one')
+        freeze.import_to(self.sources[0], dest)
+        self._assert_imported(self.sources[0], dest)
+
+    def test_import_through_mirror_cache(self):
+        cache = mirrorcache.MirrorCache(
+            os.path.join(self._tempdir.name, 'cache')
+        )
+        with unittest.mock.patch.object(freeze, 'mirror_cache', cache):
+            for attempt in range(2):
+                dest = self._dest('one-%d' % attempt)
+                freeze.import_to(self.sources[0], dest)
+                self._assert_imported(self.sources[0], dest)
+        self.assertTrue(os.path.isdir(cache.mirror_path(self.sources[0])))
+
+    def test_import_retried(self):
+        clone_from = git.Repo.clone_from
+        attempts = []
+        def flaky_clone(url, path, **kwargs):
+            attempts.append(url)
+            if len(attempts) == 1:
+                # Leave something behind, as a failed clone might
+                with open(os.path.join(path, 'partial'), 'w'):
+                    pass
+                raise git.GitCommandError(
+                    ['git', 'clone'], 128, stderr='fatal: early EOF'
+                )
+            return clone_from(url, path, **kwargs)
+        dest = self._dest('one')
+        with unittest.mock.patch.object(
+            freeze, 'retry_policy', retry.RetryPolicy(sleep=lambda _: None)
+        ), unittest.mock.patch.object(
+            git.Repo, 'clone_from', side_effect=flaky_clone
+        ), self.assertLogs(retry.logger, 'WARNING'):
+            freeze.import_to(self.sources[0], dest)
+        self.assertEqual(len(attempts), 2)
+        self._assert_imported(self.sources[0], dest)
+
+    def test_import_missing_not_retried(self):
+        with self.assertNoLogs(retry.logger, 'WARNING'):
+            with self.assertRaises(git.GitCommandError):
+                freeze.import_to(
+                    os.path.join(self._tempdir.name, 'missing.git'),
+                    self._dest('missing')
+                )
+
+    def test_prefetched_import(self):
+        prefetcher = freeze.Prefetcher(1)
+        with unittest.mock.patch.object(freeze, 'prefetcher', prefetcher):
+            for source in self.sources:
+                prefetcher.prefetch(source)
+            # Something never imported must not block the pipeline
+            prefetcher.discard(self.sources[1])
+            for source in (self.sources[0], self.sources[2]):
+                dest = self._dest(os.path.basename(source))
+                freeze.import_to(source, dest)
+                self._assert_imported(source, dest)
+            prefetcher.shutdown()
+
+    def test_prefetch_overlaps_push(self):
+        fetch_started = {source: threading.Event() for source in self.sources}
+        fetch_bare = freeze._fetch_bare
+        def fetch(source):
+            fetch_started[source].set()
+            return fetch_bare(source)
+        push = freeze._push
+        overlapped = []
+        def push_waiting(repo, **kwargs):
+            # The next lesson should be fetched while this one is pushed
+            following = self.sources[len(overlapped) + 1:]
+            if following:
+                overlapped.append(fetch_started[following[0]].wait(5))
+            push(repo, **kwargs)
+
+        prefetcher = freeze.Prefetcher(1)
+        with unittest.mock.patch.object(
+            freeze, 'prefetcher', prefetcher
+        ), unittest.mock.patch.object(
+            freeze, '_fetch_bare', fetch
+        ), unittest.mock.patch.object(freeze, '_push', push_waiting):
+            for source in self.sources:
+                prefetcher.prefetch(source)
+            for source in self.sources:
+                dest = self._dest(os.path.basename(source))
+                freeze.import_to(source, dest)
+                self._assert_imported(source, dest)
+            prefetcher.shutdown()
+        self.assertEqual(overlapped, [True, True])
+
+    def test_prefetch_jobs(self):
+        # As many fetches at once as repositories pushed at once
+        fetch_started = {source: threading.Event() for source in self.sources}
+        fetch_bare = freeze._fetch_bare
+        concurrent = []
+        def fetch(source):
+            fetch_started[source].set()
+            if source == self.sources[0]:
+                concurrent.append(fetch_started[self.sources[1]].wait(5))
+            return fetch_bare(source)
+
+        prefetcher = freeze.Prefetcher(0, jobs=2)
+        with unittest.mock.patch.object(freeze, '_fetch_bare', fetch):
+            for source in self.sources[:2]:
+                prefetcher.prefetch(source)
+            for source in self.sources[:2]:
+                prefetcher.release(prefetcher.take(source))
+            prefetcher.shutdown()
+        self.assertEqual(concurrent, [True])
+
+
+class FakeGithubTestCase(unittest.TestCase):
+    """
+    Base for tests that run freeze against a fakegithub.FakeGithub.
+    """
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tempdir.cleanup)
+        self.fake = fakegithub.FakeGithub(
+            os.path.join(self._tempdir.name, 'github')
+        )
+        self.fake.start()
+        self.addCleanup(self.fake.stop)
+        importlib.reload(freeze)
+        self.addCleanup(importlib.reload, freeze)
+        freeze.settings = {
+            'github': {
+                'accesstoken': '12345',
+                'baseurl': self.fake.base_url,
+                # No need to go easy on the fake
+                'requestrate': '1000',
+                'writeinterval': '0',
+            }
+        }
+        freeze.journal_file = os.path.join(self._tempdir.name, 'journal.jsonl')
+        environment = unittest.mock.patch.dict(
+            os.environ,
+            self.fake.git_environment(
+                ('https://github.com/', 'https://12345@github.com/')
+            )
+        )
+        environment.start()
+        self.addCleanup(environment.stop)
+
+    def add_lesson(self, name, default_branch='master', **attributes):
+        """
+        Adds a lesson repository (with an index.md) to the fake.
+        """
+        source = os.path.join(self._tempdir.name, name + '.git')
+        _make_source_repo(source).git.branch('-m', 'master', default_branch)
+        self.fake.add_repo(
+            'org', name, source=source, default_branch=default_branch,
+            **attributes
+        )
+
+    def add_course(self, name, lessons, **attributes):
+        """
+        Adds a course repository to the fake, with a schedule linking to
+        the github.io pages of each of lessons.
+        """
+        with tempfile.TemporaryDirectory() as workdir:
+            work = git.Repo.init(workdir, initial_branch='gh-pages')
+            with work.config_writer() as config:
+                config.set_value('user', 'name', 'Test')
+                config.set_value('user', 'email', 'test@example.tld')
+            schedule = os.path.join(
+                workdir, freeze._get_schedule_file_relative_path()
+            )
+            os.makedirs(os.path.dirname(schedule))
+            with open(schedule, 'w') as f:
+                for lesson in lessons:
+                    f.write(
+                        '<p><a href="https://org.github.io/%s/">%s</a></p>\n'
+                        % (lesson, lesson)
+                    )
+            with open(os.path.join(workdir, 'index.md'), 'w') as f:
+                f.write("---\nlayout: workshop\n---\n")
+            with open(os.path.join(workdir, 'image.png'), 'wb') as f:
+                f.write(os.urandom(64 * 1024))
+            work.index.add([
+                freeze._get_schedule_file_relative_path(),
+                'index.md',
+                'image.png'
+            ])
+            work.index.commit("Initial course")
+            self.fake.add_repo(
+                'org', name, source=workdir, default_branch='gh-pages',
+                **attributes
+            )
+
+
+class DoFreezeTest(FakeGithubTestCase):
+    course = '2000-01-03-bham'
+
+    def setUp(self):
+        super().setUp()
+        freeze.freeze_date = datetime.date(2000, 1, 1)
+        freeze.repository = 'https://github.com/org/%s' % self.course
+        self.add_lesson('shell', 'gh-pages')
+        self.add_lesson('python', 'gh-pages')
+        self.add_course(
+            self.course, ['shell', 'python', 'shell'],
+            homepage='https://org.github.io/%s' % self.course
+        )
+
+    def _check_course(self):
+        course = git.Repo(self.fake.repo_path('org', self.course))
+        self.assertEqual(
+            course.git.show(
+                'gh-pages:' + freeze._get_schedule_file_relative_path()
+            ),
+            '<p><a href="https://org.github.io/2000-01-01-bham_shell">shell</a></p>\n'
+            '<p><a href="https://org.github.io/2000-01-01-bham_python">python</a></p>\n'
+            '<p><a href="https://org.github.io/2000-01-01-bham_shell">shell</a></p>'
+        )
+        self.assertEqual(
+            course.git.show('gh-pages:index.md', strip_newline_in_stdout=False),
+            "---\nlayout: workshop\n---\n\n"
+        )
+        # Nothing else lost from the course
+        self.assertEqual(
+            sorted(course.git.ls_tree(
+                '-r', '--name-only', 'gh-pages'
+            ).splitlines()),
+            [
+                '_includes/swc/schedule.html', 'image.png', 'index.md'
+            ]
+        )
+        for lesson in ('shell', 'python'):
+            self.assertIn(
+                '2000-01-01-bham_' + lesson, self.fake.organisations['org']
+            )
+
+    def test_do_freeze(self):
+        freeze.do_freeze(freeze.repository)
+        self._check_course()
+
+    def test_do_freeze_shallow_course(self):
+        freeze.shallow_course = True
+        freeze.do_freeze(freeze.repository)
+        self._check_course()
+
+    def test_do_batch_freeze(self):
+        other_course = '2000-02-07-bham'
+        self.add_course(
+            other_course, ['python'],
+            homepage='https://org.github.io/%s' % other_course
+        )
+        freeze.do_batch_freeze([
+            (freeze.repository, freeze.freeze_date),
+            ('https://org.github.io/%s/' % other_course, freeze.freeze_date),
+        ])
+        self._check_course()
+        self.assertEqual(
+            git.Repo(self.fake.repo_path('org', other_course)).git.show(
+                'gh-pages:' + freeze._get_schedule_file_relative_path()
+            ),
+            '<p><a href="https://org.github.io/2000-01-01-bham_python">python</a></p>'
+        )
+        # Each lesson only frozen once
+        self.assertEqual(
+            self.fake.requests.count(('POST', '/orgs/org/repos')), 2
+        )
+        # One listing of the organisation for the whole run
+        self.assertEqual(
+            self.fake.requests.count(('GET', '/orgs/org/repos')), 1
+        )
+
+    def test_do_freeze_multiple_tokens(self):
+        freeze.settings['github']['accesstoken'] = '12345 67890'
+        environment = unittest.mock.patch.dict(
+            os.environ,
+            self.fake.git_environment((
+                'https://github.com/', 'https://12345@github.com/',
+                'https://67890@github.com/'
+            ))
+        )
+        environment.start()
+        self.addCleanup(environment.stop)
+        freeze.jobs = 2
+        with self.assertLogs(freeze.logger, 'INFO') as logs:
+            freeze.do_freeze(freeze.repository)
+        self._check_course()
+        # Both tokens used, and reported on
+        self.assertEqual(set(self.fake.requests_by_token), {'12345', '67890'})
+        for token in ('2345', '7890'):
+            self.assertTrue(
+                any('GitHub token ...%s' % token in line for line in logs.output)
+            )
+
+    def test_trace(self):
+        freeze.trace_file = os.path.join(self._tempdir.name, 'trace.json')
+        freeze.do_freeze(freeze.repository)
+        with open(freeze.trace_file) as trace_file:
+            events = json.load(trace_file)['traceEvents']
+        spans = collections.Counter(
+            event['name'] for event in events if event['ph'] == 'X'
+        )
+        for (name, count) in (
+            ('run', 1), ('read course', 1), ('clone course', 1),
+            ('find lessons', 1), ('freeze lessons', 1),
+            ('freeze lesson', 2), ('create repository', 2), ('fetch', 2),
+            ('update course', 1), ('push', 3), ('create_repo', 2)
+        ):
+            self.assertEqual(spans[name], count, msg=name)
+        self.assertEqual(
+            sorted(
+                event['args']['lesson'] for event in events
+                if event['name'] == 'freeze lesson'
+            ),
+            ['https://github.com/org/python/', 'https://github.com/org/shell/']
+        )
+
+    def test_summary(self):
+        freeze.summary_file = os.path.join(self._tempdir.name, 'summary.json')
+        with self.assertLogs(freeze.logger, 'INFO') as logs:
+            freeze.do_freeze(freeze.repository)
+        self.assertIn("INFO:freeze:Run summary:", logs.output)
+        with open(freeze.summary_file) as summary_file:
+            summary = json.load(summary_file)
+        self.assertEqual(summary['api_calls']['Organization.create_repo'], 2)
+        self.assertEqual(
+            sum(summary['api_calls'].values()), len(self.fake.requests)
+        )
+        # The course and each lesson fetched, each lesson and the course
+        # pushed
+        self.assertEqual(summary['fetches'], 3)
+        self.assertEqual(summary['pushes'], 3)
+        self.assertGreater(summary['bytes_fetched'], 0)
+        self.assertGreater(summary['bytes_pushed'], 0)
+        self.assertEqual(
+            sorted(summary['repositories']),
+            ['https://github.com/org/python/', 'https://github.com/org/shell/']
+        )
+        for size in summary['repositories'].values():
+            self.assertGreater(size['objects'], 0)
+
+    def test_regression_jobs_in_fresh_process(self):
+        # The lazily imported modules are first used by the worker
+        # threads unless something makes sure they have been imported
+        # already (freeze_test has imported git, so run freeze.py)
+        for lesson in ('git', 'markdown', 'r'):
+            self.add_lesson(lesson, 'gh-pages')
+        self.add_course(
+            '2000-01-04-bham', ['shell', 'python', 'git', 'markdown', 'r'],
+            homepage='https://org.github.io/2000-01-04-bham'
+        )
+        settings_file = os.path.join(self._tempdir.name, 'settings.ini')
+        with open(settings_file, 'w') as settings:
+            settings.write(
+                "[github]\naccesstoken = 12345\nbaseurl = %s\n"
+                "requestrate = 1000\nwriteinterval = 0\n" % self.fake.base_url
+            )
+        result = subprocess.run(
+            [
+                sys.executable,
+                os.path.join(
+                    os.path.dirname(os.path.abspath(__file__)), 'freeze.py'
+                ),
+                '--settings', settings_file,
+                '--journal', freeze.journal_file,
+                '--course-api', '--prefetch', '0', '--jobs', '4',
+                'https://github.com/org/2000-01-04-bham', '2000-01-01',
+            ],
+            capture_output=True, text=True
+        )
+        self.assertEqual(result.returncode, 0, msg=result.stderr)
+        for lesson in ('shell', 'python', 'git', 'markdown', 'r'):
+            self.assertIn(
+                '2000-01-01-bham_' + lesson, self.fake.organisations['org']
+            )
+
+    def test_journal_removed(self):
+        freeze.do_freeze(freeze.repository)
+        self.assertFalse(os.path.exists(freeze.journal_file))
+
+    def test_resume(self):
+        set_github_homepage = freeze.set_github_homepage
+        def fail_python(organisation, repo_name, homepage):
+            if repo_name.endswith('python'):
+                raise RuntimeError("Simulated failure")
+            set_github_homepage(organisation, repo_name, homepage)
+
+        with unittest.mock.patch.object(
+            freeze, 'set_github_homepage', fail_python
+        ):
+            with self.assertRaises(RuntimeError):
+                freeze.do_freeze(freeze.repository)
+        self.assertTrue(os.path.exists(freeze.journal_file))
+
+        # Must ask to resume
+        with self.assertRaises(RuntimeError):
+            freeze.do_freeze(freeze.repository)
+
+        self.fake.requests.clear()
+        freeze.carry_on = True
+        freeze.do_freeze(freeze.repository)
+        self.assertFalse(os.path.exists(freeze.journal_file))
+        # Only the failed step redone
+        self.assertNotIn(('POST', '/orgs/org/repos'), self.fake.requests)
+        self.assertEqual(
+            [
+                path for (method, path) in self.fake.requests
+                if method == 'PATCH'
+            ],
+            ['/repos/org/2000-01-01-bham_python']
+        )
+        course = git.Repo(self.fake.repo_path('org', self.course))
+        self.assertEqual(
+            course.git.show(
+                'gh-pages:' + freeze._get_schedule_file_relative_path()
+            ),
+            '<p><a href="https://org.github.io/2000-01-01-bham_shell">shell</a></p>\n'
+            '<p><a href="https://org.github.io/2000-01-01-bham_python">python</a></p>\n'
+            '<p><a href="https://org.github.io/2000-01-01-bham_shell">shell</a></p>'
+        )
+        self.assertEqual(
+            git.Repo(
+                self.fake.repo_path('org', '2000-01-01-bham_python')
+            ).heads['gh-pages'].commit.message,
+            freeze._BACKLINK_COMMIT_MESSAGE
+        )
+
+    def test_do_freeze_course_api(self):
+        freeze.course_via_api = True
+        freeze.do_freeze(freeze.repository)
+        self._check_course()
+        self.assertIn(
+            ('PATCH', '/repos/org/%s/git/refs/heads/gh-pages' % self.course),
+            self.fake.requests
+        )
+
+    def test_plan(self):
+        with self.assertLogs(freeze.logger, 'INFO'):
+            plan = freeze.do_plan([(freeze.repository, freeze.freeze_date)])
+        # Just the organisation listing and the schedule read, nothing
+        # cloned or changed
+        self.assertEqual(self.fake.requests, [
+            ('GET', '/orgs/org'),
+            ('GET', '/orgs/org/repos'),
+            (
+                'GET', '/repos/org/%s/contents/%s' % (
+                    self.course, freeze._get_schedule_file_relative_path()
+                )
+            ),
+        ])
+        self.assertEqual(freeze.run_summary.fetches, 0)
+        self.assertNotIn(
+            '2000-01-01-bham_shell', self.fake.organisations['org']
+        )
+        self.assertEqual(plan['lessons'][0], {
+            'source': 'https://github.com/org/shell/',
+            'freeze_date': '2000-01-01',
+            'course': freeze.repository,
+            'organisation': 'org',
+            'repository': '2000-01-01-bham_shell',
+            'default_branch': 'gh-pages',
+            'homepage': 'https://org.github.io/2000-01-01-bham_shell',
+            'url': 'https://org.github.io/2000-01-01-bham_shell',
+            'backlink': 'https://org.github.io/%s' % self.course,
+            'steps': [
+                'created', 'pushed', 'default branch set', 'homepage set'
+            ],
+        })
+        self.assertEqual(
+            [lesson['repository'] for lesson in plan['lessons']],
+            ['2000-01-01-bham_shell', '2000-01-01-bham_python']
+        )
+        self.assertEqual(plan['courses'], [{
+            'course': freeze.repository,
+            'freeze_date': '2000-01-01',
+            'links': {
+                'https://org.github.io/shell/':
+                    'https://org.github.io/2000-01-01-bham_shell',
+                'https://org.github.io/python/':
+                    'https://org.github.io/2000-01-01-bham_python',
+            },
+        }])
+
+    def test_plan_bad_url(self):
+        # A link in the schedule that is not to a repository
+        self.add_course(
+            '2000-01-04-bham', ['shell', 'a/b/c', 'python'],
+            homepage='https://org.github.io/2000-01-04-bham'
+        )
+        with self.assertLogs(freeze.logger, 'INFO') as logs:
+            with self.assertRaises(RuntimeError):
+                freeze.do_plan([(
+                    'https://github.com/org/2000-01-04-bham',
+                    freeze.freeze_date
+                )])
+        # Reported, and the other lessons still planned
+        self.assertIn(
+            "ERROR:freeze:PLAN - Cannot freeze https://github.com/org/a/b/c/:"
+            " Not a repository url",
+            logs.output
+        )
+        self.assertIn(
+            "INFO:freeze:PLAN - Would freeze https://github.com/org/python/"
+            " as org/2000-01-01-bham_python (created, pushed, default branch"
+            " set, homepage set)",
+            logs.output
+        )
+
+    def test_plan_existing(self):
+        self.fake.add_repo(
+            'org', '2000-01-01-bham_python', default_branch='gh-pages'
+        )
+        with self.assertLogs(freeze.logger, 'INFO') as logs:
+            with self.assertRaises(RuntimeError):
+                freeze.do_plan([(freeze.repository, freeze.freeze_date)])
+        self.assertIn(
+            "ERROR:freeze:PLAN - Cannot freeze https://github.com/org/python/"
+            " as org/2000-01-01-bham_python: Frozen repository already"
+            " exists",
+            logs.output
+        )
+
+        # Used as it is when continuing
+        freeze.carry_on = True
+        with self.assertLogs(freeze.logger, 'INFO'):
+            plan = freeze.do_plan([(freeze.repository, freeze.freeze_date)])
+        self.assertEqual(plan['lessons'][1]['steps'], [])
+        self.assertEqual(
+            plan['courses'][0]['links']['https://org.github.io/python/'],
+            'https://org.github.io/2000-01-01-bham_python'
+        )
+
+    def test_plan_reuse_snapshots(self):
+        freeze.freeze(
+            'https://github.com/org/python/', freeze.freeze_date,
+            course_repository=freeze.repository
+        )
+        freeze.reuse_snapshots = True
+        with self.assertLogs(freeze.logger, 'INFO'):
+            plan = freeze.do_plan(
+                [(freeze.repository, datetime.date(2000, 2, 1))]
+            )
+        self.assertEqual(
+            [lesson.get('snapshot') for lesson in plan['lessons']],
+            [None, '2000-01-01-bham_python']
+        )
+        self.assertEqual(plan['lessons'][1]['steps'], [])
+        self.assertEqual(
+            plan['courses'][0]['links']['https://org.github.io/python/'],
+            'https://org.github.io/2000-01-01-bham_python'
+        )
+
+    def test_plan_apply(self):
+        freeze.plan_file = os.path.join(self._tempdir.name, 'plan.json')
+        freeze.jobs = 2
+        with self.assertLogs(freeze.logger, 'INFO'):
+            freeze.do_plan([(freeze.repository, freeze.freeze_date)])
+        plan = freeze.read_plan(freeze.plan_file)
+        self.assertEqual(
+            [lesson['repository'] for lesson in plan['lessons']],
+            ['2000-01-01-bham_shell', '2000-01-01-bham_python']
+        )
+        with self.assertLogs(freeze.logger, 'INFO'):
+            freeze.apply_plan(plan)
+        self._check_course()
+        self.assertEqual(
+            self.fake.requests.count(('POST', '/orgs/org/repos')), 2
+        )
+        self.assertFalse(os.path.exists(freeze.journal_file))
+
+    def test_apply_out_of_date(self):
+        with self.assertLogs(freeze.logger, 'INFO'):
+            plan = freeze.do_plan([(freeze.repository, freeze.freeze_date)])
+        self.fake.organisations['org']['python']['default_branch'] = 'master'
+        with self.assertLogs(freeze.logger, 'ERROR'):
+            with self.assertRaises(RuntimeError):
+                freeze.apply_plan(plan)
+        self.assertNotIn(('POST', '/orgs/org/repos'), self.fake.requests)
+
+    def test_apply_plan_with_errors(self):
+        with self.assertLogs(freeze.logger, 'INFO'):
+            plan = freeze.do_plan([(freeze.repository, freeze.freeze_date)])
+        plan['lessons'][0]['error'] = "Frozen repository already exists"
+        with self.assertLogs(freeze.logger, 'ERROR'):
+            with self.assertRaises(RuntimeError):
+                freeze.apply_plan(plan)
+        self.assertEqual(
+            {method for (method, path) in self.fake.requests}, {'GET'}
+        )
+
+
+class MirrorBackendTest(FakeGithubTestCase):
+    def setUp(self):
+        super().setUp()
+        freeze.repository = 'https://github.com/org/2000-01-03-bham'
+        self.fake.add_repo(
+            'org', '2000-01-03-bham',
+            homepage='https://org.github.io/2000-01-03-bham'
+        )
+
+    def test_freeze_mirror(self):
+        self.add_lesson('lesson')
+        self.assertEqual(
+            freeze.freeze(
+                'https://github.com/org/lesson', datetime.date(2000, 1, 1)
+            ),
+            'file://' + os.path.abspath(
+                self.fake.repo_path('org', '2000-01-01-bham_lesson')
+            )[:-4]
+        )
+        self.assertEqual(
+            git.Repo(
+                self.fake.repo_path('org', '2000-01-01-bham_lesson')
+            ).heads.master.commit,
+            git.Repo(self.fake.repo_path('org', 'lesson')).heads.master.commit
+        )
+
+    def test_freeze_rate_limited(self):
+        self.add_lesson('lesson')
+        self.fake.throttle(count=2)
+        with self.assertLogs(freeze.apischeduler.logger, 'WARNING'):
+            freeze.freeze(
+                'https://github.com/org/lesson', datetime.date(2000, 1, 1)
+            )
+        self.assertIn('2000-01-01-bham_lesson', self.fake.organisations['org'])
+        self.assertEqual(freeze._get_github_client().scheduler.limit, 5000)
+
+    def test_freeze_server_error(self):
+        self.add_lesson('lesson')
+        freeze.retry_policy = retry.RetryPolicy(sleep=lambda _: None)
+        # The repository is created, but we are told it failed
+        self.fake.fail('POST', handled=True)
+        with self.assertLogs(retry.logger, 'WARNING'):
+            freeze.freeze(
+                'https://github.com/org/lesson', datetime.date(2000, 1, 1)
+            )
+        # Found, rather than trying to create it again
+        self.assertEqual(
+            self.fake.requests.count(('POST', '/orgs/org/repos')), 1
+        )
+        self.assertEqual(
+            git.Repo(
+                self.fake.repo_path('org', '2000-01-01-bham_lesson')
+            ).heads.master.commit,
+            git.Repo(self.fake.repo_path('org', 'lesson')).heads.master.commit
+        )
+
+    def test_freeze_existing(self):
+        self.add_lesson('lesson', 'gh-pages')
+        self.fake.add_repo('org', '2000-01-01-bham_lesson')
+        with self.assertRaises(RuntimeError):
+            freeze.freeze(
+                'https://github.com/org/lesson', datetime.date(2000, 1, 1)
+            )
+        # Found from the listing, without trying to create it
+        self.assertNotIn(('POST', '/orgs/org/repos'), self.fake.requests)
+
+        # Used as it is with --continue
+        freeze.carry_on = True
+        self.assertEqual(
+            freeze.freeze(
+                'https://github.com/org/lesson', datetime.date(2000, 1, 1)
+            ),
+            'https://org.github.io/2000-01-01-bham_lesson'
+        )
+        self.assertNotIn(('POST', '/orgs/org/repos'), self.fake.requests)
+        self.assertNotIn(
+            ('PATCH', '/repos/org/2000-01-01-bham_lesson'), self.fake.requests
+        )
+
+    def test_freeze_mirror_gh_pages(self):
+        self.add_lesson('lesson', 'gh-pages')
+        self.assertEqual(
+            freeze.freeze(
+                'https://github.com/org/lesson', datetime.date(2000, 1, 1)
+            ),
+            'https://org.github.io/2000-01-01-bham_lesson'
+        )
+        frozen = git.Repo(
+            self.fake.repo_path('org', '2000-01-01-bham_lesson')
+        )
+        original = git.Repo(self.fake.repo_path('org', 'lesson'))
+        # Back link committed on top of the original history
+        self.assertEqual(
+            frozen.heads['gh-pages'].commit.parents,
+            (original.heads['gh-pages'].commit,)
+        )
+        self.assertEqual(
+            frozen.git.show('gh-pages:index.md'),
+            "---\nlayout: lesson\n---\n"
+            "This is the version taught at the"
+            " [Software carpentries](https://org.github.io/2000-01-03-bham)"
+            " workshop beginning on Monday 03 January 2000.\n"
+            "Commit 0"
+        )
+        self.assertEqual(
+            self.fake.organisations['org']['2000-01-01-bham_lesson']['homepage'],
+            'https://org.github.io/2000-01-01-bham_lesson'
+        )
+
+    def test_freeze_reuses_unchanged(self):
+        self.add_lesson('lesson')
+        first = freeze.freeze(
+            'https://github.com/org/lesson', datetime.date(2000, 1, 1)
+        )
+        freeze.reuse_snapshots = True
+        with self.assertLogs(freeze.logger, 'INFO'):
+            self.assertEqual(
+                freeze.freeze(
+                    'https://github.com/org/lesson', datetime.date(2000, 2, 1)
+                ),
+                first
+            )
+        self.assertNotIn(
+            '2000-02-01-bham_lesson', self.fake.organisations['org']
+        )
+
+        # Changed since, so frozen again
+        git.Repo(self.fake.repo_path('org', 'lesson')).git.tag('v1')
+        freeze.freeze(
+            'https://github.com/org/lesson', datetime.date(2000, 3, 1)
+        )
+        self.assertIn('2000-03-01-bham_lesson', self.fake.organisations['org'])
+        self.assertEqual(
+            self.fake.requests.count(('POST', '/orgs/org/repos')), 2
+        )
+
+    def test_freeze_reuse_only_latest(self):
+        # An old copy that matches, behind a newer one that doesn't
+        self.add_lesson('lesson')
+        freeze.freeze(
+            'https://github.com/org/lesson', datetime.date(2000, 1, 1)
+        )
+        self.fake.add_repo('org', '2000-02-01-bham_lesson')
+        # As a new run would, see it
+        freeze._forget_github_repos()
+        freeze.reuse_snapshots = True
+        remote_refs = unittest.mock.Mock(wraps=freeze._remote_refs)
+        with unittest.mock.patch.object(freeze, '_remote_refs', remote_refs):
+            freeze.freeze(
+                'https://github.com/org/lesson', datetime.date(2000, 3, 1)
+            )
+        # Only the latest copy compared, and not matching it is frozen
+        # again, rather than reverting to the old copy
+        self.assertEqual(
+            remote_refs.call_args_list,
+            [
+                unittest.mock.call('org', 'lesson'),
+                unittest.mock.call('org', '2000-02-01-bham_lesson'),
+            ]
+        )
+        self.assertIn('2000-03-01-bham_lesson', self.fake.organisations['org'])
+
+    def test_freeze_reuses_unchanged_gh_pages(self):
+        self.add_lesson('lesson', 'gh-pages')
+        freeze.freeze(
+            'https://github.com/org/lesson', datetime.date(2000, 1, 1)
+        )
+        freeze.reuse_snapshots = True
+        # The back link committed to the frozen copy is allowed for
+        with self.assertLogs(freeze.logger, 'INFO'):
+            self.assertEqual(
+                freeze.freeze(
+                    'https://github.com/org/lesson', datetime.date(2000, 2, 1)
+                ),
+                'https://org.github.io/2000-01-01-bham_lesson'
+            )
+        self.assertNotIn(
+            '2000-02-01-bham_lesson', self.fake.organisations['org']
+        )
+
+
+class TemplateBackendTest(FakeGithubTestCase):
+    def setUp(self):
+        super().setUp()
+        freeze.backend = 'template'
+        freeze.repository = 'https://github.com/org/2000-01-03-bham'
+        self.fake.add_repo(
+            'org', '2000-01-03-bham',
+            homepage='https://org.github.io/2000-01-03-bham'
+        )
+
+    def test_freeze_template(self):
+        self.add_lesson('lesson', is_template=True)
+        self.assertEqual(
+            freeze.freeze(
+                'https://github.com/org/lesson', datetime.date(2000, 1, 1)
+            ),
+            'file://' + os.path.abspath(
+                self.fake.repo_path('org', '2000-01-01-bham_lesson')
+            )[:-4]
+        )
+        self.assertNotIn(('POST', '/orgs/org/repos'), self.fake.requests)
+
+    def test_freeze_template_gh_pages(self):
+        self.add_lesson('lesson', 'gh-pages', is_template=True)
+        self.assertEqual(
+            freeze.freeze(
+                'https://org.github.io/lesson', datetime.date(2000, 1, 1)
+            ),
+            'https://org.github.io/2000-01-01-bham_lesson'
+        )
+        frozen = self.fake.organisations['org']['2000-01-01-bham_lesson']
+        self.assertEqual(frozen['default_branch'], 'gh-pages')
+        self.assertEqual(
+            frozen['homepage'], 'https://org.github.io/2000-01-01-bham_lesson'
+        )
+        index = git.Repo(
+            self.fake.repo_path('org', '2000-01-01-bham_lesson')
+        ).git.show('gh-pages:index.md')
+        self.assertIn(
+            "[Software carpentries](https://org.github.io/2000-01-03-bham)"
+            " workshop beginning on Monday 03 January 2000.",
+            index
+        )
+
+    def test_freeze_template_copied_late(self):
+        self.add_lesson('lesson', 'gh-pages', is_template=True)
+        self.fake.copy_templates_late(listings=2)
+        freeze.template_poll_interval = 0
+        self.assertEqual(
+            freeze.freeze(
+                'https://org.github.io/lesson', datetime.date(2000, 1, 1)
+            ),
+            'https://org.github.io/2000-01-01-bham_lesson'
+        )
+        self.assertEqual(
+            self.fake.requests.count(
+                ('GET', '/repos/org/2000-01-01-bham_lesson/branches')
+            ),
+            3
+        )
+        frozen = self.fake.organisations['org']['2000-01-01-bham_lesson']
+        self.assertEqual(frozen['default_branch'], 'gh-pages')
+        index = git.Repo(
+            self.fake.repo_path('org', '2000-01-01-bham_lesson')
+        ).git.show('gh-pages:index.md')
+        self.assertIn("https://org.github.io/2000-01-03-bham", index)
+
+    def test_freeze_template_not_copied(self):
+        self.add_lesson('lesson', 'gh-pages', is_template=True)
+        self.fake.copy_templates_late(listings=1000)
+        freeze.template_copy_timeout = 0.1
+        freeze.template_poll_interval = 0.01
+        with self.assertRaises(RuntimeError):
+            freeze.freeze(
+                'https://org.github.io/lesson', datetime.date(2000, 1, 1)
+            )
+        self.assertNotIn(
+            ('PATCH', '/repos/org/2000-01-01-bham_lesson'), self.fake.requests
+        )
+
+    def test_freeze_not_template(self):
+        self.add_lesson('lesson')
+        with self.assertRaises(RuntimeError):
+            freeze.freeze(
+                'https://github.com/org/lesson', datetime.date(2000, 1, 1)
+            )
+
+
+class ScheduleTest(unittest.TestCase):
+    def test_rewrite_schedule(self):
+        self.assertEqual(
+            list(freeze._rewrite_schedule(
+                ['<a href="https://org.github.io/a">A</a>\n', 'Nothing\n'],
+                {'https://org.github.io/a': 'https://org.github.io/frozen_a'}
+            )),
+            ['<a href="https://org.github.io/frozen_a">A</a>\n', 'Nothing\n']
+        )
+
+    def test_rewrite_schedule_single_pass(self):
+        frozen_urls = {
+            'https://org.github.io/r': 'https://org.github.io/2000-01-01-bham_r',
+            'https://org.github.io/r-novice':
+                'https://org.github.io/2000-01-01-bham_r-novice',
+            # Would rewrite the output of the first mapping if applied
+            # one after the other
+            'https://org.github.io/2000-01-01-bham_r': 'https://wrong.tld',
+        }
+        self.assertEqual(
+            list(freeze._rewrite_schedule(
+                [
+                    '<a href="https://org.github.io/r">R</a>'
+                    ' <a href="https://org.github.io/r-novice">R</a>\n'
+                ],
+                frozen_urls
+            )),
+            [
+                '<a href="https://org.github.io/2000-01-01-bham_r">R</a>'
+                ' <a href="https://org.github.io/2000-01-01-bham_r-novice">R</a>\n'
+            ]
+        )
+        self.assertEqual(list(freeze._rewrite_schedule(['a\n'], {})), ['a\n'])
+
+    def test_regression_touch_index_unchanged(self):
+        # Lines from readlines() keep their line endings, so the index
+        # was never actually changed.
+        self.assertEqual(
+            list(freeze._touch_index(['---\n', '---\n'])),
+            ['---\n', '---\n', '\n']
+        )
+        self.assertEqual(
+            list(freeze._touch_index(['---\n', '---\n', '\n', '\n'])),
+            ['---\n', '---\n', '\n']
+        )
+
+    def test_touch_index_short(self):
+        self.assertEqual(list(freeze._touch_index([])), ['\n'])
+        self.assertEqual(list(freeze._touch_index(['\n'])), ['\n', '\n'])
+        self.assertEqual(list(freeze._touch_index(['\n', '\n'])), ['\n'])
+
+    def test_add_backlink(self):
+        self.assertEqual(
+            list(freeze._add_backlink(
+                ['---\n', 'layout: lesson\n', '---\n', 'Text\n'],
+                'https://example.com', datetime.date(2000, 1, 3)
+            )),
+            [
+                '---\n', 'layout: lesson\n', '---\n',
+                'This is the version taught at the [Software carpentries]'
+                '(https://example.com) workshop beginning on Monday 03'
+                ' January 2000.\n',
+                'Text\n'
+            ]
+        )
+
+
+class TransformFileTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'file.txt')
+        with open(self.path, 'w') as f:
+            f.write('one\ntwo\n')
+        os.chmod(self.path, 0o755)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _read(self):
+        with open(self.path) as f:
+            return f.read()
+
+    def test_transform(self):
+        freeze._transform_file(
+            self.path, lambda lines: (line.upper() for line in lines)
+        )
+        self.assertEqual(self._read(), 'ONE\nTWO\n')
+        # Mode is kept (git tracks the executable bit)
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o755)
+        self.assertEqual(os.listdir(self.tempdir), ['file.txt'])
+
+    def test_failure_leaves_original(self):
+        def transform(lines):
+            yield next(lines).upper()
+            raise ValueError("Failed part way through")
+
+        with self.assertRaises(ValueError):
+            freeze._transform_file(self.path, transform)
+        self.assertEqual(self._read(), 'one\ntwo\n')
+        self.assertEqual(os.listdir(self.tempdir), ['file.txt'])
+
+    def test_streams(self):
+        # The transform sees the lines as they are read, not a list
+        seen = []
+        def transform(lines):
+            self.assertNotIsInstance(lines, list)
+            for line in lines:
+                seen.append(line)
+                yield line
+        freeze._transform_file(self.path, transform)
+        self.assertEqual(seen, ['one\n', 'two\n'])
 
 
 class UrlTest(unittest.TestCase):
@@ -295,8 +1589,105 @@ class UrlTest(unittest.TestCase):
         # Tear-down - delete dummy schedule (mainly to ensure file doesn't interfere with other tests - directories will be cleaned up by fixture (class-level) tear-down)
         os.remove(os.path.join(self._tmprepodir, schedule_path))
 
+    def test_iter_schedule_links(self):
+        schedule = [
+            '<p><a class="lesson"\n',
+            '   href="https://org.github.io/shell/">Shell</a>',
+            " <a target='_blank' href='https://github.com/org/git'>Git</a>",
+            ' <a href=https://org.github.io/r?x=1&amp;y=2>R</a>',
+            ' <a name="anchor">No link</a> <link href="https://x.tld/a.css">',
+            ' <!-- <a href="https://org.github.io/old">Old</a> -->\n',
+        ]
+        expected = [
+            ('https://org.github.io/shell/', 'https://github.com/org/shell/'),
+            ('https://github.com/org/git', 'https://github.com/org/git'),
+            ('https://org.github.io/r?x=1&amp;y=2', 'https://github.com/org/r?x=1&y=2'),
+        ]
+        self.assertEqual(list(freeze.iter_schedule_links(schedule)), expected)
+        # Chunk boundaries anywhere make no difference
+        text = ''.join(schedule)
+        for size in (1, 7, 50):
+            self.assertEqual(
+                list(freeze.iter_schedule_links(
+                    text[start:start + size]
+                    for start in range(0, len(text), size)
+                )),
+                expected
+            )
+
     def test_regression_github_io_urls_fail(self):
         freeze.load_settings()
         freeze.dry_run = True # Don't want it changing anything
         # This should not throw an exception, unless this bug has regressed
         freeze.do_freeze("https://bham-carpentries.github.io/2019-02-11-bham/")
+
+
+class GithubCacheTest(unittest.TestCase):
+    def setUp(self):
+        importlib.reload(freeze)
+        freeze.settings = {'github': {'accesstoken': '12345'}}
+        patcher = unittest.mock.patch('github.Github')
+        self.mock_github = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mock_github.return_value.requester.rate_limiting = (-1, -1)
+
+    def tearDown(self):
+        importlib.reload(freeze)
+
+    def test_single_instance(self):
+        self.assertIs(
+            freeze._get_github_instance(), freeze._get_github_instance()
+        )
+        self.mock_github.assert_called_once()
+
+    def test_repo_lookups_are_cached(self):
+        gh = self.mock_github.return_value
+        freeze.github_default_branch('org', 'repo')
+        freeze.get_github_homepage('org', 'repo')
+        freeze.github_default_branch('org', 'other-repo')
+        gh.get_organization.assert_called_once_with('org')
+        self.assertEqual(
+            gh.get_organization.return_value.get_repo.call_count, 2
+        )
+
+    def test_edit_invalidates_cache(self):
+        org = self.mock_github.return_value.get_organization.return_value
+        freeze.get_github_homepage('org', 'repo')
+        freeze.set_github_homepage('org', 'repo', 'https://example.tld')
+        org.get_repo.return_value.edit.assert_called_once_with(
+            homepage='https://example.tld'
+        )
+        freeze.get_github_homepage('org', 'repo')
+        self.assertEqual(org.get_repo.call_count, 2)
+
+    def test_lease_most_quota(self):
+        freeze.settings['github']['accesstoken'] = 'aaaa, bbbb, cccc'
+        (first, second, third) = freeze._get_github_clients()
+        self.assertIs(freeze._get_github_client(), first)
+        first.scheduler.remaining = 100
+        second.scheduler.remaining = 4000
+        third.scheduler.remaining = 3000
+        with freeze._lease_github_client() as client:
+            self.assertIs(client, second)
+            self.assertIs(freeze._get_github_client(), second)
+            self.assertEqual(freeze._add_access_token(
+                'https://github.com/org/repo'
+            ), 'https://bbbb@github.com/org/repo')
+            # Nested leases keep the same client
+            with freeze._lease_github_client() as nested:
+                self.assertIs(nested, second)
+        self.assertIs(freeze._get_github_client(), first)
+        # Allows for the calls leases being used will make
+        second.scheduler.remaining = 3005
+        second.active = 1
+        with freeze._lease_github_client() as client:
+            self.assertIs(client, third)
+        second.active = 0
+        self.assertEqual(second.leases, 1)
+        self.assertEqual(second.active, 0)
+
+    def test_created_repo_is_cached(self):
+        org = self.mock_github.return_value.get_organization.return_value
+        freeze.create_github_repo('org', 'new-repo')
+        freeze.github_default_branch('org', 'new-repo')
+        org.get_repo.assert_not_called()
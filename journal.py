@@ -0,0 +1,125 @@
+"""
+Durable on-disk record of the steps of a freeze run that have been
+completed, so an interrupted run can be resumed without redoing them.
+
+The journal is a file of JSON records, one per line, each naming the
+piece of work (e.g. the lesson and freeze date), the step done and
+anything needed to carry on from it (e.g. the url of the repository
+created).  Records are only ever appended and each is flushed to disk
+before the step is considered done, so after a crash the journal is at
+worst missing the step that was in progress (or has half a record at
+the end, which is ignored).
+"""
+
+# Core modules
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+class Journal:
+    """
+    Journal of completed steps, keyed by (work key, step name).
+    """
+    def __init__(self, path, resume=False):
+        """
+        args:
+            path: file to keep the journal in
+            resume: if True, carry on from the steps already in the
+                journal (if there is one), otherwise start a new journal
+                (an existing one is an error, so the record of an
+                interrupted run is not thrown away by mistake)
+        """
+        self.path = path
+        self._steps = {}
+        self._lock = threading.Lock()
+        complete = True
+        if os.path.exists(path):
+            if not resume:
+                logger.error(
+                    "Journal %s exists from an earlier run that did not"
+                    " finish - resume it with --continue or remove it",
+                    path
+                )
+                raise RuntimeError("Journal already exists")
+            complete = self._load()
+        elif resume:
+            logger.warning("No journal found at %s, starting afresh", path)
+        self._file = open(path, 'a')
+        if not complete:
+            # Don't add to the end of a half written record
+            self._file.write('\n')
+
+    def _load(self):
+        # Returns whether the last record is complete (ends with a newline)
+        line = '\n'
+        with open(self.path) as journal_file:
+            for (number, line) in enumerate(journal_file, 1):
+                try:
+                    record = json.loads(line)
+                    self._steps[(record['key'], record['step'])] = \
+                        record.get('value')
+                except (ValueError, KeyError, TypeError):
+                    # Most likely the run died part way through writing
+                    logger.warning(
+                        "Ignoring unreadable line %d of journal %s",
+                        number, self.path
+                    )
+        logger.info(
+            "Resuming from journal %s (%d steps already done)",
+            self.path, len(self._steps)
+        )
+        return line.endswith('\n')
+
+    def done(self, key, step):
+        """
+        Has step been done for key?
+        """
+        with self._lock:
+            return (key, step) in self._steps
+
+    def value(self, key, step, default=None):
+        """
+        Returns the value recorded with step for key (default if it has
+        not been done).
+        """
+        with self._lock:
+            return self._steps.get((key, step), default)
+
+    def record(self, key, step, value=None):
+        """
+        Records step as done for key, returning once the record is on
+        disk.
+
+        args:
+            key: string identifying the piece of work
+            step: name of the step done
+            value: anything (that can be turned into JSON) needed to
+                carry on after the step
+
+        returns:
+            Nothing
+        """
+        line = json.dumps({'key': key, 'step': step, 'value': value})
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._steps[(key, step)] = value
+        logger.debug("Journalled %s of %s", step, key)
+
+    def close(self):
+        """
+        Closes the journal, leaving it on disk.
+        """
+        self._file.close()
+
+    def remove(self):
+        """
+        Closes and deletes the journal, once the run it records has
+        finished.
+        """
+        self.close()
+        os.remove(self.path)
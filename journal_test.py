@@ -0,0 +1,58 @@
+import os.path
+import tempfile
+import unittest
+
+import journal
+
+class JournalTest(unittest.TestCase):
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tempdir.cleanup)
+        self.path = os.path.join(self._tempdir.name, 'journal.jsonl')
+
+    def test_record(self):
+        run = journal.Journal(self.path)
+        self.assertFalse(run.done('lesson', 'created'))
+        self.assertEqual(run.value('lesson', 'created', 'default'), 'default')
+        run.record('lesson', 'created', 'https://github.com/org/frozen')
+        run.record('lesson', 'pushed')
+        self.assertTrue(run.done('lesson', 'created'))
+        self.assertTrue(run.done('lesson', 'pushed'))
+        self.assertFalse(run.done('other', 'pushed'))
+        self.assertEqual(
+            run.value('lesson', 'created'), 'https://github.com/org/frozen'
+        )
+        run.close()
+
+    def test_resume(self):
+        run = journal.Journal(self.path)
+        run.record('lesson', 'created', {'url': 'https://github.com/org/x'})
+        run.close()
+        # Half written record from a crash
+        with open(self.path, 'a') as f:
+            f.write('{"key": "lesson", "st')
+
+        with self.assertRaises(RuntimeError):
+            journal.Journal(self.path)
+        with self.assertLogs(journal.logger, 'WARNING'):
+            resumed = journal.Journal(self.path, resume=True)
+        self.assertEqual(
+            resumed.value('lesson', 'created'),
+            {'url': 'https://github.com/org/x'}
+        )
+        self.assertFalse(resumed.done('lesson', 'pushed'))
+        resumed.record('lesson', 'pushed')
+        resumed.close()
+
+        with self.assertLogs(journal.logger, 'WARNING'):
+            resumed = journal.Journal(self.path, resume=True)
+        self.assertTrue(resumed.done('lesson', 'pushed'))
+        resumed.remove()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_resume_without_journal(self):
+        with self.assertLogs(journal.logger, 'WARNING'):
+            run = journal.Journal(self.path, resume=True)
+        run.record('lesson', 'pushed')
+        run.close()
+        self.assertTrue(os.path.exists(self.path))
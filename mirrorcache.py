@@ -0,0 +1,191 @@
+"""
+Persistent on-disk cache of bare mirrors of remote git repositories.
+
+Mirrors are keyed by the canonical url of the repository (scheme, host
+and path, without any credentials or trailing '.git'), refreshed with an
+incremental fetch each time they are used and evicted, least recently
+used first, when the cache grows beyond its maximum size.
+
+Each mirror has a lock file next to it - it is locked exclusively while
+the mirror is created or updated and shared while in use, so several
+runs can use the same cache at once without one removing or updating a
+mirror underneath another.
+"""
+
+# Core modules
+import contextlib
+import fcntl
+import hashlib
+import logging
+import os
+import os.path
+import re
+import shutil
+import time
+import urllib.parse
+
+# Local imports
+import util
+
+# 3rd part imports (imported on first use, see util.lazy_import)
+git = util.lazy_import('git')
+
+logger = logging.getLogger(__name__)
+
+# Only branches and tags are kept (a full mirror of GitHub would also
+# bring down every pull request)
+_REFSPECS = ('+refs/heads/*:refs/heads/*', '+refs/tags/*:refs/tags/*')
+
+def parse_size(size):
+    """
+    Parses a size, such as '500M' or '2G', into a number of bytes.
+
+    args:
+        size: number of bytes, optionally followed by K, M, G or T
+            (powers of 1024)
+
+    returns:
+        size in bytes as an int
+    """
+    match = re.fullmatch(r'\s*([0-9]+)\s*([KMGT]?)B?\s*', size, re.IGNORECASE)
+    if not match:
+        raise ValueError("Invalid size: %s" % size)
+    multiplier = 1024 ** ' KMGT'.index(match.group(2).upper() or ' ')
+    return int(match.group(1)) * multiplier
+
+def canonical_url(url):
+    """
+    Returns the canonical form of a repository url used as the cache
+    key - lower case scheme and host, no user (or access token), no
+    trailing '/' or '.git'.
+
+    args:
+        url: repository url
+
+    returns:
+        canonical url string
+    """
+    parsed = urllib.parse.urlparse(url.strip())
+    netloc = parsed.netloc.rpartition('@')[2].lower()
+    path = parsed.path.rstrip('/')
+    if path.endswith('.git'):
+        path = path[:-4]
+    return urllib.parse.urlunparse(
+        (parsed.scheme.lower(), netloc, path, '', '', '')
+    )
+
+def _directory_size(path):
+    total = 0
+    for (dirpath, dirnames, filenames) in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, filename)).st_size
+            except FileNotFoundError:
+                pass
+    return total
+
+class MirrorCache:
+    """
+    A directory of bare mirrors of remote repositories.
+    """
+    def __init__(self, root, max_size=None):
+        """
+        args:
+            root: directory to keep the mirrors in (created if needed)
+            max_size: evict least recently used mirrors when the cache
+                is bigger than this many bytes (None for no limit)
+        """
+        self.root = root
+        self.max_size = max_size
+        os.makedirs(root, exist_ok=True)
+
+    def _mirror_name(self, url):
+        canonical = canonical_url(url)
+        # Keep the end of the path to make the cache browsable
+        readable = re.sub(
+            r'[^A-Za-z0-9_.-]+', '_', canonical.rsplit('/', 1)[-1]
+        )
+        digest = hashlib.sha1(canonical.encode('utf-8')).hexdigest()[:16]
+        return '%s-%s.git' % (readable, digest)
+
+    def mirror_path(self, url):
+        """
+        Returns where the mirror of url is (or would be) kept.
+        """
+        return os.path.join(self.root, self._mirror_name(url))
+
+    @contextlib.contextmanager
+    def mirror(self, url):
+        """
+        Context manager making sure an up-to-date mirror of url exists
+        and keeping it from being evicted while in use.
+
+        args:
+            url: url of the repository to mirror (used to fetch, so
+                may include credentials)
+
+        returns:
+            path to the bare mirror
+        """
+        path = self.mirror_path(url)
+        with open(path + '.lock', 'a+') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if os.path.isdir(path):
+                logger.debug("Updating cached mirror of %s in %s", url, path)
+                git.Repo(path).git.fetch(url, *_REFSPECS, prune=True)
+            else:
+                logger.debug("Creating cached mirror of %s in %s", url, path)
+                try:
+                    repo = git.Repo.clone_from(url, path, bare=True)
+                    # Don't leave any credentials lying around in the cache
+                    repo.remote('origin').set_url(canonical_url(url))
+                except BaseException:
+                    shutil.rmtree(path, ignore_errors=True)
+                    raise
+            # Record use for least recently used eviction
+            os.utime(path + '.lock')
+            # Let other users at it but stop it being evicted or updated
+            fcntl.flock(lock, fcntl.LOCK_SH)
+            yield path
+        self.evict()
+
+    def evict(self):
+        """
+        Removes least recently used mirrors (that are not in use) until
+        the cache is no bigger than max_size.
+
+        returns:
+            list of paths removed
+        """
+        if self.max_size is None:
+            return []
+
+        mirrors = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.endswith('.git') and os.path.isdir(path):
+                try:
+                    last_used = os.stat(path + '.lock').st_mtime
+                except FileNotFoundError:
+                    last_used = 0
+                mirrors.append((last_used, path, _directory_size(path)))
+        total = sum(size for (_, _, size) in mirrors)
+
+        removed = []
+        for (last_used, path, size) in sorted(mirrors):
+            if total <= self.max_size:
+                break
+            with open(path + '.lock', 'a+') as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # In use elsewhere - leave it be
+                    continue
+                logger.info(
+                    "Evicting cached mirror %s (last used %s)",
+                    path, time.ctime(last_used)
+                )
+                shutil.rmtree(path)
+                total -= size
+                removed.append(path)
+        return removed
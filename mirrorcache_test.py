@@ -0,0 +1,93 @@
+import fcntl
+import os
+import os.path
+import tempfile
+import unittest
+
+import git
+
+import mirrorcache
+
+class ParsingTest(unittest.TestCase):
+    def test_parse_size(self):
+        self.assertEqual(mirrorcache.parse_size('100'), 100)
+        self.assertEqual(mirrorcache.parse_size('2K'), 2048)
+        self.assertEqual(mirrorcache.parse_size('5G'), 5 * 1024 ** 3)
+        self.assertEqual(mirrorcache.parse_size(' 3mb '), 3 * 1024 ** 2)
+        with self.assertRaises(ValueError):
+            mirrorcache.parse_size('lots')
+
+    def test_canonical_url(self):
+        for url in (
+            'https://github.com/org/lesson',
+            'https://github.com/org/lesson/',
+            'https://GitHub.com/org/lesson.git',
+            'https://12345@github.com/org/lesson.git',
+        ):
+            self.assertEqual(
+                mirrorcache.canonical_url(url),
+                'https://github.com/org/lesson',
+                msg="Canonical form of %s is wrong" % url
+            )
+
+
+class MirrorCacheTest(unittest.TestCase):
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tempdir.cleanup)
+        self.cache = mirrorcache.MirrorCache(
+            os.path.join(self._tempdir.name, 'cache')
+        )
+
+    def _make_repo(self, name):
+        path = os.path.join(self._tempdir.name, name)
+        repo = git.Repo.init(path, initial_branch='master')
+        with repo.config_writer() as config:
+            config.set_value('user', 'name', 'Test')
+            config.set_value('user', 'email', 'test@example.tld')
+        self._commit(repo)
+        return repo
+
+    def _commit(self, repo):
+        with open(os.path.join(repo.working_tree_dir, 'file'), 'a') as f:
+            f.write('x' * 4096)
+        repo.index.add(['file'])
+        return repo.index.commit('Update')
+
+    def test_mirror_created_and_updated(self):
+        source = self._make_repo('source')
+        url = 'file://' + source.working_tree_dir
+        with self.cache.mirror(url) as path:
+            self.assertEqual(
+                git.Repo(path).heads.master.commit, source.heads.master.commit
+            )
+        new_commit = self._commit(source)
+        source.create_tag('v1')
+        with self.cache.mirror(url + '/') as path2:
+            self.assertEqual(path, path2)
+            mirror = git.Repo(path2)
+            self.assertEqual(mirror.heads.master.commit.hexsha, new_commit.hexsha)
+            self.assertIn('v1', [tag.name for tag in mirror.tags])
+
+    def test_eviction(self):
+        urls = []
+        for name in ('one', 'two', 'three'):
+            repo = self._make_repo(name)
+            urls.append('file://' + repo.working_tree_dir)
+            with self.cache.mirror(urls[-1]):
+                pass
+        paths = [self.cache.mirror_path(url) for url in urls]
+        for (path, last_used) in zip(paths, (30, 10, 20)):
+            os.utime(path + '.lock', (last_used, last_used))
+
+        size = mirrorcache._directory_size(paths[0])
+        self.cache.max_size = int(size * 2.5)
+        self.assertEqual(self.cache.evict(), [paths[1]])
+        self.assertFalse(os.path.exists(paths[1]))
+
+        # Mirrors in use elsewhere are not evicted
+        self.cache.max_size = 0
+        with open(paths[2] + '.lock') as lock:
+            fcntl.flock(lock, fcntl.LOCK_SH)
+            self.assertEqual(self.cache.evict(), [paths[0]])
+        self.assertTrue(os.path.exists(paths[2]))
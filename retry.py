@@ -0,0 +1,152 @@
+"""
+Retries network operations that fail for reasons that may go away.
+
+A long batch run makes hundreds of clones, pushes and api calls, so it
+will sooner or later meet a dropped connection or a GitHub server error.
+RetryPolicy tries such an operation again after a jittered exponential
+backoff - a random delay of up to base_delay, 2 x base_delay, 4 x
+base_delay... (capped at max_delay), so runs hitting the same trouble
+don't all retry at once - instead of letting it abort the run.
+
+Errors that will not go away by themselves (authentication failures,
+missing repositories, rejected pushes, api errors other than server
+errors) are not retried.  GitHub's rate limits are dealt with by
+apischeduler.
+"""
+
+# Core modules
+import itertools
+import logging
+import random
+import re
+import time
+
+# Local imports
+import util
+
+# 3rd part imports (imported on first use, see util.lazy_import)
+git = util.lazy_import('git')
+github = util.lazy_import('github')
+requests = util.lazy_import('requests')
+
+logger = logging.getLogger(__name__)
+
+# Git errors that retrying will not fix
+_PERMANENT_GIT_ERROR_RE = re.compile(
+    r'Authentication failed|not found|does not exist|Permission denied|'
+    r'does not appear to be a git repository|\[rejected\]|'
+    r'already exists and is not an empty directory'
+)
+
+def is_transient(error):
+    """
+    Might error go away if the operation is tried again?
+
+    args:
+        error: exception raised by the operation
+
+    returns:
+        True for network errors, GitHub server errors and git commands
+        that failed other than for one of the reasons in
+        _PERMANENT_GIT_ERROR_RE
+    """
+    if isinstance(error, git.GitCommandError):
+        return not _PERMANENT_GIT_ERROR_RE.search(str(error.stderr))
+    elif isinstance(error, github.GithubException):
+        return error.status is not None and error.status >= 500
+    return isinstance(
+        error, (requests.ConnectionError, requests.Timeout)
+    )
+
+def _describe(error):
+    # What went wrong, for the log - not the git command line, which can
+    # have an access token in
+    if isinstance(error, git.GitCommandError):
+        return "git exited with status %s" % error.status
+    return str(error)
+
+class RetryPolicy:
+    """
+    How many times, and how long apart, to try an operation.
+    """
+    def __init__(
+        self, attempts=5, base_delay=1.0, max_delay=60.0,
+        random=random.random, sleep=time.sleep
+    ):
+        """
+        args:
+            attempts: number of times to try an operation before giving
+                up (1 turns retrying off)
+            base_delay: longest wait, in seconds, before the first retry
+                (each retry after that can wait twice as long as the one
+                before)
+            max_delay: longest wait before any retry
+            random: function returning a random number in [0, 1) - for
+                testing
+            sleep: function to wait a number of seconds - for testing
+        """
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._random = random
+        self._sleep = sleep
+
+    def delay(self, attempt):
+        """
+        Returns how long to wait after attempt number attempt (counting
+        from 1) failed.
+        """
+        return self._random() * min(
+            self.max_delay, self.base_delay * 2 ** (attempt - 1)
+        )
+
+    def call(
+        self, function, *args, description=None, cleanup=None,
+        already_done=None, **kwargs
+    ):
+        """
+        Calls function, retrying it if it fails with a transient error
+        (see is_transient).
+
+        args:
+            function: function doing the operation
+            args: arguments for function
+            description: what the operation is, for the log (defaults to
+                the name of function)
+            cleanup: function to call before a retry to undo whatever a
+                failed attempt left behind (optional)
+            already_done: function to call before a retry to check
+                whether the failed attempt in fact succeeded (e.g. GitHub
+                created a repository but the connection dropped before it
+                said so), returning the operation's result if it did and
+                None otherwise (optional)
+            kwargs: keyword arguments for function
+
+        returns:
+            value returned by function (or already_done)
+        """
+        if description is None:
+            description = getattr(function, '__name__', repr(function))
+        for attempt in itertools.count(1):
+            try:
+                return function(*args, **kwargs)
+            except Exception as error:
+                if attempt >= self.attempts or not is_transient(error):
+                    raise
+                delay = self.delay(attempt)
+                logger.warning(
+                    "%s failed (%s), retrying in %.1fs (attempt %d of %d)",
+                    description, _describe(error), delay, attempt,
+                    self.attempts
+                )
+                self._sleep(delay)
+            if cleanup is not None:
+                cleanup()
+            if already_done is not None:
+                result = already_done()
+                if result is not None:
+                    logger.info(
+                        "%s succeeded after all, not trying again",
+                        description
+                    )
+                    return result
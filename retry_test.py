@@ -0,0 +1,88 @@
+import unittest
+
+import git
+import github
+import requests
+
+import retry
+
+def _transient_error():
+    return git.GitCommandError(
+        ['git', 'push'], 128, stderr='fatal: the remote end hung up'
+    )
+
+class RetryPolicyTest(unittest.TestCase):
+    def setUp(self):
+        self.sleeps = []
+        self.policy = retry.RetryPolicy(
+            attempts=4, base_delay=1, max_delay=3,
+            random=lambda: 0.5, sleep=self.sleeps.append
+        )
+
+    def _failing(self, errors, result='result'):
+        # Function raising each of errors in turn, then returning result
+        errors = list(errors)
+        def function():
+            if errors:
+                raise errors.pop(0)
+            return result
+        return function
+
+    def test_delay(self):
+        # Exponential, capped at max_delay, then jittered
+        self.assertEqual(
+            [self.policy.delay(attempt) for attempt in range(1, 5)],
+            [0.5, 1.0, 1.5, 1.5]
+        )
+
+    def test_retries_transient_errors(self):
+        function = self._failing([_transient_error(), _transient_error()])
+        with self.assertLogs(retry.logger, 'WARNING'):
+            self.assertEqual(self.policy.call(function), 'result')
+        self.assertEqual(self.sleeps, [0.5, 1.0])
+
+    def test_gives_up(self):
+        function = self._failing([_transient_error()] * 4)
+        with self.assertLogs(retry.logger, 'WARNING'):
+            with self.assertRaises(git.GitCommandError):
+                self.policy.call(function)
+        self.assertEqual(len(self.sleeps), 3)
+
+    def test_permanent_error_not_retried(self):
+        function = self._failing([
+            github.GithubException(422, {'message': 'name already exists'})
+        ])
+        with self.assertRaises(github.GithubException):
+            self.policy.call(function)
+        self.assertEqual(self.sleeps, [])
+
+    def test_cleanup(self):
+        cleaned = []
+        function = self._failing([_transient_error()])
+        with self.assertLogs(retry.logger, 'WARNING'):
+            self.policy.call(function, cleanup=lambda: cleaned.append(True))
+        self.assertEqual(cleaned, [True])
+
+    def test_already_done(self):
+        calls = []
+        def create():
+            calls.append(True)
+            raise github.GithubException(502, {'message': 'Server Error'})
+        with self.assertLogs(retry.logger, 'INFO'):
+            self.assertEqual(
+                self.policy.call(create, already_done=lambda: 'created'),
+                'created'
+            )
+        # Not tried again once it turned out to have worked
+        self.assertEqual(len(calls), 1)
+
+    def test_is_transient(self):
+        self.assertTrue(retry.is_transient(_transient_error()))
+        self.assertTrue(retry.is_transient(requests.ConnectionError()))
+        self.assertTrue(retry.is_transient(github.GithubException(503)))
+        self.assertFalse(retry.is_transient(github.GithubException(404)))
+        self.assertFalse(retry.is_transient(git.GitCommandError(
+            ['git', 'clone'], 128,
+            stderr="fatal: repository 'https://github.com/org/x/' not found"
+        )))
+        self.assertFalse(retry.is_transient(ValueError()))
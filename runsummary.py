@@ -0,0 +1,177 @@
+"""
+Counts what a freeze run costs - GitHub api calls, git traffic and the
+size of the repositories frozen - for a summary at the end of the run,
+so the api quota and network needed for a batch can be planned.
+"""
+
+# Core modules
+import collections
+import json
+import logging
+import re
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Amount transferred at the start of a git progress message, e.g.
+# '293.23 KiB | 20.95 MiB/s'
+_TRANSFERRED_RE = re.compile(r'([0-9.]+) (bytes|KiB|MiB|GiB)\b')
+_UNITS = {'bytes': 1, 'KiB': 1024, 'MiB': 1024 ** 2, 'GiB': 1024 ** 3}
+
+class TransferCounter:
+    """
+    Progress callback for git pushes (see git.RemoteProgress) keeping
+    how many bytes git says it transferred.
+
+    N.B. Not for clones - GitPython leaves git's error messages out of
+    the exception raised when a clone with a progress callback fails.
+    Everything in a new clone was fetched, so count_objects says how
+    much that was.
+    """
+    def __init__(self):
+        self.bytes = 0
+
+    def __call__(self, op_code, cur_count, max_count=None, message=''):
+        match = _TRANSFERRED_RE.match(message or '')
+        if match:
+            self.bytes = int(float(match.group(1)) * _UNITS[match.group(2)])
+
+def count_objects(repo):
+    """
+    Returns the size of a repository.
+
+    args:
+        repo: git.Repo
+
+    returns:
+        tuple of (number of objects, bytes they take up on disk)
+    """
+    stats = dict(
+        line.split(': ', 1)
+        for line in repo.git.count_objects('-v').splitlines()
+    )
+    return (
+        int(stats['count']) + int(stats['in-pack']),
+        1024 * (int(stats['size']) + int(stats['size-pack']))
+    )
+
+def _format_bytes(size):
+    for unit in ('bytes', 'KiB', 'MiB'):
+        if size < 1024:
+            break
+        size /= 1024
+    else:
+        unit = 'GiB'
+    return ("%d %s" if unit == 'bytes' else "%.1f %s") % (size, unit)
+
+class RunSummary:
+    """
+    Counters for a run, safe to update from several threads.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.api_calls = collections.Counter()
+        self.fetches = 0
+        self.bytes_fetched = 0
+        self.pushes = 0
+        self.bytes_pushed = 0
+        # Size of each repository fetched to be frozen, by url
+        self.repositories = {}
+
+    def api_call(self, endpoint):
+        """
+        Counts a GitHub api call (e.g. endpoint 'Organization.get_repo').
+        """
+        with self._lock:
+            self.api_calls[endpoint] += 1
+
+    def fetched(self, size):
+        """
+        Counts a clone or fetch that transferred size bytes (0 if not
+        known).
+        """
+        with self._lock:
+            self.fetches += 1
+            self.bytes_fetched += size
+
+    def pushed(self, size):
+        """
+        Counts a push that transferred size bytes.
+        """
+        with self._lock:
+            self.pushes += 1
+            self.bytes_pushed += size
+
+    def repository(self, url, objects, size):
+        """
+        Records the size of a repository fetched to be frozen (see
+        count_objects).
+        """
+        with self._lock:
+            self.repositories[url] = {'objects': objects, 'bytes': size}
+
+    def as_dict(self):
+        """
+        Returns the counters as a dict (that can be turned into JSON).
+        """
+        with self._lock:
+            return {
+                'api_calls': dict(self.api_calls),
+                'fetches': self.fetches,
+                'bytes_fetched': self.bytes_fetched,
+                'pushes': self.pushes,
+                'bytes_pushed': self.bytes_pushed,
+                'repositories': dict(self.repositories),
+            }
+
+    def table(self):
+        """
+        Returns the summary as a list of lines of a table, for the log.
+        """
+        summary = self.as_dict()
+        objects = [
+            repo['objects'] for repo in summary['repositories'].values()
+        ]
+        sizes = [repo['bytes'] for repo in summary['repositories'].values()]
+        rows = [("GitHub api calls", str(sum(summary['api_calls'].values())))]
+        rows.extend(
+            ("  " + endpoint, str(count))
+            for (endpoint, count) in sorted(summary['api_calls'].items())
+        )
+        rows.extend([
+            (
+                "Git clones and fetches",
+                "%d (%s)" % (
+                    summary['fetches'], _format_bytes(summary['bytes_fetched'])
+                )
+            ),
+            (
+                "Git pushes",
+                "%d (%s)" % (
+                    summary['pushes'], _format_bytes(summary['bytes_pushed'])
+                )
+            ),
+            ("Repositories frozen", str(len(sizes))),
+            (
+                "  Objects (total, largest)",
+                "%d, %d" % (sum(objects), max(objects, default=0))
+            ),
+            (
+                "  Size (total, largest)",
+                "%s, %s" % (
+                    _format_bytes(sum(sizes)),
+                    _format_bytes(max(sizes, default=0))
+                )
+            ),
+        ])
+        width = max(len(label) for (label, _) in rows)
+        return ["%-*s  %s" % (width, label, value) for (label, value) in rows]
+
+    def write(self, path):
+        """
+        Writes the counters (as_dict) to path as JSON.
+        """
+        with open(path, 'w') as summary_file:
+            json.dump(self.as_dict(), summary_file, indent=2, sort_keys=True)
+            summary_file.write('\n')
+        logger.info("Wrote run summary to %s", path)
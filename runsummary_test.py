@@ -0,0 +1,82 @@
+import json
+import os.path
+import tempfile
+import unittest
+
+import git
+
+import runsummary
+
+class TransferCounterTest(unittest.TestCase):
+    def test_transferred(self):
+        counter = runsummary.TransferCounter()
+        counter(16, 1, 3, '')
+        self.assertEqual(counter.bytes, 0)
+        counter(16, 3, 3, '293.50 KiB | 20.95 MiB/s')
+        self.assertEqual(counter.bytes, 300544)
+        counter(16, 3, 3, '12 bytes | 12.00 KiB/s')
+        self.assertEqual(counter.bytes, 12)
+
+    def test_count_objects(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            repo = git.Repo.init(tempdir)
+            with open(os.path.join(tempdir, 'file.txt'), 'w') as f:
+                f.write("Content\n" * 1000)
+            repo.index.add(['file.txt'])
+            repo.index.commit("Commit")
+            (objects, size) = runsummary.count_objects(repo)
+        # Blob, tree and commit
+        self.assertEqual(objects, 3)
+        self.assertGreater(size, 0)
+
+
+class RunSummaryTest(unittest.TestCase):
+    def setUp(self):
+        self.summary = runsummary.RunSummary()
+        self.summary.api_call('Organization.get_repo')
+        self.summary.api_call('Organization.get_repo')
+        self.summary.api_call('Organization.create_repo')
+        self.summary.fetched(2048)
+        self.summary.pushed(3 * 1024 ** 2)
+        self.summary.repository('https://github.com/org/shell', 10, 4096)
+        self.summary.repository('https://github.com/org/python', 20, 1024)
+
+    def test_as_dict(self):
+        self.assertEqual(self.summary.as_dict(), {
+            'api_calls': {
+                'Organization.get_repo': 2, 'Organization.create_repo': 1
+            },
+            'fetches': 1,
+            'bytes_fetched': 2048,
+            'pushes': 1,
+            'bytes_pushed': 3 * 1024 ** 2,
+            'repositories': {
+                'https://github.com/org/shell': {
+                    'objects': 10, 'bytes': 4096
+                },
+                'https://github.com/org/python': {
+                    'objects': 20, 'bytes': 1024
+                },
+            },
+        })
+
+    def test_table(self):
+        self.assertEqual(self.summary.table(), [
+            "GitHub api calls            3",
+            "  Organization.create_repo  1",
+            "  Organization.get_repo     2",
+            "Git clones and fetches      1 (2.0 KiB)",
+            "Git pushes                  1 (3.0 MiB)",
+            "Repositories frozen         2",
+            "  Objects (total, largest)  30, 20",
+            "  Size (total, largest)     5.0 KiB, 4.0 KiB",
+        ])
+
+    def test_write(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            path = os.path.join(tempdir, 'summary.json')
+            self.summary.write(path)
+            with open(path) as summary_file:
+                self.assertEqual(
+                    json.load(summary_file), self.summary.as_dict()
+                )
@@ -0,0 +1,109 @@
+"""
+Timing spans for the phases of a freeze run.
+
+Each phase (cloning a course, creating a repository, pushing a lesson...)
+is wrapped in a span, which records when it started and how long it
+took.  Spans in the same thread nest, so the trace of a run shows which
+lessons, and which phases of them, took the time.  The spans can be
+written out in the Chrome trace event format - load the file in
+chrome://tracing or https://ui.perfetto.dev to see it as a timeline.
+"""
+
+# Core modules
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class Tracer:
+    """
+    Records timing spans, from any number of threads.
+    """
+    def __init__(self, clock=time.perf_counter):
+        """
+        args:
+            clock: function returning the time in seconds (as
+                time.perf_counter) - for testing
+        """
+        self._clock = clock
+        self._start = clock()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # Completed spans as Chrome trace events
+        self.events = []
+        # Thread names, by thread id
+        self._threads = {}
+
+    @contextlib.contextmanager
+    def span(self, name, category='freeze', **args):
+        """
+        Context manager timing the code it wraps as a span.
+
+        args:
+            name: name of the phase (e.g. 'push')
+            category: kind of phase (e.g. 'api' for GitHub api calls)
+            args: details to record with the span (e.g. the lesson url)
+        """
+        depth = getattr(self._local, 'depth', 0)
+        self._local.depth = depth + 1
+        start = self._clock()
+        try:
+            yield
+        except BaseException as error:
+            args['error'] = type(error).__name__
+            raise
+        finally:
+            end = self._clock()
+            self._local.depth = depth
+            thread = threading.current_thread()
+            event = {
+                'name': name,
+                'cat': category,
+                'ph': 'X',
+                'ts': (start - self._start) * 1e6,
+                'dur': (end - start) * 1e6,
+                'pid': os.getpid(),
+                'tid': thread.ident,
+                'args': args,
+            }
+            with self._lock:
+                self.events.append(event)
+                self._threads[thread.ident] = thread.name
+            logger.debug(
+                "%s%s took %.3fs %s", '  ' * depth, name, end - start, args
+            )
+
+    def write(self, path):
+        """
+        Writes the spans recorded so far to path, in the Chrome trace
+        event format.
+
+        args:
+            path: file to write
+
+        returns:
+            Nothing
+        """
+        with self._lock:
+            events = [
+                {
+                    'name': 'thread_name',
+                    'ph': 'M',
+                    'pid': os.getpid(),
+                    'tid': ident,
+                    'args': {'name': name},
+                }
+                for (ident, name) in self._threads.items()
+            ]
+            spans = sorted(self.events, key=lambda event: event['ts'])
+        events.extend(spans)
+        with open(path, 'w') as trace_file:
+            json.dump(
+                {'traceEvents': events, 'displayTimeUnit': 'ms'},
+                trace_file
+            )
+        logger.info("Wrote trace of %d spans to %s", len(spans), path)
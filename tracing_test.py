@@ -0,0 +1,71 @@
+import json
+import os.path
+import tempfile
+import threading
+import unittest
+
+import tracing
+
+class FakeClock:
+    """
+    Clock that moves a second each time it is read.
+    """
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        self.now += 1
+        return self.now
+
+
+class TracerTest(unittest.TestCase):
+    def setUp(self):
+        self.tracer = tracing.Tracer(clock=FakeClock().time)
+
+    def test_nested_spans(self):
+        with self.tracer.span('freeze lesson', lesson='shell'):
+            with self.tracer.span('get_repo', 'api'):
+                pass
+        (inner, outer) = self.tracer.events
+        self.assertEqual(
+            (outer['name'], outer['cat'], outer['ph']),
+            ('freeze lesson', 'freeze', 'X')
+        )
+        self.assertEqual(outer['args'], {'lesson': 'shell'})
+        self.assertEqual((inner['name'], inner['cat']), ('get_repo', 'api'))
+        # Times in microseconds from when the tracer was made
+        self.assertEqual((outer['ts'], outer['dur']), (1e6, 3e6))
+        self.assertEqual((inner['ts'], inner['dur']), (2e6, 1e6))
+
+    def test_error(self):
+        with self.assertRaises(ValueError):
+            with self.tracer.span('push'):
+                raise ValueError()
+        self.assertEqual(self.tracer.events[0]['args'], {'error': 'ValueError'})
+
+    def test_write(self):
+        def fetch():
+            with self.tracer.span('fetch'):
+                pass
+        with self.tracer.span('run'):
+            thread = threading.Thread(target=fetch, name='prefetcher')
+            thread.start()
+            thread.join()
+        with tempfile.TemporaryDirectory() as tempdir:
+            path = os.path.join(tempdir, 'trace.json')
+            self.tracer.write(path)
+            with open(path) as trace_file:
+                trace = json.load(trace_file)
+        events = trace['traceEvents']
+        # Thread names, then the spans in the order they started
+        self.assertEqual(
+            sorted(
+                event['args']['name'] for event in events[:2]
+                if event['ph'] == 'M'
+            ),
+            sorted(['prefetcher', threading.current_thread().name])
+        )
+        self.assertEqual(
+            [event['name'] for event in events[2:]], ['run', 'fetch']
+        )
+        self.assertNotEqual(events[2]['tid'], events[3]['tid'])
@@ -1,16 +1,87 @@
 import configparser
+import importlib.util
+import logging
+import re
+import sys
+
+logger = logging.getLogger(__name__)
+
+def split_list(value):
+	"""
+	Split a setting holding several values, separated by whitespace
+	(including new lines) or commas.
+
+	args:
+		value: the setting's value
+
+	returns:
+		list of the values
+	"""
+	return re.split(r'[\s,]+', value.strip()) if value.strip() else []
+
+# Modules imported by lazy_import (see finish_lazy_imports)
+_lazy_modules = []
+
+def lazy_import(name):
+	"""
+	Import a module when it is first used, rather than now - so that
+	slow to import modules (e.g. dateparser) don't slow down starting
+	up, e.g. for --help, if they are never needed.
+
+	The first use must not be by several threads at once (python before
+	3.12 can use the module before it has finished importing) - call
+	finish_lazy_imports before starting threads that might use it.
+
+	args:
+		name: name of the module
+
+	returns:
+		The module (or a stand-in for it that imports it when one of
+		its attributes is first used)
+	"""
+	if name in sys.modules:
+		return sys.modules[name]
+	spec = importlib.util.find_spec(name)
+	if spec is None:
+		raise ModuleNotFoundError("No module named %r" % name, name=name)
+	loader = importlib.util.LazyLoader(spec.loader)
+	spec.loader = loader
+	module = importlib.util.module_from_spec(spec)
+	sys.modules[name] = module
+	loader.exec_module(module)
+	_lazy_modules.append(module)
+	return module
+
+def finish_lazy_imports():
+	"""
+	Imports every module lazy_import has put off importing, if it has
+	not been used yet.  LazyLoader is not thread-safe, so call this
+	before starting threads that use any of them.
+
+	args:
+		None
+
+	returns:
+		Nothing
+	"""
+	for module in _lazy_modules:
+		# Using any attribute finishes the import
+		getattr(module, '__name__')
 
 def read_settings(settings_file):
 	"""
 	Read settings for the program using ConfigParser.
 
+	Settings holding several values (e.g. the access tokens) can be read
+	as lists with getlist (see split_list).
+
 	args:
 		settings_file: filename to read
 
 	returns:
 		Result from configparser of reading the settings
 	"""
-	cp = configparser.ConfigParser()
+	cp = configparser.ConfigParser(converters={'list': split_list})
 	cp.read(settings_file)
 	if not cp.sections():
 		logger.error("Unable to read any settings from '%s'.", settings_file)
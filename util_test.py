@@ -1,6 +1,8 @@
 import logging
 import os
+import sys
 import tempfile
+import types
 import unittest
 
 import util
@@ -41,3 +43,40 @@ accesstoken = 12345
 		self.assertIn('accesstoken', settings['github'])
 		self.assertEqual(settings.get('github', 'accesstoken'), '12345')
 		self.assertEqual(settings['github']['accesstoken'], '12345')
+
+
+	def test_split_list(self):
+		self.assertEqual(util.split_list('12345'), ['12345'])
+		self.assertEqual(
+			util.split_list('12345, 67890\n abcde'), ['12345', '67890', 'abcde']
+		)
+		self.assertEqual(util.split_list(' '), [])
+
+
+	def test_load_list_settings(self):
+		settings = util.read_settings(self._dummysettings)
+		self.assertEqual(settings['github'].getlist('accesstoken'), ['12345'])
+
+
+	def test_lazy_import(self):
+		# A module that nothing else here imports
+		self.assertNotIn('colorsys', sys.modules)
+		self.addCleanup(sys.modules.pop, 'colorsys', None)
+		colorsys = util.lazy_import('colorsys')
+		self.assertIs(util.lazy_import('colorsys'), colorsys)
+		self.assertEqual(colorsys.rgb_to_hsv(1, 0, 0), (0, 1, 1))
+		with self.assertRaises(ModuleNotFoundError):
+			util.lazy_import('no_such_module')
+
+	def test_finish_lazy_imports(self):
+		self.assertNotIn('colorsys', sys.modules)
+		self.addCleanup(sys.modules.pop, 'colorsys', None)
+		colorsys = util.lazy_import('colorsys')
+		self.assertIsNot(type(colorsys), types.ModuleType)
+		util.finish_lazy_imports()
+		# No longer a stand-in
+		self.assertIs(type(colorsys), types.ModuleType)
+
+	def test_regression_missing_settings_file(self):
+		with self.assertRaises(RuntimeError):
+			util.read_settings(self._dummysettings + '.missing')